@@ -0,0 +1,78 @@
+'''
+Microbenchmark for adding up many :class:`foodypy.Nutrients`, comparing the
+builtin ``sum`` against in-place addition and ``Nutrients.sum``.
+
+Run from the root of the repository with::
+
+    python -m benchmarks.bench_nutrients
+'''
+import argparse
+import random
+import timeit
+
+from foodypy import Nutrients
+
+def _make_nutrients(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        Nutrients(*(rng.uniform(0, 50) for _ in range(4)))
+        for _ in range(count)
+    ]
+
+def _sum_builtin(nutrients, weights):
+    return sum(nutrients)
+
+def _sum_inplace(nutrients, weights):
+    total = Nutrients()
+    for n in nutrients:
+        total += n
+    return total
+
+def _sum_method(nutrients, weights):
+    return Nutrients.sum(nutrients)
+
+def _weighted_sum_builtin(nutrients, weights):
+    return sum(n * w for n, w in zip(nutrients, weights))
+
+def _weighted_sum_method(nutrients, weights):
+    return Nutrients.sum(nutrients, weights)
+
+benchmarks = {
+    'sum (builtin)': _sum_builtin,
+    'sum (+= loop)': _sum_inplace,
+    'sum (Nutrients.sum)': _sum_method,
+    'weighted sum (builtin)': _weighted_sum_builtin,
+    'weighted sum (Nutrients.sum)': _weighted_sum_method,
+}
+
+def run(count=1000, repeat=5):
+    '''
+    Time each benchmark and return the best time per call, in seconds.
+    '''
+    nutrients = _make_nutrients(count)
+    weights = [random.Random(1).uniform(0, 300) for _ in range(count)]
+    results = {}
+
+    for name, func in benchmarks.items():
+        timer = timeit.Timer(lambda: func(nutrients, weights))
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat, number)) / number
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=1000,
+        help='number of Nutrients to add up')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.count, args.repeat)
+
+    for name, seconds in results.items():
+        # Speedup over the builtin version of the same operation
+        baseline = results[name.split(' (')[0] + ' (builtin)']
+        print(f'{name:<30} {seconds * 1e3:9.3f} ms  {baseline / seconds:6.1f}x')
+
+if __name__ == '__main__':
+    main()
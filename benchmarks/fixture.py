@@ -0,0 +1,128 @@
+'''
+Generates synthetic foods in the format of FoodData Central's JSON datasets,
+so that the benchmarks run offline and give the same results on every
+machine.
+'''
+import json
+import random
+import zipfile
+
+_bases = [
+    'Apples', 'Apricots', 'Asparagus', 'Avocados', 'Bananas', 'Barley',
+    'Beans, black', 'Beans, kidney', 'Beans, navy', 'Beef, ground',
+    'Beef, chuck', 'Beets', 'Blueberries', 'Bread, white', 'Bread, rye',
+    'Broccoli', 'Buckwheat', 'Butter', 'Cabbage', 'Carrots', 'Cashews',
+    'Cauliflower', 'Celery', 'Cheese, cheddar', 'Cheese, mozzarella',
+    'Cherries', 'Chicken, breast', 'Chicken, thigh', 'Chickpeas', 'Corn',
+    'Cranberries', 'Cucumber', 'Dates', 'Egg, whole', 'Egg, white',
+    'Eggplant', 'Figs', 'Garlic', 'Grapes', 'Ham', 'Kale', 'Lamb, leg',
+    'Lentils', 'Lettuce', 'Mangos', 'Milk', 'Mushrooms', 'Oats', 'Onions',
+    'Oranges', 'Pasta', 'Peaches', 'Peanuts', 'Pears', 'Peas, green',
+    'Pork, loin', 'Potatoes', 'Quinoa', 'Rice, brown', 'Rice, white',
+    'Salmon', 'Spinach', 'Strawberries', 'Sweet potatoes', 'Tofu',
+    'Tomatoes', 'Tuna', 'Turkey', 'Walnuts', 'Yogurt',
+]
+
+_qualifiers = [
+    'raw', 'fresh', 'frozen', 'canned', 'dried', 'organic', 'unsweetened',
+    'sweetened', 'low fat', 'whole', 'sliced', 'diced', 'mature seeds',
+    'immature seeds', 'lean meat only', 'with skin', 'without skin',
+    'enriched', 'unenriched', 'reduced sodium',
+]
+
+_preparations = [
+    'uncooked', 'cooked', 'boiled', 'steamed', 'baked', 'roasted', 'fried',
+    'grilled', 'braised', 'microwaved', 'stewed', 'drained', 'with salt',
+    'without salt', 'in water', 'in syrup',
+]
+
+# FDC nutrient ID, name, unit, and largest amount per 100 grams of the
+# nutrients that the synthetic foods have
+_nutrients = [
+    (1004, 'Total lipid (fat)', 'g', 40),
+    (1005, 'Carbohydrate, by difference', 'g', 80),
+    (1003, 'Protein', 'g', 35),
+    (1079, 'Fiber, total dietary', 'g', 15),
+    (2000, 'Sugars, total including NLEA', 'g', 30),
+    (1258, 'Fatty acids, total saturated', 'g', 15),
+    (1253, 'Cholesterol', 'mg', 300),
+    (1051, 'Water', 'g', 95),
+    (1093, 'Sodium, Na', 'mg', 1500),
+    (1092, 'Potassium, K', 'mg', 900),
+    (1087, 'Calcium, Ca', 'mg', 500),
+    (1089, 'Iron, Fe', 'mg', 10),
+    (1162, 'Vitamin C, total ascorbic acid', 'mg', 90),
+    (1106, 'Vitamin A, RAE', 'µg', 800),
+    (1178, 'Vitamin B-12', 'µg', 5),
+    # Not used by FoodyPy, so converting has to skip it
+    (1008, 'Energy', 'kcal', 900),
+]
+
+def make_foods_raw(count, seed=0):
+    '''
+    Make a list of synthetic foods.
+
+    Args:
+      count (int): Number of foods
+      seed (int, optional): Seed of the random number generator
+
+    Returns:
+      list[dict]:
+    '''
+    rng = random.Random(seed)
+    num_names = len(_bases) * len(_qualifiers) * len(_preparations)
+    foods = []
+
+    for i in range(count):
+        # Names repeat after all combinations are used, like the duplicates
+        # between FDC datasets
+        name_idx = (i * 7919) % num_names
+        base = _bases[name_idx % len(_bases)]
+        qualifier = _qualifiers[(name_idx // len(_bases)) % len(_qualifiers)]
+        preparation = _preparations[name_idx // (len(_bases) * len(_qualifiers))]
+
+        food_nutrients = []
+
+        for nutrient_id, nutrient_name, unit, max_amount in _nutrients:
+            # Every food has carbs except for a few, which cannot be converted
+            if nutrient_id == 1005:
+                if rng.random() < 0.02:
+                    continue
+            elif rng.random() < 0.3:
+                continue
+
+            food_nutrients.append({
+                'type': 'FoodNutrient',
+                'id': 1000000 + 20 * i + len(food_nutrients),
+                'nutrient': {
+                    'id': nutrient_id,
+                    'number': str(nutrient_id),
+                    'name': nutrient_name,
+                    'rank': 1,
+                    'unitName': unit,
+                },
+                'amount': round(rng.uniform(0, max_amount), 3),
+            })
+
+        foods.append({
+            'foodClass': 'FinalFood',
+            'description': f'{base}, {qualifier}, {preparation}',
+            'foodNutrients': food_nutrients,
+            'fdcId': 100000 + i,
+            'dataType': 'SR Legacy',
+            'publicationDate': '4/1/2019',
+        })
+
+    return foods
+
+def write_dataset_zip(path, foods_raw, key='SRLegacyFoods'):
+    '''
+    Write foods to a zipfile laid out like an FDC JSON dataset.
+
+    Args:
+      path (str): Path of the zipfile
+      foods_raw (list[dict]): Foods from :func:`make_foods_raw`
+      key (str, optional): Top-level key of the JSON document
+    '''
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('foods.json', json.dumps({key: foods_raw}))
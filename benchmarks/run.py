@@ -0,0 +1,314 @@
+'''
+Runs the FoodyPy benchmarks offline, against a database installed from
+synthetic FoodData Central foods, and writes the results as JSON so that they
+can be compared between commits.
+
+Run from the root of the repository with::
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json
+
+The database is installed to a temporary home directory, so an existing
+``~/.foodypy`` is not touched.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from . import fixture
+
+_repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Whether a larger value of each unit is better
+_higher_is_better = {
+    's': False,
+    'ms': False,
+    'ops/s': True,
+}
+
+def _time_subprocess(code, env, repeat):
+    # Returns the median wall time of running the code in a fresh interpreter
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, cwd=_repo_dir, check=True)
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+def _run_subprocess_timer(code, env, repeat):
+    # Runs code that prints the time it measured, and returns the median
+    times = []
+
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            env=env, cwd=_repo_dir, check=True, capture_output=True, text=True)
+        times.append(float(output.stdout.strip().splitlines()[-1]))
+
+    return float(np.median(times))
+
+def _best_time(func, repeat=5):
+    # Returns the best time per call of a function, in seconds
+    import timeit
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def bench_import(results, env, repeat):
+    startup = _time_subprocess('pass', env, repeat)
+    results['import.cold_s'] = (
+        _time_subprocess('import foodypy', env, repeat) - startup, 's')
+    results['import.nutrients_s'] = (
+        _time_subprocess('import foodypy; foodypy.Nutrients', env, repeat) - startup, 's')
+
+def bench_install(results, foods_raw, zip_path):
+    from foodypy import database
+
+    start = time.perf_counter()
+    database._convert_from_raw(foods_raw, 'sr_legacy')
+    results['convert.per_10k_s'] = (
+        (time.perf_counter() - start) * 10000 / len(foods_raw), 's')
+
+    # The same steps as 'install_database', except for the download
+    start = time.perf_counter()
+    database._write_database(database._resolve_duplicates(
+        database._convert_datasets(
+            {'sr_legacy': zip_path}, 1, database._compiled_nutrient_map),
+        'rename'))
+    results['install.per_10k_s'] = (
+        (time.perf_counter() - start) * 10000 / len(foods_raw), 's')
+
+def bench_first_load(results, env, repeat, food_name):
+    timer_code = (
+        'import time, foodypy\n'
+        'start = time.perf_counter()\n'
+        'foodypy.{}\n'
+        'print(time.perf_counter() - start)\n')
+    results['load.first_get_s'] = (_run_subprocess_timer(
+        timer_code.format(f'get({food_name!r})'), env, repeat), 's')
+    results['load.first_search_s'] = (_run_subprocess_timer(
+        timer_code.format('search("chicken breast")'), env, repeat), 's')
+
+def _search_terms(food_names, length, count, rng):
+    # Search terms of about the given length, taken from the start of random
+    # words of food names, with a typo in some of them
+    terms = []
+
+    while len(terms) < count:
+        words = rng.choice(food_names).lower().replace(',', '').split()
+        start = rng.randrange(len(words))
+        term = ' '.join(words[start:])[:length]
+
+        if len(term) < min(length, 3):
+            continue
+
+        if len(term) > 4 and rng.random() < 0.3:
+            typo_idx = rng.randrange(1, len(term) - 1)
+            term = term[:typo_idx] + term[typo_idx + 1] + term[typo_idx] + term[typo_idx + 2:]
+
+        terms.append(term)
+
+    return terms
+
+def bench_search(results, food_names, num_queries, rng):
+    import foodypy
+
+    # Measure the search itself, not the cache
+    foodypy.configure_search_cache(max_size=0)
+    foodypy.search('warm up')
+
+    for length in [3, 6, 12, 24]:
+        latencies = []
+
+        for term in _search_terms(food_names, length, num_queries, rng):
+            start = time.perf_counter()
+            foodypy.search(term)
+            latencies.append(time.perf_counter() - start)
+
+        for percentile in [50, 90, 99]:
+            results[f'search.len{length}.p{percentile}_ms'] = (
+                float(np.percentile(latencies, percentile)) * 1e3, 'ms')
+
+    foodypy.configure_search_cache()
+
+def bench_get(results, food_names, rng):
+    import foodypy
+
+    names = [rng.choice(food_names) for _ in range(1000)]
+    name_iter = iter(names * 10000)
+
+    results['get.per_call_ms'] = (
+        _best_time(lambda: foodypy.get(next(name_iter))) * 1e3, 'ms')
+    results['get_many.1000_ms'] = (
+        _best_time(lambda: foodypy.get_many(names)) * 1e3, 'ms')
+    results['copy_database_s'] = (_best_time(foodypy.copy_database, repeat=3), 's')
+
+def bench_arithmetic(results, food_names, rng):
+    import foodypy
+    from . import bench_nutrients
+
+    nutrients_results = bench_nutrients.run(count=1000)
+    results['arithmetic.sum_1000_ms'] = (
+        nutrients_results['sum (Nutrients.sum)'] * 1e3, 'ms')
+    results['arithmetic.weighted_sum_1000_ms'] = (
+        nutrients_results['weighted sum (Nutrients.sum)'] * 1e3, 'ms')
+    results['arithmetic.builtin_sum_1000_ms'] = (
+        nutrients_results['sum (builtin)'] * 1e3, 'ms')
+
+    a = foodypy.get(food_names[0])
+    b = foodypy.get(food_names[1])
+    results['arithmetic.scalar_ops'] = (1 / _best_time(lambda: a * 2 + b), 'ops/s')
+
+    # Foods scaled by amounts and added up, like the meals of a food log
+    nutrients = foodypy.get_many([rng.choice(food_names) for _ in range(10000)])
+    grams = np.array([rng.uniform(0, 300) for _ in range(10000)])
+    results['arithmetic.batch_10k_foods_ops'] = (
+        10000 / _best_time(lambda: grams @ nutrients), 'ops/s')
+
+def run(num_foods=10000, num_queries=50, repeat=5, seed=0):
+    '''
+    Run all the benchmarks.
+
+    Returns:
+      dict[str, tuple[float, str]]:
+        The value and unit of each result
+    '''
+    rng = random.Random(seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as home_dir:
+        # The database location is read from the home directory when foodypy
+        # is imported, so it has to be set first
+        os.environ['HOME'] = home_dir
+        os.environ['USERPROFILE'] = home_dir
+        env = dict(os.environ, PYTHONPATH=_repo_dir)
+
+        import foodypy.database
+        assert foodypy.database._data_dir.startswith(home_dir), (
+            'foodypy was imported before the benchmarks set the home directory')
+
+        foods_raw = fixture.make_foods_raw(num_foods, seed)
+        zip_path = os.path.join(home_dir, 'foods.zip')
+        fixture.write_dataset_zip(zip_path, foods_raw)
+
+        bench_import(results, env, repeat)
+        bench_install(results, foods_raw, zip_path)
+
+        food_names = list(foodypy.database._maybe_load_columns().columns.names)
+        bench_first_load(results, env, repeat, food_names[0])
+        bench_search(results, food_names, num_queries, rng)
+        bench_get(results, food_names, rng)
+        bench_arithmetic(results, food_names, rng)
+
+        foodypy.database._unload_database()
+
+    return results
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=_repo_dir, check=True, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=_repo_dir, check=True, capture_output=True, text=True).stdout.strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+    return commit, dirty
+
+def compare(results, baseline_results, threshold):
+    '''
+    Print how each result changed from a baseline.
+
+    Returns:
+      list[str]: Names of the results that got worse by more than
+      ``threshold``, as a fraction of the baseline
+    '''
+    regressions = []
+
+    for name, result in results.items():
+        baseline = baseline_results.get(name)
+
+        if baseline is None or baseline['unit'] != result['unit'] or baseline['value'] == 0:
+            continue
+
+        change = result['value'] / baseline['value'] - 1
+
+        if _higher_is_better[result['unit']]:
+            change = -change
+
+        regressed = change > threshold
+        marker = ' REGRESSION' if regressed else ''
+        print(
+            f"{name:<36} {baseline['value']:12.4g} -> {result['value']:12.4g} "
+            f"{result['unit']:<6} {change:+7.1%}{marker}")
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='path to write the results JSON to')
+    parser.add_argument('--compare', metavar='BASELINE',
+        help='path of results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='fraction that a result can get worse by before it is reported '
+             'as a regression')
+    parser.add_argument('--foods', type=int, default=10000,
+        help='number of synthetic foods to install')
+    parser.add_argument('--queries', type=int, default=50,
+        help='number of search terms of each length')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    commit, dirty = _git_commit()
+    results = run(args.foods, args.queries, args.repeat)
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'foods': args.foods,
+        'results': {
+            name: {'value': value, 'unit': unit}
+            for name, (value, unit) in results.items()
+        },
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        print(
+            f"Comparing against {baseline.get('commit')}. Positive changes are "
+            "slowdowns")
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+
+        if regressions:
+            sys.exit(1)
+    else:
+        for name, (value, unit) in results.items():
+            print(f'{name:<36} {value:12.4g} {unit}')
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,52 @@
-from .nutrients import (
-    Nutrients,
-)
+import importlib
 
-from .database import (
-    search,
-    get,
-    install_database,
-    copy_database,
-)
+# Public names, mapped to the submodule that defines each one. A submodule is
+# only imported when one of its names is first accessed, so that
+# 'import foodypy' does not pay for importing NumPy and the search and
+# download libraries
+_lazy_attrs = {
+    'Nutrients': 'nutrients',
+    'NutrientsArray': 'nutrients',
+    'Recipe': 'recipe',
+    'parse': 'portions',
+    'parse_many': 'portions',
+    'get_portions': 'portions',
+    'search': 'database',
+    'search_many': 'database',
+    'search_cache_info': 'database',
+    'clear_search_cache': 'database',
+    'configure_search_cache': 'database',
+    'similar': 'database',
+    'similar_many': 'database',
+    'get': 'database',
+    'get_many': 'database',
+    'get_source': 'database',
+    'install_database': 'database',
+    'update_database': 'database',
+    'database_status': 'database',
+    'preload': 'database',
+    'close': 'database',
+    'reload': 'database',
+    'copy_database': 'database',
+    'stats': 'instrumentation',
+    'enable_instrumentation': 'instrumentation',
+    'disable_instrumentation': 'instrumentation',
+    'add_span_hook': 'instrumentation',
+    'remove_span_hook': 'instrumentation',
+}
 
-# Install database if it hasn't been installed yet
-try:
-    install_database()
-except RuntimeError:
-    pass
+__all__ = list(_lazy_attrs)
 
-del nutrients
-del database
-del error_checking
+def __getattr__(name):
+    module_name = _lazy_attrs.get(name)
+
+    if module_name is None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    module = importlib.import_module(f'.{module_name}', __name__)
+    attr = getattr(module, name)
+    globals()[name] = attr
+    return attr
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs))
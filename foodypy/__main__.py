@@ -0,0 +1,23 @@
+import argparse
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='foodypy')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='serve the database over HTTP/JSON to foodypy.client.Client')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on (default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=8642,
+        help='port to listen on (default: %(default)s)')
+    serve_parser.add_argument('--verbose', action='store_true',
+        help='log each request')
+
+    args = parser.parse_args(args)
+
+    if args.command == 'serve':
+        from . import server
+        server.serve(args.host, args.port, verbose=args.verbose)
+
+if __name__ == '__main__':
+    main()
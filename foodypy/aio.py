@@ -0,0 +1,170 @@
+import asyncio
+import concurrent.futures
+import functools
+
+from . import database
+from .error_checking import check
+
+# Executor that the database functions run on. If None, a few worker
+# threads are created when first needed, so that quick calls like 'get' do not
+# wait behind a search or an install. Searching holds the GIL, so the threads
+# do not search any faster than one thread would
+_executor = None
+_default_executor = None
+_default_max_workers = 4
+
+# Calls that are running, keyed by event loop and call arguments, so that
+# identical calls made while one is running share its result
+_in_flight = {}
+
+def set_executor(executor):
+    '''
+    Set the executor that the functions in :mod:`foodypy.aio` run on.
+
+    By default, they run on a few worker threads. Searching is CPU-bound and
+    holds the GIL, so searches on threads run one at a time, and they slow
+    down the event loop's thread while they run. A
+    :class:`concurrent.futures.ProcessPoolExecutor` lets several searches run
+    in parallel without slowing down the event loop. Each worker process loads
+    the database separately, so give :func:`foodypy.preload` as the
+    initializer to load it in each worker when it starts. Custom scorers must
+    be picklable::
+
+        import concurrent.futures
+        import foodypy
+        from foodypy import aio
+
+        aio.set_executor(concurrent.futures.ProcessPoolExecutor(
+            max_workers=4, initializer=foodypy.preload))
+
+    Args:
+
+      executor (:class:`concurrent.futures.Executor` or None):
+        The executor to use. It is not shut down by FoodyPy. If ``None``, use
+        the default worker threads.
+    '''
+    global _executor
+
+    check(executor is None or isinstance(executor, concurrent.futures.Executor), TypeError, lambda: (
+        f"Expected 'executor' to be a concurrent.futures.Executor or None, but "
+        f"got {type(executor)}"))
+
+    _executor = executor
+
+def _get_executor():
+    global _default_executor
+
+    if _executor is not None:
+        return _executor
+
+    if _default_executor is None:
+        _default_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_default_max_workers, thread_name_prefix='foodypy')
+
+    return _default_executor
+
+async def _run_coalesced(key, func, *args, **kwargs):
+    # Runs the function on the executor, unless an identical call is already
+    # running, in which case its result is awaited instead
+    loop = asyncio.get_running_loop()
+    key = (loop, key)
+    future = _in_flight.get(key)
+
+    if future is None:
+        future = loop.run_in_executor(
+            _get_executor(), functools.partial(func, *args, **kwargs))
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Cancelling one caller must not cancel the call for the others
+    return await asyncio.shield(future)
+
+async def search(food_name, limit=10, scorer=None, score_cutoff=0):
+    '''
+    Asynchronous version of :func:`foodypy.search`. The search runs on the
+    executor set by :func:`foodypy.aio.set_executor`, so it does not block the
+    event loop. The search term is normalized on the executor too. Searches
+    for the same normalized search term and arguments that are made while one
+    of them is running share its results.
+
+    Args:
+
+      food_name (str):
+        Search term
+
+      limit (int, optional):
+        The maximum number of search results to return.
+
+        Default: 10
+
+      scorer (str or callable, optional):
+        How to score each food name. See :func:`foodypy.search`.
+
+        Default: None
+
+      score_cutoff (int, optional):
+        Leave out results with scores below this.
+
+        Default: 0
+
+    Returns:
+      list[tuple[str, int]]:
+    '''
+    # Normalizing imports the fuzzy matcher the first time, which is slow
+    search_term = await _run_coalesced(
+        ('normalize', food_name), database._normalize_search_term, food_name)
+    key = ('search', search_term, limit, scorer, score_cutoff)
+    return list(await _run_coalesced(
+        key, database.search, food_name, limit=limit, scorer=scorer,
+        score_cutoff=score_cutoff))
+
+async def get(food_name):
+    '''
+    Asynchronous version of :func:`foodypy.get`. The first call loads the
+    database on the executor, so it does not block the event loop.
+
+    Args:
+
+      food_name (str): The name of the food in the database
+
+    Returns:
+      :class:`foodypy.Nutrients`
+    '''
+    nutrients = await _run_coalesced(('get', food_name), database.get, food_name)
+
+    # Nutrients can be modified in place, so callers that shared a call each
+    # get their own
+    return nutrients + 0
+
+async def load_database():
+    '''
+    Load the database and its search index on the executor, so that the first
+    calls to :func:`foodypy.aio.search` and :func:`foodypy.aio.get` do not have
+    to. This is useful to call when a service starts.
+
+    The database is loaded by one call on the executor. The default worker
+    threads share it, but with a process pool, only the worker process that
+    runs the call loads it. To load it in every worker process, give
+    :func:`foodypy.preload` as the initializer of the pool, see
+    :func:`foodypy.aio.set_executor`.
+    '''
+    await _run_coalesced(('load_database',), _load_database)
+
+def _load_database():
+    database._maybe_load_search_index(database._maybe_load_columns())
+
+async def install_database(*args, **kwargs):
+    '''
+    Asynchronous version of :func:`foodypy.install_database`, which takes the
+    same arguments. Installing runs on the executor, so it does not block the
+    event loop.
+    '''
+    try:
+        key = ('install_database', args, tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        # Arguments like 'nutrient_map' cannot be compared cheaply, so these
+        # calls are not shared
+        key = ('install_database', object())
+
+    await _run_coalesced(key, database.install_database, *args, **kwargs)
@@ -0,0 +1,313 @@
+import http.client
+import json
+import queue
+import socket
+import urllib.parse
+
+import numpy as np
+
+from .error_checking import check, check_type
+from .nutrients import Nutrients, NutrientsArray, _field_names
+from .recipe import Recipe
+
+# Errors that the server sends which are raised again as the same type. Other
+# errors are raised as RuntimeError
+_error_types = {
+    'ValueError': ValueError,
+    'TypeError': TypeError,
+}
+
+def _recipe_json(recipe):
+    return {
+        'ingredients': [
+            [_recipe_json(ingredient) if isinstance(ingredient, Recipe) else ingredient, amount]
+            for ingredient, amount in recipe._ingredients.items()],
+        'servings': recipe._servings,
+    }
+
+class Client:
+    '''
+    Client for a FoodyPy server, started with ``python -m foodypy serve``. It
+    has the same ``search`` and ``get`` functions as :mod:`foodypy`, but they
+    are answered by the server, so that the database does not have to be
+    loaded in this process.
+
+    Connections to the server are kept open and reused between requests. The
+    client can be used from many threads at once, and each thread that makes
+    a request at the same time uses its own connection.
+
+    Args:
+
+      url (str, optional):
+        URL of the server.
+
+        Default: ``'http://127.0.0.1:8642'``
+
+      pool_size (int, optional):
+        The most idle connections to keep open.
+
+        Default: 8
+
+      timeout (number, optional):
+        Seconds to wait for the server to respond.
+
+        Default: 60
+    '''
+    def __init__(self, url='http://127.0.0.1:8642', pool_size=8, timeout=60):
+        check_type(url, str, 'url')
+        check_type(pool_size, int, 'pool_size')
+        check(pool_size >= 1, ValueError, lambda: (
+            f"Expected 'pool_size >= 1' but got {pool_size}"))
+
+        parsed_url = urllib.parse.urlparse(url)
+        check(parsed_url.scheme == 'http' and parsed_url.hostname is not None, ValueError, lambda: (
+            f"Expected 'url' to be an http URL, like 'http://127.0.0.1:8642', but got '{url}'"))
+
+        self.url = url
+        self._host = parsed_url.hostname
+        self._port = parsed_url.port or 80
+        self._timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+        connection.connect()
+
+        # Requests are small, so they are sent right away instead of waiting
+        # to be combined with more data
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def _post(self, path, request):
+        body = json.dumps(request).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+
+        try:
+            connection = self._pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self._connect()
+            reused = False
+
+        try:
+            connection.request('POST', path, body, headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+
+            # The server may have closed an idle connection, so a request on
+            # a reused connection is tried once more on a new one
+            if not reused:
+                raise
+
+            connection = self._connect()
+            connection.request('POST', path, body, headers)
+            response = connection.getresponse()
+
+        try:
+            body = response.read()
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+        try:
+            response_json = json.loads(body)
+        except ValueError:
+            response_json = None
+
+        if response.status != 200 or not isinstance(response_json, dict):
+            error = response_json.get('error', {}) if isinstance(response_json, dict) else {}
+            error_type = _error_types.get(error.get('type'), RuntimeError)
+            raise error_type(error.get(
+                'message', f"Server responded with status {response.status}"))
+
+        return response_json
+
+    def _values(self, response_json):
+        # Fields are sent with the values, in case the server's version of
+        # FoodyPy has different fields
+        values = np.array(response_json['values'], dtype=np.float64)
+        fields = response_json['fields']
+
+        if fields != list(_field_names):
+            server_values = values
+            values = np.zeros(values.shape[:-1] + (len(_field_names),))
+
+            for field_idx, field in enumerate(fields):
+                if field in _field_names:
+                    values[..., _field_names.index(field)] = server_values[..., field_idx]
+
+        return values
+
+    def close(self):
+        '''
+        Close the open connections to the server. The client can still be
+        used after it is closed, and opens new connections as needed.
+        '''
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def search(self, food_name, limit=10, scorer=None, score_cutoff=0):
+        '''
+        Search foods in the database which match the search term most
+        closely. See :func:`foodypy.search`.
+
+        Args:
+
+          food_name (str):
+            Search term
+
+          limit (int, optional):
+            The maximum number of search results to return.
+
+            Default: 10
+
+          scorer (str, optional):
+            The name of the scorer to use. Functions cannot be sent to the
+            server.
+
+            Default: None
+
+          score_cutoff (int, optional):
+            Leave out results with scores below this.
+
+            Default: 0
+
+        Returns:
+          list[tuple[str, int]]:
+        '''
+        check(scorer is None or isinstance(scorer, str), TypeError, lambda: (
+            f"Expected 'scorer' to be the name of a scorer, but got {type(scorer)}"))
+        response_json = self._post('/search', {
+            'food_name': food_name,
+            'limit': limit,
+            'scorer': scorer,
+            'score_cutoff': score_cutoff,
+        })
+        return [tuple(result) for result in response_json['results']]
+
+    def search_many(self, food_names, limit=10, workers=None, scorer=None, score_cutoff=0):
+        '''
+        Search the database for each of several search terms, in one request.
+        See :func:`foodypy.search_many`.
+
+        Args:
+
+          food_names (list[str]):
+            Search terms
+
+          limit (int, optional):
+            The maximum number of search results to return for each search
+            term.
+
+            Default: 10
+
+          workers (int, optional):
+            Not used, since the server does the search. Accepted so that
+            calls to :func:`foodypy.search_many` work unchanged.
+
+            Default: None
+
+          scorer (str, optional):
+            The name of the scorer to use.
+
+            Default: None
+
+          score_cutoff (int, optional):
+            Leave out results with scores below this.
+
+            Default: 0
+
+        Returns:
+          list[list[tuple[str, int]]]:
+        '''
+        check(scorer is None or isinstance(scorer, str), TypeError, lambda: (
+            f"Expected 'scorer' to be the name of a scorer, but got {type(scorer)}"))
+        response_json = self._post('/search_many', {
+            'food_names': list(food_names),
+            'limit': limit,
+            'scorer': scorer,
+            'score_cutoff': score_cutoff,
+        })
+        return [
+            [tuple(result) for result in results]
+            for results in response_json['results']]
+
+    def get(self, food_name):
+        '''
+        Get the :class:`foodypy.Nutrients` for one gram of the specified food
+        in the database. See :func:`foodypy.get`.
+
+        Args:
+
+          food_name (str): The name of the food in the database
+
+        Returns:
+          :class:`foodypy.Nutrients`
+        '''
+        return Nutrients._from_values(
+            self._values(self._post('/get', {'food_name': food_name})))
+
+    def get_many(self, food_names):
+        '''
+        Get the nutrients for one gram of each of the specified foods in the
+        database, in one request. See :func:`foodypy.get_many`.
+
+        Args:
+
+          food_names (list[str]): The names of the foods in the database
+
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        values = self._values(self._post('/get_many', {'food_names': list(food_names)}))
+        return NutrientsArray._from_values(values.reshape(-1, len(_field_names)))
+
+    def evaluate_many(self, recipes, per_serving=False):
+        '''
+        Calculate the nutrients of each of several recipes, in one request.
+        See :meth:`foodypy.Recipe.evaluate_many`.
+
+        Args:
+
+          recipes (list[:class:`foodypy.Recipe`]):
+            The recipes
+
+          per_serving (bool, optional):
+            If ``True``, calculate the nutrients of one serving of each
+            recipe, rather than the total.
+
+            Default: False
+
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        recipes = list(recipes)
+
+        for recipe in recipes:
+            check(isinstance(recipe, Recipe), TypeError, lambda: (
+                f"Expected 'recipes' to contain foodypy.Recipe, but got "
+                f"{type(recipe)}"))
+
+        values = self._values(self._post('/recipes', {
+            'recipes': [_recipe_json(recipe) for recipe in recipes],
+            'per_serving': per_serving,
+        }))
+        return NutrientsArray._from_values(values.reshape(-1, len(_field_names)))
@@ -1,4 +1,3 @@
-import requests
 import json
 import os
 import urllib.parse
@@ -6,196 +5,1844 @@ import zipfile
 import io
 import copy
 import warnings
-from fuzzywuzzy import fuzz, process
+import collections
+import concurrent.futures
+import functools
+import gc
+import heapq
+import pickle
+import threading
+import time
 
+import numpy as np
+
+from . import portions, scoring
 from .error_checking import check, check_type
-from .nutrients import Nutrients
+from .instrumentation import _count, _instrumented, _span
+from .nutrients import Nutrients, NutrientsArray, _field_names, _field_units
+from .storage import (
+    _BinaryDatabaseWriter,
+    _ColumnarDatabase,
+    _MappedDatabase,
+)
 
 _data_dir = os.path.expanduser('~/.foodypy')
 _data_path = os.path.join(_data_dir, 'foodypy_database.json')
-_database = None
+_index_path = os.path.join(_data_dir, 'foodypy_search_index.json')
+_binary_path = os.path.join(_data_dir, 'foodypy_database.bin')
+_download_dir = os.path.join(_data_dir, 'downloads')
+
+class _LoadedDatabase:
+    # Everything that is loaded from one installed version of the database.
+    # Each part other than the database itself is loaded the first time that
+    # it is needed, and is never changed after it is set. Reloading builds
+    # a new object and replaces '_loaded' with it, so a function that takes
+    # '_loaded' once keeps using one version of the database, even if another
+    # thread reloads it in the meantime
+    def __init__(self, version, database, search_index=None):
+        # Identifies the installed database that was loaded, so that cached
+        # search results from other versions are not used
+        self.version = version
+        self.database = database
+        self.search_index = search_index
+        self.columns = None
+        self.similar_index = None
+        self.portion_table = None
+        self.metadata = None
+
+# The loaded database, or None if it is not loaded yet
+_loaded = None
+
+# Held while loading or unloading the database, so that threads which need
+# the database at the same time load it only once. It is reentrant because
+# the loading functions call each other
+_load_lock = threading.RLock()
+
+# Number of candidates, taken from the search index, that get scored first
+# for each search. Names tied with the last one are included too. Their scores
+# let the search skip the other names that cannot beat them
+_search_shortlist_size = 256
+
+# Search results, keyed by database version, normalized search term, and
+# limit. Entries are ordered from least to most recently used
+_search_cache = collections.OrderedDict()
+_search_cache_max_size = 1024
+_search_cache_ttl = None
+_search_cache_stats = {'hits': 0, 'misses': 0, 'prefix_hits': 0}
+
+# Trigram overlap counts of recent search terms, keyed by database version
+# and normalized search term. They are extended for longer search terms that
+# start with them
+_overlap_cache = collections.OrderedDict()
+_overlap_cache_max_size = 64
+
+# Held while using the search result and trigram overlap caches
+_search_cache_lock = threading.Lock()
+
+def _reset_locks_after_fork():
+    # A lock that another thread held when the process forked would stay held
+    # in the child forever
+    global _load_lock, _search_cache_lock
+    _load_lock = threading.RLock()
+    _search_cache_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+_metadata_path = os.path.join(_data_dir, 'foodypy_metadata.json')
+
+# The arguments that the database was installed with, and the version of each
+# dataset that was downloaded, so that 'update_database' can update it the
+# same way
+_install_info_path = os.path.join(_data_dir, 'foodypy_install.json')
+
+# Lists the database files that are being replaced, once all of their new
+# versions are written to temporary files. It is removed once they are all in
+# place, so if replacing them is interrupted, the next process that uses the
+# database finishes replacing them, rather than using a mix of old and new
+# files
+_replacing_path = os.path.join(_data_dir, 'foodypy_replacing.json')
+
+# Pickled snapshots of the structures that are prepared when the database is
+# loaded, so that later processes can load them in one step. Each one is only
+# used if it was written for the installed version of the database
+_columns_cache_path = os.path.join(_data_dir, 'foodypy_database.pickle')
+_index_cache_path = os.path.join(_data_dir, 'foodypy_search_index.pickle')
+_similar_cache_path = os.path.join(_data_dir, 'foodypy_similar_index.pickle')
+_portions_cache_path = os.path.join(_data_dir, 'foodypy_portions.pickle')
+
+# Incremented whenever the contents of the cache files change
+_cache_format = 1
+
+# URLs of the FoodData Central datasets that can be installed
+_dataset_urls = {
+    'foundation': 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_foundation_food_json_2023-04-20.zip',
+    'sr_legacy': 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_sr_legacy_food_json_2018-04.zip',
+    'survey': 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_survey_food_json_2022-10-28.zip',
+    'branded': 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_branded_food_json_2023-04-20.zip',
+}
+
+# Number of foods that each worker process converts at a time
+_conversion_chunk_size = 1000
+
+# 'requests' and 'fuzzywuzzy' are slow to import, so they are only imported by
+# the functions that need them
+
+def _download(url, path, chunk_size=2 ** 20):
+    # Downloads to a partial file first. If a previous download was
+    # interrupted, it is resumed from the end of the partial file, but only if
+    # the file at the URL has not changed since the partial file was started.
+    # The server checks that with the 'If-Range' header, which holds the
+    # version of the partial file, and sends the whole file again if it
+    # changed. Returns the version of the file, see '_remote_version'
+    import requests
+
+    part_path = path + '.part'
+    part_version_path = part_path + '.json'
+
+    for _ in range(2):
+        start = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        part_version = None
+
+        if start > 0 and os.path.exists(part_version_path):
+            with open(part_version_path) as json_file:
+                part_version = json.loads(json_file.read())
+
+        # Weak ETags cannot be used for ranges. A partial file without a
+        # version cannot be resumed safely, so it is downloaded again
+        validator = None
+
+        if part_version is not None:
+            etag = part_version.get('ETag')
+
+            if etag is not None and not etag.startswith('W/'):
+                validator = etag
+            else:
+                validator = part_version.get('Last-Modified')
+
+        if validator is None:
+            start = 0
+
+        headers = {'Range': f'bytes={start}-', 'If-Range': validator} if start > 0 else {}
+
+        with requests.get(url, headers=headers, stream=True) as req_result:
+            content_range = req_result.headers.get('Content-Range')
+
+            # The server responds with 416 if the partial file is already
+            # complete
+            if start > 0 and req_result.status_code == 416:
+                if content_range is None or content_range == f'bytes */{start}':
+                    version = part_version
+                    break
+
+                os.remove(part_path)
+                continue
+
+            check(req_result.ok, RuntimeError,
+                lambda: f"failed to get zipfile from URL: {url}")
+
+            # A partial response must continue the partial file. Servers that
+            # do not support ranges, or whose file changed, send the whole
+            # file again
+            if req_result.status_code == 206:
+                if content_range is None or not content_range.startswith(f'bytes {start}-'):
+                    os.remove(part_path)
+                    continue
 
-def _load_database_raw(url):
-    req_result = requests.get(url)
-    check(req_result.ok, RuntimeError,
-        lambda: f"failed to get zipfile from URL: {url}")
+                mode = 'ab'
+            else:
+                mode = 'wb'
 
-    zip_result = zipfile.ZipFile(io.BytesIO(req_result.content))
-    infolist = zip_result.infolist()
+            version = _response_version(req_result)
 
-    check(len(infolist) == 1, RuntimeError, lambda: (
-        "expected zipfile from URL to have exactly one entry, but got "
-        f"{len(infolist)}: {url}"))
+            with open(part_version_path, 'w', encoding='utf-8') as f:
+                json.dump(version, f)
 
-    with zip_result.open(infolist[0].filename) as json_file:
-        data = json.loads(json_file.read())
+            with open(part_path, mode) as f:
+                for chunk in req_result.iter_content(chunk_size):
+                    f.write(chunk)
 
-    #with open(os.path.expanduser('~/tmp/foodypy_database_sr_raw.json'), 'w', encoding='utf-8') as f:
-    #    json.dump(data, f)
+            break
+    else:
+        raise RuntimeError(f"failed to resume download from URL: {url}")
 
-    return data
+    os.replace(part_path, path)
+
+    if os.path.exists(part_version_path):
+        os.remove(part_version_path)
+
+    return version
+
+def _response_version(response):
+    # The 'ETag' and 'Last-Modified' headers change whenever the file at a URL
+    # changes. Returns None if the server sends neither
+    version = {
+        header: response.headers[header]
+        for header in ['ETag', 'Last-Modified']
+        if header in response.headers}
+
+    return version or None
+
+def _remote_version(url):
+    # Returns the version of the file at a URL, without downloading it, or
+    # None if it cannot be found out
+    import requests
+
+    try:
+        with requests.head(url, allow_redirects=True) as response:
+            return _response_version(response) if response.ok else None
+    except requests.RequestException:
+        return None
+
+class _JSONArrayReader:
+    # Incrementally decodes JSON from a text file, reading it in chunks
+    def __init__(self, text_file, chunk_size):
+        self._file = text_file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self):
+        chunk = self._file.read(self._chunk_size)
+
+        if not chunk:
+            self._eof = True
+        else:
+            self._buffer = self._buffer[self._pos:] + chunk
+            self._pos = 0
+
+    def _next_char(self):
+        # Returns the next non-whitespace character without consuming it, or
+        # an empty string at the end of the file
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+
+            if self._pos < len(self._buffer) or self._eof:
+                return self._buffer[self._pos:self._pos + 1]
+
+            self._read_more()
+
+    def _consume(self, expected_chars):
+        char = self._next_char()
+        check(char != '' and char in expected_chars, RuntimeError, lambda: (
+            f"expected one of {list(expected_chars)} in JSON, but got "
+            f"'{char}' at position {self._pos}"))
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        self._next_char()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                self._pos = end
+                return value
+
+            self._read_more()
+
+    def iter_first_array(self):
+        # Yields the items of the array that is the value of the first key in
+        # a JSON object
+        self._consume('{')
+        self._decode_value()
+        self._consume(':')
+        self._consume('[')
+
+        if self._next_char() == ']':
+            return
+
+        while True:
+            yield self._decode_value()
+
+            if self._consume(',]') == ']':
+                return
+
+def _iter_foods_raw(zip_path, chunk_size=2 ** 16):
+    # Yields each food of an FDC dataset zipfile, without reading the whole
+    # dataset into memory
+    with zipfile.ZipFile(zip_path) as zip_file:
+        infolist = zip_file.infolist()
+
+        check(len(infolist) == 1, RuntimeError, lambda: (
+            "expected zipfile to have exactly one entry, but got "
+            f"{len(infolist)}: {zip_path}"))
+
+        with zip_file.open(infolist[0].filename) as json_file:
+            text_file = io.TextIOWrapper(json_file, encoding='utf-8')
+            yield from _JSONArrayReader(text_file, chunk_size).iter_first_array()
+
+# Sizes of the mass units used by FoodData Central, in grams
+_unit_grams = {
+    'g': 1,
+    'mg': 1e-3,
+    'µg': 1e-6,
+    'ug': 1e-6,
+}
 
 def _extract_nutrient(nutrient_raw, expected_unit):
     nutrient_name = nutrient_raw['nutrient']['name']
     unit = nutrient_raw['nutrient']['unitName']
-    check(unit == expected_unit, RuntimeError, lambda: (
+    amount = float(nutrient_raw['amount'])
+
+    if unit == expected_unit:
+        return amount
+
+    # Convert between mass units
+    unit_grams = _unit_grams.get(unit.lower())
+    check(unit_grams is not None, RuntimeError, lambda: (
         f"expected nutrient '{nutrient_name}' to be in units "
         f"'{expected_unit}', but got '{unit}'"))
 
-    return float(nutrient_raw['amount'])
+    return amount * unit_grams / _unit_grams[expected_unit]
+
+# Maps each nutrient field to the FoodData Central nutrient IDs that it is
+# calculated from. Each field has a list of alternatives, and the first
+# alternative that a food has any nutrients for is used. The amounts of all
+# the nutrients in that alternative are added together
+_nutrient_map = {
+    'fat': [
+        [1004],  # Total lipid (fat)
+    ],
+    'carbs': [
+        [1005],  # Carbohydrate, by difference
+        [1050],  # Carbohydrate, by summation
+    ],
+    'protein': [
+        [1003],  # Protein
+    ],
+    'fiber': [
+        [1079],  # Fiber, total dietary
+    ],
+    'sugars': [
+        [2000],  # Sugars, total including NLEA
+        [1063],  # Sugars, Total
+    ],
+    'added_sugars': [[1235]],
+    'starch': [[1009]],
+    'saturated_fat': [[1258]],
+    'monounsaturated_fat': [[1292]],
+    'polyunsaturated_fat': [[1293]],
+    'trans_fat': [[1257]],
+    'cholesterol': [[1253]],
+    'water': [[1051]],
+    'alcohol': [[1018]],
+    'caffeine': [[1057]],
+    'sodium': [[1093]],
+    'potassium': [[1092]],
+    'calcium': [[1087]],
+    'iron': [[1089]],
+    'magnesium': [[1090]],
+    'phosphorus': [[1091]],
+    'zinc': [[1095]],
+    'copper': [[1098]],
+    'manganese': [[1101]],
+    'selenium': [[1103]],
+    'vitamin_a': [[1106]],  # Vitamin A, RAE
+    'vitamin_c': [[1162]],
+    'vitamin_d': [[1114]],  # Vitamin D (D2 + D3)
+    'vitamin_e': [[1109]],  # Vitamin E (alpha-tocopherol)
+    'vitamin_k': [[1185]],  # Vitamin K (phylloquinone)
+    'thiamin': [[1165]],
+    'riboflavin': [[1166]],
+    'niacin': [[1167]],
+    'pantothenic_acid': [[1170]],
+    'vitamin_b6': [[1175]],
+    'folate': [[1177]],  # Folate, total
+    'vitamin_b12': [[1178]],
+    'choline': [[1180]],  # Choline, total
+}
+
+# Foods without any of these fields cannot be converted. Other fields that
+# are missing are set to 0
+_required_fields = ['carbs']
 
-def _extract_grams(nutrient_raw):
-    return _extract_nutrient(nutrient_raw, 'g')
+def _compile_nutrient_map(nutrient_map):
+    # Returns a dict from each FDC nutrient ID to the (field, alternative
+    # index) pairs that it is added to, and a dict of the number of
+    # alternatives of each field
+    nutrient_targets = {}
+    num_alternatives = {}
 
-def _extract_add_contributors(nutrients_raw, contributors):
-    amount = None
+    for field, alternatives in nutrient_map.items():
+        num_alternatives[field] = len(alternatives)
 
-    for nutrient_raw in nutrients_raw:
-        nutrient_name_raw = nutrient_raw['nutrient']['name']
+        for alternative_idx, nutrient_ids in enumerate(alternatives):
+            for nutrient_id in nutrient_ids:
+                nutrient_targets.setdefault(nutrient_id, []).append(
+                    (field, alternative_idx))
 
-        if nutrient_name_raw in contributors:
-            if amount is None:
-                amount = 0
-            amount += _extract_grams(nutrient_raw)
+    return nutrient_targets, num_alternatives
 
-    return amount
+_compiled_nutrient_map = _compile_nutrient_map(_nutrient_map)
 
-def _nutrients_from_raw(food_raw):
+def _nutrients_from_raw(food_raw, compiled_nutrient_map=_compiled_nutrient_map):
     # NOTE: This shows how to calculate calories from macros for this
     # particular food
     #print(food_raw['nutrientConversionFactors'])
 
-    nutrients_raw = food_raw['foodNutrients']
-
-    nutrient_contributors_map = {
-        'fat': [
-            'Total lipid (fat)',
-        ],
-        'protein': [
-            'Protein',
-        ],
-        'carbs by diff': [
-            'Carbohydrate, by difference',
-        ],
-        #'carbs by sum': [
-        #    'Carbohydrate, by summation',
-        #],
-        #'starch': [
-        #    'Starch',
-        #],
-        'fiber': [
-            'Fiber, total dietary',
-        ],
-        #'sugars': [
-        #    'Sugars, Total',
-        #],
-    }
+    nutrient_targets, num_alternatives = compiled_nutrient_map
 
-    nutrients_extracted = {}
+    # Amounts are gathered in one pass over the food's nutrients
+    amounts = {}
 
-    for nutrient_name, contributors in nutrient_contributors_map.items():
-        nutrients_extracted[nutrient_name] = _extract_add_contributors(nutrients_raw, contributors)
+    for nutrient_raw in food_raw['foodNutrients']:
+        targets = nutrient_targets.get(nutrient_raw['nutrient']['id'])
 
-    if nutrients_extracted['carbs by diff'] is None:
-        check(False, RuntimeError, lambda: 'Need to decide what to do here')
+        if targets is not None:
+            for target in targets:
+                amount = _extract_nutrient(nutrient_raw, _field_units[target[0]])
+                amounts[target] = amounts.get(target, 0) + amount
 
-    nutrients_dict = {
-        'fat': (nutrients_extracted['fat'] or 0),
-        'carbs': nutrients_extracted['carbs by diff'],
-        'protein': (nutrients_extracted['protein'] or 0),
-        'fiber': (nutrients_extracted['fiber'] or 0),
-    }
+    nutrients_dict = {}
+
+    for field in _field_names:
+        amount = None
+
+        for alternative_idx in range(num_alternatives.get(field, 0)):
+            amount = amounts.get((field, alternative_idx))
 
-    # Divide by 100g, since that is the amount stored in FoodData Central
-    for key, value in nutrients_dict.items():
-        nutrients_dict[key] = value / 100
+            if amount is not None:
+                break
+
+        if amount is None:
+            if field in _required_fields:
+                return None
+
+            amount = 0
+
+        # Divide by 100g, since that is the amount stored in FoodData Central
+        nutrients_dict[field] = amount / 100
 
     return nutrients_dict
 
-def _convert_from_raw(data_raw):
-    foods = list(data_raw.values())[0]
+def _convert_from_raw(foods_raw, source, compiled_nutrient_map=_compiled_nutrient_map):
+    # Returns a list with the name, nutrients dict, and metadata dict of each
+    # food that can be converted, and a list with the metadata dict of each
+    # food that cannot
+    foods = []
+    skipped = []
+
+    for food in foods_raw:
+        nutrients = _nutrients_from_raw(food, compiled_nutrient_map)
+        info = {
+            'source': source,
+            'fdc_id': food.get('fdcId'),
+            'published': food.get('publicationDate'),
+        }
+
+        if nutrients is None:
+            skipped.append(info)
+            continue
+
+        food_portions = portions._portions_from_raw(food)
+
+        if food_portions:
+            info['portions'] = food_portions
+
+        foods.append((food['description'], nutrients, info))
+
+    return foods, skipped
+
+def _iter_chunks(iterable, chunk_size):
+    chunk = []
+
+    for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def _convert_datasets(zip_paths, workers, compiled_nutrient_map, food_filter=None, skipped=None):
+    # Yields each converted food of the given datasets, in order. Chunks of
+    # foods are converted in a pool of processes, while this process reads
+    # the datasets. Only a few chunks are in flight at a time, so memory use
+    # does not depend on the size of the datasets. If 'food_filter' is given,
+    # only the raw foods that it returns True for, given the dataset name and
+    # the raw food, are converted. If 'skipped' is given, the foods that
+    # cannot be converted are recorded in it, see '_record_skipped'
+    chunks = (
+        (chunk, source, compiled_nutrient_map)
+        for source, zip_path in zip_paths.items()
+        for chunk in _iter_chunks(
+            (food_raw for food_raw in _iter_foods_raw(zip_path)
+                if food_filter is None or food_filter(source, food_raw)),
+            _conversion_chunk_size))
+
+    num_skipped = 0
+
+    if workers == 1:
+        results = (_convert_from_raw(*args) for args in chunks)
+    else:
+        results = _map_bounded(_convert_from_raw, chunks, workers)
 
-    food_data = {}
+    for foods, chunk_skipped in results:
+        num_skipped += len(chunk_skipped)
+        _count('install.foods_converted', len(foods))
 
-    for food in foods:
-        name = food['description']
-        nutrients = _nutrients_from_raw(food)
+        if skipped is not None:
+            for info in chunk_skipped:
+                _record_skipped(skipped, info)
 
-        check(name not in food_data, RuntimeError,
-            lambda: f"multiple entries for food '{name}' found in database")
-        food_data[name] = nutrients
+        yield from foods
 
-    return food_data
+    if num_skipped > 0:
+        warnings.warn(
+            f"Skipped {num_skipped} foods that do not have any amounts for "
+            f"the required nutrients {_required_fields}")
 
-def install_database(overwrite=False):
+def _map_bounded(func, args_iter, workers):
+    # Like 'executor.map', but only submits as many calls as can run at once,
+    # plus a few more, rather than consuming all of 'args_iter' up front
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+
+        for args in args_iter:
+            pending.append(executor.submit(func, *args))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def _record_skipped(skipped, info, duplicate_of=None):
+    # Records a food that is left out of the database, keyed by its dataset
+    # and FDC ID, so that 'update_database' does not convert it again unless
+    # it is published again. Foods left out as duplicates also record the name
+    # that they duplicate
+    if info.get('fdc_id') is None:
+        return
+
+    entry = {'published': info.get('published')}
+
+    if duplicate_of is not None:
+        entry['duplicate_of'] = duplicate_of
+
+    skipped.setdefault(info['source'], {})[str(info['fdc_id'])] = entry
+
+def _resolve_duplicates(foods, duplicates, skipped=None):
+    names = set()
+
+    for name, nutrients, info in foods:
+        if name in names:
+            check(duplicates != 'error', RuntimeError,
+                lambda: f"multiple entries for food '{name}' found in database")
+
+            if duplicates == 'skip':
+                if skipped is not None:
+                    _record_skipped(skipped, info, name)
+
+                continue
+
+            renamed = f"{name} (FDC ID {info['fdc_id']})"
+            check(renamed not in names, RuntimeError, lambda: (
+                f"multiple entries for food '{name}' found in database, "
+                f"and could not rename to '{renamed}'"))
+            name = renamed
+
+        names.add(name)
+        yield name, nutrients, info
+
+@_instrumented('install_database')
+def install_database(overwrite=False, datasets=('sr_legacy',), duplicates='rename', workers=None, nutrient_map=None):
     '''
     Installs the FoodyPy database to ``$HOME/.foodypy/``.
 
+    The database can combine several of the FoodData Central datasets:
+
+    * ``'foundation'``: Foundation Foods
+
+    * ``'sr_legacy'``: SR Legacy
+
+    * ``'survey'``: Food and Nutrient Database for Dietary Studies (FNDDS)
+
+    * ``'branded'``: Branded Foods
+
+    Each dataset is downloaded to ``$HOME/.foodypy/downloads/`` and converted
+    one chunk of foods at a time, so installing uses little memory. If a
+    download is interrupted, the next call resumes it. Use
+    :func:`foodypy.get_source` to find out which dataset a food came from.
+
     Args:
 
       overwrite (bool, optional):
         If ``True``, overwrite the current database, if it exists.
 
         Default: False
+
+      datasets (list[str], optional):
+        The datasets to install. If the same food name appears more than
+        once, the entry from the dataset listed first is considered the
+        original and the others are duplicates.
+
+        Default: ``('sr_legacy',)``
+
+      duplicates (str, optional):
+        How to handle duplicate food names. ``'rename'`` appends the FDC ID
+        to the names of duplicates, like ``'Bananas, raw (FDC ID 173944)'``.
+        ``'skip'`` leaves out duplicates. ``'error'`` raises an error.
+
+        Default: ``'rename'``
+
+      workers (int, optional):
+        The number of worker processes that convert foods. If ``None``, use
+        the number of CPUs. If ``1``, convert in the calling process.
+
+        Default: None
+
+      nutrient_map (dict[str, list[list[int]]], optional):
+        Overrides which FoodData Central nutrients each field of
+        :class:`foodypy.Nutrients` is calculated from. Each item maps a field
+        name to a list of alternatives, where each alternative is a list of
+        FDC nutrient IDs. The first alternative that a food has any of the
+        nutrients for is used, and the amounts of its nutrients are added
+        together. For instance, ``{'carbs': [[1005], [1050]]}`` uses
+        "Carbohydrate, by difference" if a food has it, and "Carbohydrate, by
+        summation" otherwise. Fields that are not given keep their default
+        mapping.
+
+        Default: None
     '''
     if not overwrite:
         check(not os.path.exists(_data_path), RuntimeError, lambda: (
             f"Database already installed to location '{_data_path}'. "
             "To overwrite it, set argument 'overwrite=True'"))
 
+    datasets = list(datasets)
+
+    check(len(datasets) > 0, ValueError, lambda: (
+        "Expected at least one dataset"))
+
+    for dataset in datasets:
+        check(dataset in _dataset_urls, ValueError, lambda: (
+            f"Unknown dataset '{dataset}'. Expected one of "
+            f"{list(_dataset_urls.keys())}"))
+
+    check(len(set(datasets)) == len(datasets), ValueError, lambda: (
+        f"Expected datasets to be unique, but got {datasets}"))
+
+    check(duplicates in ['rename', 'skip', 'error'], ValueError, lambda: (
+        "Expected 'duplicates' to be one of ['rename', 'skip', 'error'], "
+        f"but got '{duplicates}'"))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    check(workers >= 1, ValueError, lambda: (
+        f"Expected 'workers >= 1' but got {workers}"))
+
+    if nutrient_map is None:
+        compiled_nutrient_map = _compiled_nutrient_map
+    else:
+        for field, alternatives in nutrient_map.items():
+            check(field in _field_names, ValueError, lambda: (
+                f"Unknown nutrient field '{field}' in 'nutrient_map'. "
+                f"Expected one of {list(_field_names)}"))
+            check(
+                isinstance(alternatives, (list, tuple)) and all(
+                    isinstance(nutrient_ids, (list, tuple))
+                    and all(isinstance(nutrient_id, int) for nutrient_id in nutrient_ids)
+                    for nutrient_ids in alternatives),
+                TypeError,
+                lambda: (
+                    f"Expected 'nutrient_map['{field}']' to be a list of lists "
+                    f"of nutrient IDs, but got {alternatives}"))
+
+        compiled_nutrient_map = _compile_nutrient_map(
+            dict(_nutrient_map, **nutrient_map))
+
     warnings.warn('Installing FoodyPy database')
 
-    foundation_foods_url = 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_foundation_food_json_2023-04-20.zip'
-    sr_legacy_url = 'https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_sr_legacy_food_json_2018-04.zip'
+    if not os.path.exists(_download_dir):
+        os.makedirs(_download_dir)
+
+    zip_paths = {}
+    versions = {}
+
+    for dataset in datasets:
+        zip_paths[dataset], versions[dataset] = _download_dataset(dataset)
+
+    # The foods that are left out are recorded while the database is
+    # written, which is before the install info is written
+    skipped = {}
+    _write_database(
+        _resolve_duplicates(
+            _convert_datasets(zip_paths, workers, compiled_nutrient_map, skipped=skipped),
+            duplicates, skipped),
+        install_info={
+            'datasets': datasets,
+            'duplicates': duplicates,
+            'nutrient_map': nutrient_map,
+            'versions': versions,
+            'skipped': skipped,
+        })
+
+    for zip_path in zip_paths.values():
+        os.remove(zip_path)
+
+def _download_dataset(dataset):
+    # Returns the path that the dataset was downloaded to, and its version
+    url = _dataset_urls[dataset]
+    zip_path = os.path.join(
+        _download_dir,
+        os.path.basename(urllib.parse.urlparse(url).path))
+
+    with _span('install.download', dataset=dataset):
+        return zip_path, _download(url, zip_path)
+
+def _write_install_info(install_info, replace=True):
+    with open(_install_info_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(install_info, f)
+
+    if replace:
+        os.replace(_install_info_path + '.tmp', _install_info_path)
+
+def _replace_files(paths):
+    # Moves the temporary file of each path into place, as if all at once
+    with open(_replacing_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump([os.path.relpath(path, _data_dir) for path in paths], f)
+
+    os.replace(_replacing_path + '.tmp', _replacing_path)
+    _finish_replacing_files()
 
-    #data_raw = _load_database_raw(foundation_foods_url)
+def _finish_replacing_files():
+    # Finishes replacing the files listed by '_replacing_path', if replacing
+    # them was interrupted. Files that another process already moved into
+    # place are skipped
+    try:
+        with open(_replacing_path) as json_file:
+            paths = json.loads(json_file.read())
+    except FileNotFoundError:
+        return
 
-    data_raw = _load_database_raw(sr_legacy_url)
+    for path in paths:
+        path = os.path.join(_data_dir, path)
 
-    # Foundation Foods
-    #file_raw = '~/tmp/foodypy_database_raw.json'
+        try:
+            os.replace(path + '.tmp', path)
+        except FileNotFoundError:
+            pass
 
-    # SR Legacy
-    #file_raw = '~/tmp/foodypy_database_sr_raw.json'
+    try:
+        os.remove(_replacing_path)
+    except FileNotFoundError:
+        pass
 
-    #with open(os.path.expanduser(file_raw)) as json_file:
-    #    data_raw = json.loads(json_file.read())
+def _read_install_info():
+    # Databases installed before the install info was recorded were installed
+    # with the default arguments, from the datasets that their foods came from
+    if os.path.exists(_install_info_path):
+        with open(_install_info_path) as json_file:
+            return json.loads(json_file.read())
 
-    data = _convert_from_raw(data_raw)
+    metadata = _maybe_load_metadata().metadata
+    datasets = list(dict.fromkeys(
+        info['source'] for info in metadata.values() if 'source' in info))
 
+    return {
+        'datasets': datasets or ['sr_legacy'],
+        'duplicates': 'rename',
+        'nutrient_map': None,
+        'versions': {},
+        'skipped': {},
+    }
+
+@_instrumented('update_database')
+def update_database(workers=None):
+    '''
+    Update the installed FoodyPy database to the latest versions of the
+    datasets that it was installed from, with the same arguments that were
+    given to :func:`foodypy.install_database`.
+
+    Datasets that have not changed since they were installed are not
+    downloaded again. For the ones that have, only the foods that were added,
+    removed, or published again since then are converted, and the others are
+    kept as they are. Foods are matched by their FDC ID and publication date.
+    Foods that were left out of the database, because they do not have the
+    required nutrients or were skipped as duplicates, are also only converted
+    again if they were published again. Foods without an FDC ID cannot be
+    matched, so they are kept as they are. The counts only include foods that
+    end up in the database or leave it.
+
+    The database files are replaced all at once when the update is done. If
+    this process loaded the database, the new one is loaded and replaces it,
+    while threads that are using the old one keep using it until they are
+    done. Other processes that loaded the database keep using the old one
+    until they call :func:`foodypy.reload`.
+
+    Args:
+
+      workers (int, optional):
+        The number of worker processes that convert foods. If ``None``, use
+        the number of CPUs. If ``1``, convert in the calling process.
+
+        Default: None
+
+    Returns:
+      dict[str, int]:
+        The number of foods that were ``'added'``, ``'changed'``, and
+        ``'removed'``.
+    '''
+    _finish_replacing_files()
+    check(os.path.exists(_data_path), RuntimeError, lambda: (
+        "Cannot update database because it has not been installed "
+        "please run 'foodypy.install_database()'"))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    check(workers >= 1, ValueError, lambda: (
+        f"Expected 'workers >= 1' but got {workers}"))
+
+    install_info = _read_install_info()
+    nutrient_map = install_info['nutrient_map']
+
+    if nutrient_map is None:
+        compiled_nutrient_map = _compiled_nutrient_map
+    else:
+        compiled_nutrient_map = _compile_nutrient_map(dict(_nutrient_map, **nutrient_map))
+
+    counts = {'added': 0, 'changed': 0, 'removed': 0}
+    versions = dict(install_info['versions'])
+    zip_paths = {}
+
+    for dataset in install_info['datasets']:
+        version = versions.get(dataset)
+
+        if version is not None and _remote_version(_dataset_urls[dataset]) == version:
+            continue
+
+        if not os.path.exists(_download_dir):
+            os.makedirs(_download_dir)
+
+        zip_paths[dataset], versions[dataset] = _download_dataset(dataset)
+
+    if not zip_paths:
+        return counts
+
+    try:
+        loaded = _maybe_load_database()
+        _preload_parts(loaded, search=True)
+        names = list(loaded.columns.names)
+        metadata = loaded.metadata
+        table = loaded.columns.table
+        search_index = loaded.search_index
+
+        # The name of each food of the updated datasets that is installed,
+        # keyed by its dataset and FDC ID
+        installed = {}
+
+        for name in names:
+            info = metadata.get(name, {})
+
+            if info.get('source') in zip_paths and info.get('fdc_id') is not None:
+                installed[(info['source'], info['fdc_id'])] = name
+
+        # Foods that were left out of the database before are not converted
+        # again unless they were published again. Foods left out as
+        # duplicates are kept aside, since they are added if the name that
+        # they duplicate is removed
+        old_skipped = install_info.get('skipped', {})
+        skipped = {
+            dataset: entries for dataset, entries in old_skipped.items()
+            if dataset not in zip_paths}
+        skipped_duplicates = []
+        unchanged = set()
+
+        def is_changed(source, food_raw):
+            key = (source, food_raw.get('fdcId'))
+            name = installed.get(key)
+            published = food_raw.get('publicationDate')
+
+            # Foods without an FDC ID cannot be told apart, so they are not
+            # converted, and the installed ones are kept
+            if key[1] is None:
+                unchanged.add(key)
+                return False
+
+            if published is None:
+                return True
+
+            if name is not None:
+                if metadata[name].get('published') == published:
+                    unchanged.add(key)
+                    return False
+
+                return True
+
+            entry = old_skipped.get(source, {}).get(str(key[1]))
+
+            if entry is None or entry['published'] != published:
+                return True
+
+            if 'duplicate_of' in entry:
+                skipped_duplicates.append((source, food_raw, entry))
+            else:
+                skipped.setdefault(source, {})[str(key[1])] = entry
+
+            return False
+
+        converted = {
+            (info['source'], info['fdc_id']): (name, nutrients, info)
+            for name, nutrients, info
+            in _convert_datasets(
+                zip_paths, workers, compiled_nutrient_map, is_changed, skipped)}
+
+        # Foods keep their place in the database, and added foods go at the
+        # end. Each food that is kept reserves its name first, so that the
+        # duplicates are the changed and added foods
+        foods = []
+        taken_names = set()
+
+        for row, name in enumerate(names):
+            info = metadata.get(name, {})
+            key = (info.get('source'), info.get('fdc_id'))
+
+            if info.get('source') not in zip_paths or key in unchanged:
+                foods.append((name, row, info))
+                taken_names.add(name)
+            elif key in converted:
+                foods.append((name, None, converted[key]))
+            else:
+                counts['removed'] += 1
+
+        for key, food in converted.items():
+            if key not in installed:
+                foods.append((None, None, food))
+
+        new_foods = []
+        old_ids = []
+
+        def add_converted(old_name, name, nutrients, info):
+            # Adds a converted food, unless it is left out as a duplicate.
+            # A changed food keeps its name if it was renamed as a duplicate
+            # before, and its description did not change
+            renamed = f"{name} (FDC ID {info['fdc_id']})"
+
+            if old_name == renamed and renamed not in taken_names:
+                name = renamed
+            elif name in taken_names:
+                check(install_info['duplicates'] != 'error', RuntimeError,
+                    lambda: f"multiple entries for food '{name}' found in database")
+
+                if install_info['duplicates'] == 'skip':
+                    _record_skipped(skipped, info, name)
+                    return False
+
+                check(renamed not in taken_names, RuntimeError, lambda: (
+                    f"multiple entries for food '{name}' found in database, "
+                    f"and could not rename to '{renamed}'"))
+                name = renamed
+
+            taken_names.add(name)
+            new_foods.append((name, nutrients, info))
+            old_ids.append(None)
+            return True
+
+        # Foods are only counted once duplicates are resolved, so a changed
+        # food that is left out as a duplicate is removed, and an added one is
+        # not counted
+        for old_name, row, food in foods:
+            if row is not None:
+                new_foods.append((old_name, dict(zip(_field_names, table[row].tolist())), food))
+                old_ids.append(row)
+            elif add_converted(old_name, *food):
+                counts['changed' if old_name is not None else 'added'] += 1
+            elif old_name is not None:
+                counts['removed'] += 1
+
+        for source, food_raw, entry in skipped_duplicates:
+            if entry['duplicate_of'] in taken_names:
+                skipped.setdefault(source, {})[str(food_raw['fdcId'])] = entry
+                continue
+
+            duplicate_foods, _ = _convert_from_raw([food_raw], source, compiled_nutrient_map)
+
+            for food in duplicate_foods:
+                if add_converted(None, *food):
+                    counts['added'] += 1
+
+        install_info = dict(install_info, versions=versions, skipped=skipped)
+
+        if counts == {'added': 0, 'changed': 0, 'removed': 0}:
+            _write_install_info(install_info)
+            return counts
+
+        new_names = [name for name, _, _ in new_foods]
+        _write_database(
+            new_foods, _update_search_index(search_index, new_names, old_ids),
+            install_info)
+    finally:
+        for zip_path in zip_paths.values():
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+
+    return counts
+
+def _update_search_index(index, names, old_ids):
+    # Returns the search index for the names of an updated database, from the
+    # index from before the update. 'old_ids' has the ID that each name had
+    # before, or None if it is new. Only the new names are processed, and the
+    # result is the same as building the index from scratch
+    new_ids = np.full(len(index['names']), -1, dtype=np.intp)
+
+    for name_id, old_id in enumerate(old_ids):
+        if old_id is not None:
+            new_ids[old_id] = name_id
+
+    trigrams = {}
+
+    for trigram, name_ids in index['trigrams'].items():
+        name_ids = new_ids[name_ids]
+        name_ids = name_ids[name_ids >= 0]
+
+        if len(name_ids) > 0:
+            trigrams[trigram] = name_ids.tolist()
+
+    # Kept names stay in the same order, so only the lists that new names are
+    # added to need to be sorted again
+    changed_trigrams = set()
+
+    for name_id, old_id in enumerate(old_ids):
+        if old_id is None:
+            for trigram in _name_trigrams(names[name_id]):
+                trigrams.setdefault(trigram, []).append(name_id)
+                changed_trigrams.add(trigram)
+
+    for trigram in changed_trigrams:
+        trigrams[trigram].sort()
+
+    from fuzzywuzzy import utils
+
+    processed_names = {
+        force_ascii: [
+            utils.full_process(name, force_ascii=force_ascii) if old_id is None
+            else index['processed_names'][force_ascii][old_id]
+            for name, old_id in zip(names, old_ids)]
+        for force_ascii in [True, False]
+    }
+
+    index = {'names': names, 'trigrams': trigrams, 'processed_names': processed_names}
+    _add_name_stats(index)
+
+    return index
+
+@_instrumented('database.write')
+def _write_database(foods, search_index=None, install_info=None):
+    # Writes the database files from an iterable of food names, each with its
+    # nutrients dict and metadata dict. Each food is written to the JSON
+    # database, the metadata, and the binary database as soon as it is
+    # received, so the foods are not kept in memory. The search index and the
+    # other prepared structures are built from the binary database once it is
+    # written. Files are written to temporary paths and then moved into
+    # place together, so an error or a crash does not leave behind a
+    # partially written database or a mix of old and new files. If the
+    # prepared search index for the food names is given, it is written
+    # instead of building a new one. If 'install_info' is given, it is
+    # written once all the foods are written, and replaces the old install
+    # info along with the database
     if not os.path.exists(_data_dir):
         os.makedirs(_data_dir)
 
-    with open(_data_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f)
+    _finish_replacing_files()
+    paths = [_binary_path, _index_path, _metadata_path, _data_path]
+
+    if install_info is not None:
+        paths.append(_install_info_path)
+
+    try:
+        portion_builder = portions._PortionTableBuilder()
+        num_foods = 0
+
+        with open(_data_path + '.tmp', 'w', encoding='utf-8') as f, \
+                open(_metadata_path + '.tmp', 'w', encoding='utf-8') as metadata_f, \
+                _BinaryDatabaseWriter(_binary_path + '.tmp') as binary_writer:
+            f.write('{')
+            metadata_f.write('{')
+
+            for name, nutrients, info in foods:
+                if num_foods > 0:
+                    f.write(', ')
+                    metadata_f.write(', ')
+
+                name_json = json.dumps(name)
+                f.write(name_json)
+                f.write(': ')
+                json.dump(nutrients, f)
+                metadata_f.write(name_json)
+                metadata_f.write(': ')
+                json.dump(info, metadata_f)
+
+                binary_writer.add(name, [nutrients.get(field, 0) for field in _field_names])
+                portion_builder.add(info.get('portions'))
+                num_foods += 1
+
+            f.write('}')
+            metadata_f.write('}')
+
+        columns = _MappedDatabase.open(_binary_path + '.tmp')
+        names = columns.names
+        similar_index = _build_similar_index(columns.table)
+        del columns
+
+        if search_index is None:
+            index = _build_search_index(names)
+        else:
+            check(search_index['names'] == names, RuntimeError, lambda: (
+                "The search index was prepared for different food names than "
+                "the ones that were written"))
+            index = {'names': names, 'trigrams': search_index['trigrams']}
+
+        with open(_index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+
+        if install_info is not None:
+            _write_install_info(install_info, replace=False)
+    except BaseException:
+        for path in paths:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        raise
+
+    _replace_files(paths)
+
+    # The columns are read from the binary database now, so only the search
+    # index is cached. It is prepared now, so that the first search does not
+    # have to
+    if os.path.exists(_columns_cache_path):
+        os.remove(_columns_cache_path)
+
+    if search_index is None:
+        index['processed_names'] = _process_names(names)
+        _add_name_stats(index)
+    else:
+        index['processed_names'] = search_index['processed_names']
+        index['name_stats'] = search_index['name_stats']
+
+    _write_cache(_index_cache_path, index, _installed_version())
+    _write_cache(_similar_cache_path, similar_index, _installed_version())
+    _write_cache(_portions_cache_path, portion_builder.build(), _installed_version())
+
+    # A database that is loaded is replaced by the new one once it is loaded,
+    # so threads that are using the old one are not interrupted
+    loaded = _loaded
+
+    if loaded is not None:
+        reload(search=loaded.search_index is not None)
+    else:
+        _unload_database()
+
+def _unload_database():
+    # Drops the loaded database, so that it is loaded again when next needed.
+    # Threads that are using it keep their own reference to it
+    global _loaded
+
+    with _load_lock:
+        _loaded = None
+
+    with _search_cache_lock:
+        _search_cache.clear()
+        _overlap_cache.clear()
+
+def _installed_version():
+    # Identifies the installed database by the modification time, size, and
+    # inode of its JSON file and its binary file. Installing replaces the
+    # files, which changes all three
+    version = ()
+
+    for path in [_data_path, _binary_path]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version += (None,)
+        else:
+            version += ((stat.st_mtime_ns, stat.st_size, stat.st_ino),)
+
+    return version
+
+def _read_cache(path, database_version):
+    # Returns the contents of a cache file, or None if it does not exist or was
+    # not written for the specified version of the database
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # A cache that cannot be read, like one that was partially written by
+        # an old version, is rebuilt
+        return None
+
+    if (not isinstance(cache, dict)
+            or cache.get('format') != _cache_format
+            or cache.get('database_version') != database_version):
+        return None
+
+    return cache['contents']
+
+def _write_cache(path, contents, database_version):
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({
+                'format': _cache_format,
+                'database_version': database_version,
+                'contents': contents,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # The cache only makes loading faster, so the database can still be
+        # used if the cache cannot be written, like in a read-only directory
+        pass
+
+def database_status():
+    '''
+    Get the installation status of the FoodyPy database.
+
+    The database is not installed automatically. It must be installed once
+    with :func:`foodypy.install_database`, after which it is loaded from disk
+    the first time that it is needed.
+
+    Returns:
+      dict:
+        Dict with the following items:
+
+        * ``'installed'`` (bool): Whether the database is installed
+
+        * ``'loaded'`` (bool): Whether the database is loaded in this process
+
+        * ``'path'`` (str): Location that the database is installed to
+    '''
+    return {
+        'installed': os.path.exists(_data_path),
+        'loaded': _loaded is not None,
+        'path': _data_path,
+    }
+
+def preload(search=True, freeze=False):
+    '''
+    Load the database now, rather than when it is first needed.
+
+    This is useful in a server that forks worker processes. If the master
+    process preloads the database before forking, the workers share its
+    memory instead of each loading the database separately. Loading is
+    thread-safe, so threads that need the database at the same time only load
+    it once.
+
+    Args:
+
+      search (bool, optional):
+        If ``True``, also load the search index used by
+        :func:`foodypy.search`.
+
+        Default: True
+
+      freeze (bool, optional):
+        If ``True``, call :func:`gc.freeze` after loading, so that the garbage
+        collector of forked processes does not touch the loaded objects. This
+        keeps their memory pages shared between processes.
+
+        Default: False
+    '''
+    with _load_lock:
+        _preload_parts(_maybe_load_database(), search)
+
+    if freeze:
+        gc.freeze()
+
+def _preload_parts(loaded, search):
+    _maybe_load_columns(loaded)
+    _maybe_load_metadata(loaded)
+
+    if search:
+        _maybe_load_search_index(loaded)
+
+def close():
+    '''
+    Unload the database and clear the search cache, to free their memory. The
+    database is loaded again when it is next needed. Threads that are using
+    the database keep using it until they are done, so its memory is only
+    freed after that.
+    '''
+    _unload_database()
+
+def reload(search=True):
+    '''
+    Load the database again, like after it was changed by another process.
+
+    The new database is loaded completely before it replaces the old one.
+    Threads that are using the old database while it is reloaded keep using
+    it until they are done.
+
+    Args:
+
+      search (bool, optional):
+        If ``True``, also load the search index used by
+        :func:`foodypy.search`.
+
+        Default: True
+    '''
+    global _loaded
+
+    with _load_lock:
+        loaded = _open_database()
+        _preload_parts(loaded, search)
+        _loaded = loaded
+
+    with _search_cache_lock:
+        _search_cache.clear()
+        _overlap_cache.clear()
 
 def _maybe_load_database():
-    global _database
+    # Returns the loaded database, and loads it if it is not loaded yet. Each
+    # '_maybe_load_*' function checks again after taking the lock, in case
+    # another thread loaded it in the meantime. Each loaded part is assigned
+    # last, so that threads that do not take the lock never see it partially
+    # loaded
+    global _loaded
+    loaded = _loaded
+
+    if loaded is not None:
+        return loaded
+
+    with _load_lock:
+        if _loaded is None:
+            _loaded = _open_database()
+
+        return _loaded
+
+def _open_database():
+    # Opens the installed database, and returns it as a new '_LoadedDatabase'
+    # without any of the parts that are loaded when needed
+    _finish_replacing_files()
+    check(os.path.exists(_data_path), RuntimeError, lambda: (
+        "Cannot load database because it has not been installed "
+        "please run 'foodypy.install_database()'"))
+
+    with _span('database.load'):
+        # The binary database is memory-mapped, so that it is only read from
+        # disk as needed, and its pages are shared between processes.
+        # Databases installed before it existed fall back to JSON, which is
+        # only parsed if there is no cached copy of its columns
+        #
+        # Another process can replace the files while they are opened, like
+        # with 'update_database'. The mapped file is the one that was opened,
+        # even if it is replaced later, so it is only opened again if the
+        # files changed between checking their version and opening them
+        while True:
+            version = _installed_version()
+
+            if version[1] is None:
+                break
+
+            database = _MappedDatabase.open(_binary_path)
+
+            if _installed_version() == version:
+                break
+
+        if version[1] is None:
+            database = _read_cache(_columns_cache_path, version)
+
+            if database is None:
+                with open(_data_path) as json_file:
+                    database = _ColumnarDatabase.from_dict(json.loads(json_file.read()))
+
+                _write_cache(_columns_cache_path, database, version)
+
+        return _LoadedDatabase(version, database)
+
+def _maybe_load_columns(loaded=None):
+    # Returns the loaded database, or 'loaded' if it is given, with its
+    # columns loaded. The other '_maybe_load_*' functions for parts of the
+    # database work the same way
+    if loaded is None:
+        loaded = _maybe_load_database()
+
+    if loaded.columns is not None:
+        return loaded
+
+    with _load_lock:
+        if loaded.columns is None:
+            if isinstance(loaded.database, _ColumnarDatabase):
+                loaded.columns = loaded.database
+            else:
+                loaded.columns = _ColumnarDatabase.from_dict(loaded.database)
+
+    return loaded
+
+def _name_trigrams(name):
+    from fuzzywuzzy import utils
+
+    # Trigrams are only padded at the start of each token, so the trigrams of
+    # a query are a subset of the trigrams of any longer query that it is
+    # a prefix of
+    trigrams = set()
+
+    for token in utils.full_process(name).split():
+        token = '  ' + token
+        for i in range(len(token) - 2):
+            trigrams.add(token[i:i + 3])
+
+    return trigrams
+
+def _build_search_index(food_names):
+    names = list(food_names)
+    trigrams = {}
+
+    for name_id, name in enumerate(names):
+        for trigram in _name_trigrams(name):
+            trigrams.setdefault(trigram, []).append(name_id)
+
+    return {'names': names, 'trigrams': trigrams}
+
+def _process_names(food_names):
+    # Processes the names like the fuzzy matcher does before scoring them,
+    # both with and without removing non-ASCII characters
+    from fuzzywuzzy import utils
+
+    return {
+        force_ascii: [utils.full_process(name, force_ascii=force_ascii) for name in food_names]
+        for force_ascii in [True, False]
+    }
+
+def _add_name_stats(index):
+    # Adds the statistics that bound the scores of the processed names, see
+    # 'foodypy.scoring'
+    index['name_stats'] = {
+        force_ascii: scoring._name_stats(processed_names)
+        for force_ascii, processed_names in index['processed_names'].items()
+    }
+
+def _maybe_load_search_index(loaded=None):
+    if loaded is None:
+        loaded = _maybe_load_database()
+
+    if loaded.search_index is not None:
+        return loaded
+
+    with _load_lock:
+        if loaded.search_index is not None:
+            return loaded
+
+        with _span('search_index.load'):
+            index = _read_cache(_index_cache_path, loaded.version)
+
+            if index is None:
+                if os.path.exists(_index_path):
+                    with open(_index_path) as json_file:
+                        index = json.loads(json_file.read())
+
+                # Databases installed before the index existed, or an index
+                # that is out of date, get a fresh index
+                if index is None or index['names'] != list(loaded.database.keys()):
+                    index = _build_search_index(loaded.database.keys())
+
+                index['processed_names'] = _process_names(index['names'])
+                _add_name_stats(index)
+                _write_cache(_index_cache_path, index, loaded.version)
+
+            # Caches written before the statistics existed
+            elif 'name_stats' not in index:
+                _add_name_stats(index)
+                _write_cache(_index_cache_path, index, loaded.version)
+
+            loaded.search_index = index
+
+    return loaded
+
+def _normalize_search_term(food_name):
+    from fuzzywuzzy import utils
+    return ' '.join(utils.full_process(food_name).split())
+
+def _overlap_counts(loaded, search_term):
+    # Counts the trigrams that each name shares with a normalized search term.
+    # If the counts of a shorter search term that this one starts with are
+    # cached, only the trigrams that this one adds need to be counted
+    trigrams = loaded.search_index['trigrams']
+    search_trigrams = _name_trigrams(search_term)
+    prefix_counts = None
+
+    with _search_cache_lock:
+        for prefix_len in range(len(search_term) - 1, 2, -1):
+            prefix_key = (loaded.version, search_term[:prefix_len])
+            prefix_counts = _overlap_cache.get(prefix_key)
+
+            if prefix_counts is not None:
+                _overlap_cache.move_to_end(prefix_key)
+                _search_cache_stats['prefix_hits'] += 1
+                break
+
+    # Cached counts are never modified, so they can be copied without the lock
+    if prefix_counts is not None:
+        search_trigrams = search_trigrams - _name_trigrams(search_term[:prefix_len])
+        overlap_counts = prefix_counts.copy()
+    else:
+        overlap_counts = collections.Counter()
+
+    for trigram in search_trigrams:
+        overlap_counts.update(trigrams.get(trigram, ()))
+
+    with _search_cache_lock:
+        _overlap_cache[(loaded.version, search_term)] = overlap_counts
+
+        while len(_overlap_cache) > _overlap_cache_max_size:
+            _overlap_cache.popitem(last=False)
+
+    return overlap_counts
+
+def _search_candidates(loaded, search_term):
+    # Returns the IDs of the names that share the most trigrams with the
+    # search term, including all the names tied with the last one, in
+    # database order
+    names = loaded.search_index['names']
+
+    # Queries shorter than a trigram can partially match almost anything, so
+    # they are scored against the whole database
+    if len(search_term) < 3:
+        return range(len(names))
+
+    overlap_counts = _overlap_counts(loaded, search_term)
+
+    if not overlap_counts:
+        return range(len(names))
+
+    shortlist = overlap_counts.most_common(_search_shortlist_size)
+
+    if len(shortlist) == _search_shortlist_size:
+        min_count = shortlist[-1][1]
+        name_ids = [
+            name_id for name_id, count in overlap_counts.items()
+            if count >= min_count]
+    else:
+        name_ids = [name_id for name_id, _ in shortlist]
+
+    # Keep database order, so that ties in the fuzzy score are broken the
+    # same way as in a full scan of the database
+    name_ids.sort()
+
+    return name_ids
+
+# Scorers from 'fuzzywuzzy.fuzz' that can be selected by name in 'search'
+_search_scorers = [
+    'WRatio',
+    'QRatio',
+    'ratio',
+    'partial_ratio',
+    'token_sort_ratio',
+    'token_set_ratio',
+    'partial_token_sort_ratio',
+    'partial_token_set_ratio',
+]
+
+def _get_scorer(scorer):
+    # Returns the scoring function, whether it expects strings processed with
+    # non-ASCII characters removed, and the name of the scorer if its scores
+    # can be bounded, or None. Strings are processed the same way as
+    # 'fuzzywuzzy.process.extract' does
+    from fuzzywuzzy import fuzz
 
-    if _database is None:
-        check(os.path.exists(_data_path), RuntimeError, lambda: (
-            "Cannot load database because it has not been installed "
-            "please run 'foodypy.install_database()'"))
+    if scorer is None:
+        scorer = 'WRatio'
 
-        with open(_data_path) as json_file:
-            _database = json.loads(json_file.read())
+    if isinstance(scorer, str):
+        check(scorer in _search_scorers, ValueError, lambda: (
+            f"Unknown scorer '{scorer}'. Expected one of {_search_scorers}"))
 
-def search(food_name, limit=10):
+        if scorer in ['ratio', 'partial_ratio']:
+            return getattr(fuzz, scorer), False, scorer
+
+        return functools.partial(getattr(fuzz, scorer), full_process=False), True, scorer
+
+    check(callable(scorer), TypeError, lambda: (
+        f"Expected 'scorer' to be a str, callable, or None, but got {type(scorer)}"))
+
+    return scorer, False, None
+
+def _check_limit(limit):
+    check_type(limit, (int, type(None)), 'limit')
+    check(limit is None or limit >= 0, ValueError, lambda: (
+        f"Expected 'limit' to be None or >= 0, but got {limit}"))
+
+def _score_candidates(search_index, search_term, name_ids, scorer, limit, score_cutoff):
+    # Returns the 'limit' best names in 'search_index' with scores of at least
+    # 'score_cutoff', in the same order as 'process.extractBests'. The
+    # candidates in 'name_ids' are scored first, and the other names are
+    # only scored if the upper bound of their score can beat the results so
+    # far, see 'foodypy.scoring'
+    from fuzzywuzzy import utils
+
+    score_func, force_ascii, bounded_scorer = _get_scorer(scorer)
+    query = utils.full_process(search_term, force_ascii=force_ascii)
+    names = search_index['names']
+    processed_names = search_index['processed_names'][force_ascii]
+
+    if limit == 0:
+        return []
+
+    # Heap of the best results so far. Ties are won by the name that comes
+    # first in the database
+    best = []
+
+    def is_full():
+        return limit is not None and len(best) == limit
+
+    def add_result(score, name_id):
+        result = (score, -name_id)
+
+        if not is_full():
+            heapq.heappush(best, result)
+        elif result > best[0]:
+            heapq.heapreplace(best, result)
+
+    if bounded_scorer is None:
+        for name_id in range(len(names)):
+            score = score_func(query, processed_names[name_id])
+
+            if score >= score_cutoff:
+                add_result(score, name_id)
+    else:
+        scoring_query = scoring._Query(query)
+        upper_bounds = scoring._upper_bounds(
+            bounded_scorer, scoring_query, search_index['name_stats'][force_ascii])
+
+        def score_in_order(ordered_ids):
+            # Names are visited from the highest upper bound down, so the
+            # visit stops once no remaining name can beat the worst result
+            for name_id in ordered_ids:
+                upper_bound = upper_bounds[name_id]
+
+                if upper_bound < score_cutoff or (is_full() and upper_bound < best[0][0]):
+                    break
+
+                # The score needed to beat the worst result, which wins ties
+                # if it comes first in the database
+                needed = score_cutoff
+
+                if is_full():
+                    worst_score, neg_worst_id = best[0]
+                    needed = max(needed, worst_score + (name_id > -neg_worst_id))
+
+                if upper_bound < needed or not scoring._reaches(
+                        bounded_scorer, scoring_query, processed_names[name_id], needed):
+                    continue
+
+                score = score_func(query, processed_names[name_id])
+
+                if score >= needed:
+                    add_result(score, name_id)
+
+        # The sorts are stable, so names with equal bounds stay in database
+        # order
+        name_ids = np.asarray(name_ids, dtype=np.int64)
+        score_in_order(name_ids[np.argsort(-upper_bounds[name_ids], kind='stable')])
+
+        min_bound = best[0][0] if is_full() else score_cutoff
+        remaining = upper_bounds >= min_bound
+        remaining[name_ids] = False
+        other_ids = np.flatnonzero(remaining)
+        score_in_order(other_ids[np.argsort(-upper_bounds[other_ids], kind='stable')])
+
+    best.sort(reverse=True)
+
+    return [(names[-neg_name_id], score) for score, neg_name_id in best]
+
+def _search_cache_get(key):
+    with _search_cache_lock:
+        entry = _search_cache.get(key)
+
+        if entry is not None:
+            results, time_added = entry
+
+            if _search_cache_ttl is None or time.monotonic() - time_added < _search_cache_ttl:
+                _search_cache.move_to_end(key)
+                _search_cache_stats['hits'] += 1
+                return results
+
+            del _search_cache[key]
+
+        _search_cache_stats['misses'] += 1
+        return None
+
+def _search_cache_put(key, results):
+    with _search_cache_lock:
+        if _search_cache_max_size > 0:
+            _search_cache[key] = (results, time.monotonic())
+
+            while len(_search_cache) > _search_cache_max_size:
+                _search_cache.popitem(last=False)
+
+def search_cache_info():
+    '''
+    Get statistics of the cache of search results used by
+    :func:`foodypy.search`.
+
+    Returns:
+      dict:
+        Dict with the following items:
+
+        * ``'hits'`` (int): Number of searches that were answered from the
+          cache
+
+        * ``'misses'`` (int): Number of searches that were not
+
+        * ``'prefix_hits'`` (int): Number of misses that reused the work done
+          for a shorter search term that the search term starts with
+
+        * ``'size'`` (int): Number of cached results
+
+        * ``'max_size'`` (int): Maximum number of cached results
+
+        * ``'ttl'`` (float or None): Number of seconds that results stay
+          cached
+    '''
+    return dict(
+        _search_cache_stats,
+        size=len(_search_cache),
+        max_size=_search_cache_max_size,
+        ttl=_search_cache_ttl)
+
+def clear_search_cache():
+    '''
+    Clear the cache of search results used by :func:`foodypy.search`, and
+    reset its statistics.
+    '''
+    with _search_cache_lock:
+        _search_cache.clear()
+        _overlap_cache.clear()
+
+        for key in _search_cache_stats:
+            _search_cache_stats[key] = 0
+
+def configure_search_cache(max_size=1024, ttl=None):
+    '''
+    Configure the cache of search results used by :func:`foodypy.search`.
+    The cache is cleared.
+
+    Args:
+
+      max_size (int, optional):
+        Maximum number of cached results. When the cache is full, the least
+        recently used result is dropped. If ``0``, results are not cached.
+
+        Default: 1024
+
+      ttl (float, optional):
+        Number of seconds that results stay cached. If ``None``, results stay
+        cached until they are dropped to make room for others, or the database
+        is reinstalled.
+
+        Default: None
+    '''
+    global _search_cache_max_size, _search_cache_ttl
+
+    check_type(max_size, int, 'max_size')
+    check(max_size >= 0, ValueError, lambda: (
+        f"Expected 'max_size >= 0' but got {max_size}"))
+
+    if ttl is not None:
+        check_type(ttl, (int, float), 'ttl')
+        check(ttl > 0, ValueError, lambda: f"Expected 'ttl > 0' but got {ttl}")
+
+    _search_cache_max_size = max_size
+    _search_cache_ttl = ttl
+    clear_search_cache()
+
+@_instrumented('search')
+def search(food_name, limit=10, scorer=None, score_cutoff=0):
     '''
 
     Search foods in the database which match the search term most closely. This
     uses a fuzzy string search to find the most relevant matches.
 
+    The search runs in stages. The foods that share the most character
+    trigrams with the search term are scored first. An upper bound of the
+    score of every other food is computed from the characters and words that
+    it has in common with the search term, and only the foods whose bound can
+    beat the results found so far are scored. The results are the same as
+    scoring every food in the database.
+
+    The search term is normalized by lowercasing it and removing punctuation
+    and extra whitespace. Results are cached for each normalized search term
+    and limit. See :func:`foodypy.configure_search_cache`.
+
     Args:
 
       food_name (str):
         Search term
 
       limit (int, optional):
-        The maximum number of search results to return.
+        The maximum number of search results to return. If ``None``, return
+        all the foods with scores of at least ``score_cutoff``.
 
         Default: 10
 
+      scorer (str or callable, optional):
+        How to score each food name. Either the name of a scorer from
+        ``fuzzywuzzy.fuzz``, like ``'WRatio'``, ``'ratio'``, or
+        ``'token_set_ratio'``, or a function that takes the processed search
+        term and food name and returns a score between 0 and 100. A function
+        is called for every food in the database, since its scores cannot be
+        bounded. If ``None``, use ``'WRatio'``.
+
+        Default: None
+
+      score_cutoff (int, optional):
+        Leave out results with scores below this.
+
+        Default: 0
+
     Returns:
       list[tuple[str, int]]:
 
@@ -206,10 +1853,323 @@ def search(food_name, limit=10):
         food.
 
     '''
-    _maybe_load_database()
-    results = process.extract(food_name, _database.keys(), limit=limit)
+    _check_limit(limit)
+
+    # The database is only taken once, so that the whole search uses the same
+    # version of it even if another thread reloads it
+    loaded = _maybe_load_search_index()
+
+    # Check the scorer even when the results are cached
+    _get_scorer(scorer)
+
+    search_term = _normalize_search_term(food_name)
+    key = (loaded.version, search_term, limit, scorer, score_cutoff)
+    results = _search_cache_get(key)
+
+    if results is None:
+        _count('search.cache_misses')
+        name_ids = _search_candidates(loaded, search_term)
+
+        with _span('search.score', candidates=len(name_ids)):
+            results = _score_candidates(
+                loaded.search_index, search_term, name_ids, scorer, limit, score_cutoff)
+
+        _search_cache_put(key, results)
+    else:
+        _count('search.cache_hits')
+
+    return list(results)
+
+def _init_search_worker(version, database, search_index):
+    global _loaded
+    _loaded = _LoadedDatabase(version, database, search_index)
+
+@_instrumented('search_many')
+def search_many(food_names, limit=10, workers=None, scorer=None, score_cutoff=0):
+    '''
+    Search the database for each of several search terms. This gives the same
+    results as calling :func:`foodypy.search` for each search term, but the
+    searches are spread across a pool of processes.
+
+    Args:
+
+      food_names (list[str]):
+        Search terms
+
+      limit (int, optional):
+        The maximum number of search results to return for each search term.
+
+        Default: 10
+
+      workers (int, optional):
+        The number of worker processes to use. If ``None``, use the number of
+        CPUs. If ``1``, search in the calling process.
+
+        Default: None
+
+      scorer (str or callable, optional):
+        How to score each food name. See :func:`foodypy.search`. A function
+        must be picklable to be used with more than one worker.
+
+        Default: None
+
+      score_cutoff (int, optional):
+        Leave out results with scores below this.
+
+        Default: 0
+
+    Returns:
+      list[list[tuple[str, int]]]:
+
+        List of the search results for each search term, in the same order as
+        ``food_names``. See :func:`foodypy.search`.
+    '''
+    food_names = list(food_names)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    check(workers >= 1, ValueError, lambda: (
+        f"Expected 'workers >= 1' but got {workers}"))
+    _check_limit(limit)
+
+    # Load the database and index once here, so that they are handed to each
+    # worker instead of being loaded separately by each one
+    loaded = _maybe_load_search_index()
+
+    _get_scorer(scorer)
+    workers = min(workers, len(food_names))
+    search_func = functools.partial(
+        search, limit=limit, scorer=scorer, score_cutoff=score_cutoff)
+
+    if workers <= 1:
+        return [search_func(food_name) for food_name in food_names]
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_search_worker,
+            initargs=(loaded.version, loaded.database, loaded.search_index)) as executor:
+        chunksize = max(1, len(food_names) // (4 * workers))
+        return list(executor.map(
+            search_func,
+            food_names,
+            chunksize=chunksize))
+
+# Metrics that 'foodypy.similar' can use, mapped to the vectors of the similar
+# index that they are measured between and the p-norm of their difference
+_similar_metrics = {
+    'euclidean': ('scaled', 2),
+    'manhattan': ('scaled', 1),
+    'cosine': ('unit', 2),
+}
+
+def _build_similar_index(table):
+    # Each field is divided by its standard deviation across foods, so that
+    # fields measured in micrograms count as much as fields measured in grams.
+    # The 'unit' vectors are also scaled to a length of 1, so that the
+    # distance between them only depends on the angle between them. KD-trees
+    # are only built if SciPy is installed
+    scale = table.std(axis=0)
+    scale[scale == 0] = 1
+    scaled = np.ascontiguousarray(table / scale)
+    norms = np.linalg.norm(scaled, axis=1, keepdims=True)
+    unit = scaled / np.where(norms > 0, norms, 1)
+    index = {
+        'vectors': {'scaled': scaled, 'unit': unit},
+        'squared_norms': {'scaled': norms[:, 0] ** 2, 'unit': (unit ** 2).sum(axis=1)},
+        'trees': None,
+    }
+
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        pass
+    else:
+        index['trees'] = {name: cKDTree(vectors) for name, vectors in index['vectors'].items()}
+
+    return index
+
+def _maybe_load_similar_index(loaded=None):
+    loaded = _maybe_load_columns(loaded)
+
+    if loaded.similar_index is not None:
+        return loaded
+
+    with _load_lock:
+        if loaded.similar_index is not None:
+            return loaded
+
+        with _span('similar_index.load'):
+            index = _read_cache(_similar_cache_path, loaded.version)
+
+            if index is None:
+                index = _build_similar_index(loaded.columns.table)
+                _write_cache(_similar_cache_path, index, loaded.version)
+
+            loaded.similar_index = index
+
+    return loaded
+
+def _nearest_rows(index, vectors_name, query_rows, count, p):
+    # Returns the rows of the 'count' nearest vectors to the vector of each
+    # query row, and their distances, both with shape (len(query_rows), count)
+    vectors = index['vectors'][vectors_name]
+    queries = vectors[query_rows]
+
+    if index['trees'] is not None:
+        distances, rows = index['trees'][vectors_name].query(queries, k=count, p=p)
+        return (
+            rows.reshape(len(queries), count),
+            distances.reshape(len(queries), count))
+
+    rows = np.empty((len(queries), count), dtype=np.intp)
+    distances = np.empty((len(queries), count))
+    squared_norms = index['squared_norms'][vectors_name]
+
+    # Without a tree, the distances to all the vectors are calculated, for
+    # a chunk of queries at a time to limit memory use
+    chunk_size = max(1, 2 ** 22 // vectors.size)
+
+    for start in range(0, len(queries), chunk_size):
+        chunk = slice(start, start + chunk_size)
+
+        if p == 2:
+            # Squared distances are compared, and only the nearest are square
+            # rooted
+            chunk_distances = (
+                squared_norms[query_rows[chunk], None]
+                - 2 * queries[chunk] @ vectors.T
+                + squared_norms)
+        else:
+            chunk_distances = np.abs(queries[chunk, None, :] - vectors).sum(axis=2)
+
+        chunk_rows = np.argpartition(chunk_distances, count - 1, axis=1)[:, :count]
+        chunk_distances = np.take_along_axis(chunk_distances, chunk_rows, axis=1)
+        order = np.argsort(chunk_distances, axis=1, kind='stable')
+        rows[chunk] = np.take_along_axis(chunk_rows, order, axis=1)
+        distances[chunk] = np.take_along_axis(chunk_distances, order, axis=1)
+
+        if p == 2:
+            distances[chunk] = np.sqrt(np.maximum(distances[chunk], 0))
+
+    return rows, distances
+
+def similar(food_name, k=10, metric='euclidean'):
+    '''
+    Find the foods in the database with the most similar nutrients to the
+    specified food, like to find substitutes for it.
+
+    Foods are compared by their nutrients per gram, with each field divided by
+    its standard deviation across the database, so that each field counts
+    about as much as the others. The index that is searched is built when the
+    database is installed, and loaded the first time that it is needed. If
+    SciPy is installed, the index is a KD-tree.
+
+    Args:
+
+      food_name (str):
+        The name of the food in the database
+
+      k (int, optional):
+        The number of similar foods to return.
+
+        Default: 10
+
+      metric (str, optional):
+        How to measure the difference between the nutrients of two foods.
+        ``'euclidean'`` and ``'manhattan'`` measure the distance between them.
+        ``'cosine'`` measures the angle between them, as one minus its cosine,
+        so foods with nutrients in the same proportions are similar no matter
+        how dense they are.
+
+        Default: ``'euclidean'``
+
+    Returns:
+      list[tuple[str, float]]:
+
+        List of the most similar foods, ordered from most to least similar.
+        Each result is a tuple containing the name of the food in the
+        database, paired with its distance from the specified food. The
+        specified food is left out.
+    '''
+    return similar_many([food_name], k=k, metric=metric)[0]
+
+@_instrumented('similar_many')
+def similar_many(food_names, k=10, metric='euclidean'):
+    '''
+    Find the most similar foods to each of several foods. This gives the same
+    results as calling :func:`foodypy.similar` for each food, but all the
+    foods are looked up in the index at once.
+
+    Args:
+
+      food_names (list[str]):
+        The names of the foods in the database
+
+      k (int, optional):
+        The number of similar foods to return for each food.
+
+        Default: 10
+
+      metric (str, optional):
+        How to measure the difference between the nutrients of two foods. See
+        :func:`foodypy.similar`.
+
+        Default: ``'euclidean'``
+
+    Returns:
+      list[list[tuple[str, float]]]:
+
+        List of the most similar foods to each food, in the same order as
+        ``food_names``. See :func:`foodypy.similar`.
+    '''
+    food_names = list(food_names)
+    check_type(k, int, 'k')
+    check(k >= 0, ValueError, lambda: f"Expected 'k >= 0' but got {k}")
+    check(metric in _similar_metrics, ValueError, lambda: (
+        f"Expected 'metric' to be one of {list(_similar_metrics)}, but got "
+        f"'{metric}'"))
+
+    loaded = _maybe_load_similar_index()
+    columns = loaded.columns
+    query_rows = []
+
+    for food_name in food_names:
+        row = columns._row(food_name)
+        check(row is not None, ValueError, lambda: (
+            f"Did not find exact name '{food_name}' in database. "
+            "Use 'foodypy.search' to find existing matches"))
+        query_rows.append(row)
+
+    vectors_name, p = _similar_metrics[metric]
+
+    # Each food is usually its own nearest neighbor, so one more is found
+    # than is needed
+    count = min(k + 1, len(columns))
+
+    if count == 0 or len(query_rows) == 0:
+        return [[] for _ in query_rows]
+
+    rows, distances = _nearest_rows(
+        loaded.similar_index, vectors_name, np.array(query_rows, dtype=np.intp), count, p)
+
+    if metric == 'cosine':
+        # The distance between unit vectors is 'sqrt(2 - 2 cos(angle))'
+        distances = distances ** 2 / 2
+
+    results = []
+
+    for query_row, neighbor_rows, neighbor_distances in zip(
+            query_rows, rows.tolist(), distances.tolist()):
+        results.append([
+            (columns.names[row], distance)
+            for row, distance in zip(neighbor_rows, neighbor_distances)
+            if row != query_row
+        ][:k])
+
     return results
 
+@_instrumented('get')
 def get(food_name):
     '''
     Get the :class:`foodypy.Nutrients` for one gram of the specified food in
@@ -222,12 +2182,97 @@ def get(food_name):
     Returns:
       :class:`foodypy.Nutrients`
     '''
-    _maybe_load_database()
-    check(food_name in _database, ValueError, lambda: (
+    columns = _maybe_load_columns().columns
+    row = columns._row(food_name)
+    check(row is not None, ValueError, lambda: (
+        f"Did not find exact name '{food_name}' in database. "
+        "Use 'foodypy.search' to find existing matches"))
+    return Nutrients._from_values(columns.table[row].copy())
+
+@_instrumented('get_many')
+def get_many(food_names):
+    '''
+    Get the nutrients for one gram of each of the specified foods in the
+    database, gathered into one array.
+
+    This avoids creating a :class:`foodypy.Nutrients` for each food, so it is
+    much faster than calling :func:`foodypy.get` for many foods.
+
+    Args:
+
+      food_names (list[str]): The names of the foods in the database
+
+    Returns:
+      :class:`foodypy.NutrientsArray`:
+        Array of shape ``(len(food_names),)`` with one element per food.
+    '''
+    columns = _maybe_load_columns().columns
+    return NutrientsArray._from_values(columns.gather(list(food_names)))
+
+def _maybe_load_metadata(loaded=None):
+    if loaded is None:
+        loaded = _maybe_load_database()
+
+    if loaded.metadata is not None:
+        return loaded
+
+    with _load_lock:
+        if loaded.metadata is None:
+            with _span('metadata.load'):
+                # Databases installed before metadata was recorded have none
+                if os.path.exists(_metadata_path):
+                    with open(_metadata_path) as json_file:
+                        loaded.metadata = json.loads(json_file.read())
+                else:
+                    loaded.metadata = {}
+
+    return loaded
+
+def _maybe_load_portions(loaded=None):
+    loaded = _maybe_load_columns(loaded)
+
+    if loaded.portion_table is not None:
+        return loaded
+
+    with _load_lock:
+        if loaded.portion_table is not None:
+            return loaded
+
+        with _span('portions.load'):
+            table = _read_cache(_portions_cache_path, loaded.version)
+
+            # Databases installed before portions were recorded have none
+            if table is None:
+                metadata = _maybe_load_metadata(loaded).metadata
+                table = portions._build_portion_table(
+                    metadata.get(name, {}).get('portions') for name in loaded.columns.names)
+                _write_cache(_portions_cache_path, table, loaded.version)
+
+            loaded.portion_table = table
+
+    return loaded
+
+def get_source(food_name):
+    '''
+    Get the name of the FoodData Central dataset that the specified food in
+    the database came from. See :func:`foodypy.install_database`.
+
+    Args:
+
+      food_name (str): The name of the food in the database
+
+    Returns:
+      str or None:
+        The name of the dataset, like ``'sr_legacy'``, or ``None`` if the
+        database was installed without recording it.
+    '''
+    loaded = _maybe_load_metadata()
+    check(food_name in loaded.database, ValueError, lambda: (
         f"Did not find exact name '{food_name}' in database. "
         "Use 'foodypy.search' to find existing matches"))
-    return Nutrients(**_database[food_name])
+    return loaded.metadata.get(food_name, {}).get('source')
 
+@_instrumented('copy_database')
 def copy_database():
     '''
     Get a copy of the database.
@@ -236,10 +2281,11 @@ def copy_database():
       dict[str, :class:`foodypy.Nutrients`]:
         A copy of the FoodyPy database, keyed by food names.
     '''
-    _maybe_load_database()
+    columns = _maybe_load_columns().columns
+    table = columns.table.copy()
     db = {}
 
-    for food_name, nutrients_raw in _database.items():
-        db[food_name] = Nutrients(**nutrients_raw)
+    for row, food_name in enumerate(columns.names):
+        db[food_name] = Nutrients._from_values(table[row])
 
     return db
@@ -0,0 +1,230 @@
+import functools
+import threading
+import time
+import warnings
+
+from .error_checking import check
+
+# Instrumentation is off unless it is enabled, and then each instrumented
+# operation only checks this flag
+_enabled = False
+
+_hooks = []
+_span_stats = {}
+_counters = {}
+_stats_lock = threading.Lock()
+
+# The spans that are open in each thread, so that each span knows its parent
+_local = threading.local()
+
+class Span:
+    '''
+    A timed operation inside FoodyPy, which is given to the hooks added with
+    :func:`foodypy.add_span_hook` when it ends.
+
+    Attributes:
+
+      name (str): Name of the operation, like ``'search'`` or
+        ``'database.load'``
+
+      start_time (float): Time that the operation started, in seconds since
+        the epoch
+
+      duration (float): Seconds that the operation took
+
+      attributes (dict): Details of the operation, like the number of search
+        candidates that were scored
+
+      parent (:class:`foodypy.instrumentation.Span` or None): The operation
+        that this one ran inside of, in the same thread
+
+      error (BaseException or None): The error that the operation raised, if
+        any
+    '''
+    __slots__ = ('name', 'start_time', 'duration', 'attributes', 'parent', 'error', '_start')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.error = None
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+
+        if stack is None:
+            stack = _local.stack = []
+
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+        _local.stack.pop()
+
+        with _stats_lock:
+            stats = _span_stats.get(self.name)
+
+            if stats is None:
+                stats = _span_stats[self.name] = {
+                    'count': 0, 'errors': 0, 'total_s': 0.0, 'max_s': 0.0}
+
+            stats['count'] += 1
+            stats['errors'] += error is not None
+            stats['total_s'] += self.duration
+            stats['max_s'] = max(stats['max_s'], self.duration)
+
+        for hook in list(_hooks):
+            try:
+                hook(self)
+            except Exception as hook_error:
+                # An exporter that fails must not break the operation
+                warnings.warn(f"FoodyPy span hook {hook!r} raised {hook_error!r}")
+
+    def __repr__(self):
+        return f'Span({self.name!r}, duration={self.duration!r}, attributes={self.attributes!r})'
+
+class _NullSpan:
+    # Used in place of a span while instrumentation is disabled
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        pass
+
+_null_span = _NullSpan()
+
+def _span(name, **attributes):
+    # Returns a context manager that times the operation inside it, if
+    # instrumentation is enabled
+    if not _enabled:
+        return _null_span
+
+    return Span(name, attributes)
+
+def _instrumented(name):
+    # Decorates a function so that each call to it is a span
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def _count(name, value=1):
+    # Adds to a counter, if instrumentation is enabled
+    if _enabled:
+        with _stats_lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+def enable_instrumentation():
+    '''
+    Start timing and counting the operations inside FoodyPy, like loading the
+    database, searching, and getting nutrients. While instrumentation is
+    disabled, which is the default, it costs almost nothing, so it can be
+    enabled and disabled in production as needed.
+
+    See :func:`foodypy.stats` and :func:`foodypy.add_span_hook`.
+    '''
+    global _enabled
+    _enabled = True
+
+def disable_instrumentation():
+    '''
+    Stop timing and counting the operations inside FoodyPy. The statistics
+    that were collected are kept.
+    '''
+    global _enabled
+    _enabled = False
+
+def add_span_hook(hook):
+    '''
+    Add a function that is called with each :class:`foodypy.instrumentation.Span`
+    when it ends, while instrumentation is enabled. This can be used to export
+    spans to a tracing system, like OpenTelemetry. Hooks are called in the
+    thread that ran the operation, so they should be fast.
+
+    Args:
+      hook (callable): Function that takes a span
+
+    Returns:
+      callable: The hook, so that this can be used as a decorator
+    '''
+    check(callable(hook), TypeError, lambda: (
+        f"Expected 'hook' to be callable, but got {type(hook)}"))
+
+    with _stats_lock:
+        _hooks.append(hook)
+
+    return hook
+
+def remove_span_hook(hook):
+    '''
+    Remove a function added with :func:`foodypy.add_span_hook`.
+
+    Args:
+      hook (callable): The hook to remove
+    '''
+    with _stats_lock:
+        check(hook in _hooks, ValueError, lambda: f"Hook {hook!r} was not added")
+        _hooks.remove(hook)
+
+def stats(reset=False):
+    '''
+    Get a snapshot of the statistics collected while instrumentation was
+    enabled. See :func:`foodypy.enable_instrumentation`.
+
+    Args:
+
+      reset (bool, optional):
+        If ``True``, clear the statistics after taking the snapshot.
+
+        Default: False
+
+    Returns:
+      dict:
+        Dict with the following items:
+
+        * ``'enabled'`` (bool): Whether instrumentation is enabled
+
+        * ``'spans'`` (dict[str, dict]): For each operation, like
+          ``'search'``, the number of times it ran (``'count'``), the number
+          of times it raised an error (``'errors'``), and the total, mean, and
+          longest number of seconds it took (``'total_s'``, ``'mean_s'``,
+          ``'max_s'``)
+
+        * ``'counters'`` (dict[str, int]): Counts of events, like
+          ``'search.cache_hits'``
+    '''
+    with _stats_lock:
+        snapshot = {
+            'enabled': _enabled,
+            'spans': {
+                name: dict(span_stats, mean_s=span_stats['total_s'] / span_stats['count'])
+                for name, span_stats in _span_stats.items()
+            },
+            'counters': dict(_counters),
+        }
+
+        if reset:
+            _span_stats.clear()
+            _counters.clear()
+
+    return snapshot
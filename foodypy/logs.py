@@ -0,0 +1,449 @@
+import collections.abc
+
+import numpy as np
+
+from . import database
+from .error_checking import check_type, check_value
+from .instrumentation import _count, _instrumented
+from .nutrients import NutrientsArray, _field_names
+
+# Periods that log rows can be grouped by
+_periods = ['day', 'week', 'month']
+
+# Rows of a log are aggregated this many at a time, so that memory use does
+# not grow with the size of the log
+_default_chunk_size = 1 << 20
+
+_default_columns = {
+    'user': 'user',
+    'timestamp': 'timestamp',
+    'food': 'food',
+    'grams': 'grams',
+}
+
+def _is_chunk(log):
+    # A chunk is a dict of columns, a pandas DataFrame, or an Arrow Table or
+    # RecordBatch. Anything else is an iterable of chunks
+    return (
+        isinstance(log, collections.abc.Mapping)
+        or hasattr(log, 'columns')
+        or hasattr(log, 'num_rows'))
+
+def _chunk_columns(chunk, columns):
+    # Returns the user, timestamp, food, and grams columns of a chunk as NumPy
+    # arrays. Indexing by name works the same way for dicts, DataFrames, and
+    # Arrow tables, and each of their columns converts to a NumPy array
+    arrays = []
+
+    for key in ['user', 'timestamp', 'food', 'grams']:
+        name = columns[key]
+
+        try:
+            column = chunk[name]
+        except KeyError:
+            raise ValueError(f"Expected the log to have a '{name}' column") from None
+
+        arrays.append(np.asarray(column))
+
+    users, timestamps, foods, grams = arrays
+    num_rows = len(users)
+    check_value(all(len(array) == num_rows for array in arrays), lambda: (
+        "Expected the columns of the log to have the same length, but got "
+        f"lengths {[len(array) for array in arrays]}"))
+
+    return users, timestamps, foods, grams.astype(np.float64, copy=False)
+
+def _period_numbers(timestamps, by):
+    # Returns the number of the period that each timestamp is in. Days and
+    # months are counted from 1970-01-01, and weeks start on Monday
+    if np.issubdtype(timestamps.dtype, np.number):
+        timestamps = timestamps.astype('datetime64[s]')
+    elif not np.issubdtype(timestamps.dtype, np.datetime64):
+        # Python datetimes and ISO 8601 strings
+        try:
+            timestamps = timestamps.astype('datetime64[us]')
+        except (TypeError, ValueError):
+            raise TypeError(
+                "Expected the timestamps of the log to be datetimes or numbers "
+                f"of seconds since the epoch, but got {timestamps.dtype}") from None
+
+    if by == 'month':
+        return timestamps.astype('datetime64[M]').astype(np.int64)
+
+    days = timestamps.astype('datetime64[D]').astype(np.int64)
+
+    if by == 'week':
+        # 1970-01-01 was a Thursday, so weeks are counted from 1969-12-29
+        return (days + 3) // 7
+
+    return days
+
+def _period_starts(periods, by):
+    # Returns the first day of each period
+    if by == 'month':
+        return periods.astype('datetime64[M]').astype('datetime64[D]')
+
+    if by == 'week':
+        return (periods * 7 - 3).astype('datetime64[D]')
+
+    return periods.astype('datetime64[D]')
+
+def _group(users, periods):
+    # Returns the user and period of each distinct pair of user and period,
+    # sorted by user and then period, and the index of the pair of each row
+    user_values, user_codes = np.unique(users, return_inverse=True)
+
+    if len(periods) == 0:
+        return user_values, periods.astype(np.int64), np.zeros(0, dtype=np.int64)
+
+    first_period = periods.min()
+    num_periods = periods.max() - first_period + 1
+    keys = user_codes.reshape(-1).astype(np.int64) * num_periods + (periods - first_period)
+    group_keys, group_idx = np.unique(keys, return_inverse=True)
+
+    return (
+        user_values[group_keys // num_periods],
+        group_keys % num_periods + first_period,
+        group_idx.reshape(-1))
+
+def _sum_groups(group_idx, num_groups, columns):
+    # Returns the sum of each of the columns in each group, with shape
+    # (len(columns), num_groups). Each column is summed with 'bincount', which
+    # is much faster than summing the rows of a 2-D array. Columns that are
+    # None are all zero
+    sums = np.zeros((len(columns), num_groups))
+
+    for column_idx, column in enumerate(columns):
+        if column is not None:
+            sums[column_idx] = np.bincount(group_idx, column, minlength=num_groups)
+
+    return sums
+
+class _Totals:
+    # Partial totals of each user and period, which are added up as chunks of
+    # a log are aggregated. The nutrient values are stored with one row per
+    # field, so that each field is contiguous
+    def __init__(self):
+        self.users = []
+        self.periods = []
+        self.values = []
+        self.grams = []
+        self.counts = []
+        self.num_partial = 0
+
+    def add(self, users, periods, values, grams, counts):
+        self.users.append(users)
+        self.periods.append(periods)
+        self.values.append(values)
+        self.grams.append(grams)
+        self.counts.append(counts)
+        self.num_partial += len(users)
+
+    def combine(self):
+        # Adds up the totals of the same user and period
+        if not self.users:
+            return (
+                np.zeros(0), np.zeros(0, dtype=np.int64),
+                np.zeros((len(_field_names), 0)), np.zeros(0),
+                np.zeros(0, dtype=np.int64))
+
+        # The totals of one chunk already have one element for each user and
+        # period
+        if len(self.users) == 1:
+            return self.users[0], self.periods[0], self.values[0], self.grams[0], self.counts[0]
+
+        users, periods, group_idx = _group(
+            np.concatenate(self.users), np.concatenate(self.periods))
+        num_groups = len(users)
+        values = _sum_groups(group_idx, num_groups, np.concatenate(self.values, axis=1))
+        grams = np.bincount(group_idx, np.concatenate(self.grams), minlength=num_groups)
+        counts = np.bincount(
+            group_idx, np.concatenate(self.counts), minlength=num_groups).astype(np.int64)
+
+        self.__init__()
+        self.add(users, periods, values, grams, counts)
+        return users, periods, values, grams, counts
+
+class _FoodRows:
+    # Database rows of food names, which are looked up once for each distinct
+    # name in the log. The same columns are used for the whole log, even if
+    # the database is reloaded in the meantime
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = {}
+
+    def __call__(self, food_names):
+        rows = np.empty(len(food_names), dtype=np.intp)
+
+        for i, food_name in enumerate(food_names.tolist()):
+            row = self.rows.get(food_name)
+
+            if row is None:
+                row = self.columns._row(food_name)
+                row = self.rows[food_name] = -1 if row is None else row
+
+            rows[i] = row
+
+        return rows
+
+def _aggregate_chunk(totals, food_rows, users, timestamps, foods, grams, by, errors):
+    periods = _period_numbers(timestamps, by)
+    food_names, food_codes = np.unique(foods, return_inverse=True)
+    food_codes = food_codes.reshape(-1)
+    rows = food_rows(food_names)
+
+    if (rows < 0).any():
+        unknown = food_names[rows < 0]
+
+        check_value(errors == 'ignore', lambda: (
+            f"Did not find exact name '{unknown[0]}' in database"
+            + (f", or {len(unknown) - 1} other foods in the log" if len(unknown) > 1 else '')
+            + ". Use 'foodypy.search' to find existing matches"))
+
+        known = rows[food_codes] >= 0
+        _count('logs.unknown_rows', int((~known).sum()))
+        users = users[known]
+        periods = periods[known]
+        food_codes = food_codes[known]
+        grams = grams[known]
+
+    if len(users) == 0:
+        return
+
+    group_users, group_periods, group_idx = _group(users, periods)
+    num_groups = len(group_users)
+
+    # The grams of each food in each group are added up first, so that the
+    # nutrients are only multiplied out once for each food in each group,
+    # rather than once for each row
+    pair_keys = group_idx.astype(np.int64) * len(food_names) + food_codes
+    pairs, pair_idx = np.unique(pair_keys, return_inverse=True)
+    pair_grams = np.bincount(pair_idx.reshape(-1), grams, minlength=len(pairs))
+    pair_groups = pairs // len(food_names)
+    pair_foods = pairs % len(food_names)
+
+    # Fields that none of the foods have are left out
+    food_table = food_rows.columns.table[rows].T
+    field_columns = [
+        food_table[field_idx][pair_foods] * pair_grams if food_table[field_idx].any() else None
+        for field_idx in range(len(_field_names))]
+
+    totals.add(
+        group_users,
+        group_periods,
+        _sum_groups(pair_groups, num_groups, field_columns),
+        np.bincount(group_idx, grams, minlength=num_groups),
+        np.bincount(group_idx, minlength=num_groups))
+
+def _result(users, periods, values, grams, counts, by):
+    return {
+        'user': users,
+        'period': _period_starts(periods, by),
+        'nutrients': NutrientsArray._from_values(np.ascontiguousarray(values.T)),
+        'grams': grams,
+        'count': counts,
+        'by': by,
+    }
+
+@_instrumented('logs.aggregate')
+def aggregate(log, by='day', columns=None, errors='raise', chunk_size=None):
+    '''
+    Calculate the total nutrients that each user logged in each day, week, or
+    month, from a food log with one row for each food that a user ate.
+
+    The log is columnar. Each distinct food name is looked up in the database
+    once, the grams of each food are added up for each user and period, and
+    the nutrients are calculated from those sums with array operations, so
+    logs with tens of millions of rows can be aggregated on one machine. Logs
+    that do not fit in memory can be given as an iterable of chunks, like the
+    batches of a Parquet file or ``pandas.read_csv(..., chunksize=...)``,
+    and only the totals are kept between chunks.
+
+    Args:
+
+      log (dict, DataFrame, Arrow Table, or iterable):
+        The log, as a dict of NumPy arrays or lists, a pandas DataFrame, an
+        Arrow Table or RecordBatch, or an iterable of any of those. It must
+        have these columns:
+
+        * ``'user'``: ID of the user, of any type that NumPy can sort, like
+          ints or strings
+
+        * ``'timestamp'``: Time that the food was eaten, as ``datetime64``
+          or as seconds since the epoch. Times are grouped into periods as
+          they are given, so local times should be given to group by the
+          user's local days
+
+        * ``'food'``: Exact name of the food in the database
+
+        * ``'grams'``: Grams of the food
+
+      by (str, optional):
+        The period to group by, either ``'day'``, ``'week'``, which starts
+        on Monday, or ``'month'``.
+
+        Default: ``'day'``
+
+      columns (dict[str, str], optional):
+        Names of the columns in the log, if they differ from the ones above,
+        like ``{'user': 'user_id', 'timestamp': 'eaten_at'}``.
+
+        Default: None
+
+      errors (str, optional):
+        If ``'raise'``, raise an error if a food is not in the database. If
+        ``'ignore'``, leave out the rows of foods that are not in the
+        database.
+
+        Default: ``'raise'``
+
+      chunk_size (int, optional):
+        The number of rows to aggregate at a time. Larger chunks are split,
+        so that memory use does not depend on the size of the log.
+
+        Default: 1048576
+
+    Returns:
+      dict:
+        Dict with the following items, with one element for each user and
+        period that has any rows in the log, sorted by user and then period:
+
+        * ``'user'`` (ndarray): The user
+
+        * ``'period'`` (ndarray of ``datetime64[D]``): The first day of the
+          period
+
+        * ``'nutrients'`` (:class:`foodypy.NutrientsArray`): Total nutrients
+
+        * ``'grams'`` (ndarray): Total grams of food
+
+        * ``'count'`` (ndarray): Number of rows in the log
+
+        * ``'by'`` (str): The period that was grouped by
+
+        This can be given to :func:`foodypy.logs.rolling`, or converted to
+        a DataFrame with ``pandas.DataFrame({'user': result['user'], ...})``.
+    '''
+    check_value(by in _periods, lambda: (
+        f"Expected 'by' to be one of {_periods}, but got '{by}'"))
+    check_value(errors in ['raise', 'ignore'], lambda: (
+        f"Expected 'errors' to be one of ['raise', 'ignore'], but got '{errors}'"))
+
+    if columns is None:
+        columns = {}
+
+    check_type(columns, dict, 'columns')
+
+    for key in columns:
+        check_value(key in _default_columns, lambda: (
+            f"Expected the keys of 'columns' to be in {list(_default_columns)}, "
+            f"but got '{key}'"))
+
+    columns = dict(_default_columns, **columns)
+
+    if chunk_size is None:
+        chunk_size = _default_chunk_size
+
+    check_type(chunk_size, int, 'chunk_size')
+    check_value(chunk_size >= 1, lambda: f"Expected 'chunk_size >= 1' but got {chunk_size}")
+
+    chunks = [log] if _is_chunk(log) else log
+    totals = _Totals()
+    food_rows = _FoodRows(database._maybe_load_columns().columns)
+
+    for chunk in chunks:
+        chunk_arrays = _chunk_columns(chunk, columns)
+        num_rows = len(chunk_arrays[0])
+        _count('logs.rows', num_rows)
+
+        for start in range(0, num_rows, chunk_size):
+            _aggregate_chunk(
+                totals, food_rows,
+                *(array[start:start + chunk_size] for array in chunk_arrays),
+                by, errors)
+
+        # The partial totals are combined once they could be as large as a
+        # chunk, which keeps them from growing with the number of chunks
+        if totals.num_partial > chunk_size:
+            totals.combine()
+
+    return _result(*totals.combine(), by)
+
+@_instrumented('logs.rolling')
+def rolling(totals, window, mean=False):
+    '''
+    Calculate the total nutrients of each user over a trailing window of
+    periods, from the result of :func:`foodypy.logs.aggregate`. For
+    instance, with daily totals and ``window=7``, the result for each day is
+    the total of that day and the 6 days before it.
+
+    Periods without any rows in the log count as zero, and only the periods
+    that have rows are included in the result.
+
+    Args:
+
+      totals (dict):
+        The result of :func:`foodypy.logs.aggregate`
+
+      window (int):
+        The number of periods in each window.
+
+      mean (bool, optional):
+        If ``True``, divide the totals by ``window``, to give the mean of
+        each period in the window.
+
+        Default: False
+
+    Returns:
+      dict:
+        Dict with the same items as ``totals``, where ``'nutrients'``,
+        ``'grams'``, and ``'count'`` are the totals of each window, and
+        ``'window'`` is the number of periods in each window.
+    '''
+    check_type(totals, dict, 'totals')
+    check_type(window, int, 'window')
+    check_value(window >= 1, lambda: f"Expected 'window >= 1' but got {window}")
+
+    by = totals['by']
+    users = totals['user']
+    periods = _period_numbers(totals['period'], by)
+
+    if len(users) == 0:
+        return dict(totals, window=window)
+
+    # Each user's periods are offset so that no window reaches into another
+    # user's periods
+    new_user = users[1:] != users[:-1]
+    user_codes = np.concatenate([[0], np.cumsum(new_user)])
+    first_period = periods.min()
+    user_span = periods.max() - first_period + window
+    keys = user_codes * user_span + (periods - first_period)
+
+    check_value((users[1:] >= users[:-1]).all() and (np.diff(keys) > 0).all(), lambda: (
+        "Expected 'totals' to be sorted by user and then period, with one "
+        "element for each, like the result of 'foodypy.logs.aggregate'"))
+
+    # The total of each window is the difference of two cumulative sums
+    window_starts = np.searchsorted(keys, keys - window, side='right')
+
+    def window_sums(array):
+        cumsum = np.zeros((len(array) + 1,) + array.shape[1:], dtype=array.dtype)
+        np.cumsum(array, axis=0, out=cumsum[1:])
+        sums = cumsum[1:]
+        sums -= cumsum[window_starts]
+        return sums
+
+    window_values = window_sums(totals['nutrients']._values.reshape(len(users), -1))
+    window_grams = window_sums(totals['grams'])
+    window_counts = window_sums(totals['count'])
+
+    if mean:
+        window_values /= window
+        window_grams /= window
+
+    return dict(
+        totals,
+        nutrients=NutrientsArray._from_values(window_values),
+        grams=window_grams,
+        count=window_counts,
+        window=window)
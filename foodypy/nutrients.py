@@ -1,15 +1,117 @@
+import numpy as np
+
 from .error_checking import check, check_type, check_value
 
+# Nutrient fields, with their units and descriptions, in the order that they
+# are stored in arrays
+_fields = (
+    ('fat', 'g', 'Total fat'),
+    ('carbs', 'g', 'Total carbohydrates'),
+    ('protein', 'g', 'Total protein'),
+    ('fiber', 'g', 'Total fiber'),
+    ('sugars', 'g', 'Total sugars'),
+    ('added_sugars', 'g', 'Added sugars'),
+    ('starch', 'g', 'Starch'),
+    ('saturated_fat', 'g', 'Total saturated fatty acids'),
+    ('monounsaturated_fat', 'g', 'Total monounsaturated fatty acids'),
+    ('polyunsaturated_fat', 'g', 'Total polyunsaturated fatty acids'),
+    ('trans_fat', 'g', 'Total trans fatty acids'),
+    ('cholesterol', 'mg', 'Cholesterol'),
+    ('water', 'g', 'Water'),
+    ('alcohol', 'g', 'Ethyl alcohol'),
+    ('caffeine', 'mg', 'Caffeine'),
+    ('sodium', 'mg', 'Sodium'),
+    ('potassium', 'mg', 'Potassium'),
+    ('calcium', 'mg', 'Calcium'),
+    ('iron', 'mg', 'Iron'),
+    ('magnesium', 'mg', 'Magnesium'),
+    ('phosphorus', 'mg', 'Phosphorus'),
+    ('zinc', 'mg', 'Zinc'),
+    ('copper', 'mg', 'Copper'),
+    ('manganese', 'mg', 'Manganese'),
+    ('selenium', 'µg', 'Selenium'),
+    ('vitamin_a', 'µg', 'Vitamin A, as retinol activity equivalents'),
+    ('vitamin_c', 'mg', 'Vitamin C'),
+    ('vitamin_d', 'µg', 'Vitamin D (D2 + D3)'),
+    ('vitamin_e', 'mg', 'Vitamin E, as alpha-tocopherol'),
+    ('vitamin_k', 'µg', 'Vitamin K, as phylloquinone'),
+    ('thiamin', 'mg', 'Thiamin (vitamin B1)'),
+    ('riboflavin', 'mg', 'Riboflavin (vitamin B2)'),
+    ('niacin', 'mg', 'Niacin (vitamin B3)'),
+    ('pantothenic_acid', 'mg', 'Pantothenic acid (vitamin B5)'),
+    ('vitamin_b6', 'mg', 'Vitamin B6'),
+    ('folate', 'µg', 'Total folate'),
+    ('vitamin_b12', 'µg', 'Vitamin B12'),
+    ('choline', 'mg', 'Total choline'),
+)
+
+_field_names = tuple(field for field, _, _ in _fields)
+_field_units = dict((field, unit) for field, unit, _ in _fields)
+_field_indices = dict((field, field_idx) for field_idx, field in enumerate(_field_names))
+
+_unit_names = {
+    'g': 'grams',
+    'mg': 'milligrams',
+    'µg': 'micrograms',
+}
+
+# Fields that are always shown by 'str', even if they are 0
+_str_fields = ('fat', 'carbs', 'protein')
+
+def _check_array_values(values):
+    # 'min' also catches NaN, since NaN compares false
+    if values.size > 0 and not values.min() >= 0:
+        for field_idx, field in enumerate(_field_names):
+            field_values = values[..., field_idx]
+            bad_values = field_values[~(field_values >= 0)]
+
+            if bad_values.size > 0:
+                check_value(False, lambda: (
+                    f"Expected '{field} >= 0' but got {bad_values[0]}"))
+
+def _divide(a, b):
+    # Element-wise division, where fields that are 0 in both operands give 0,
+    # since most foods have no amount of many of the fields
+    b_zero = (b == 0)
+
+    if not np.any(b_zero):
+        return np.true_divide(a, b)
+
+    a, b_zero = np.broadcast_arrays(a, b_zero)
+    check(not np.any(a[b_zero]), ZeroDivisionError, lambda: 'division by zero')
+    return np.true_divide(a, np.where(b_zero, 1, b))
+
+def _fields_str(get_field):
+    # Formats the fields for 'str', skipping extra fields that are all 0
+    items = [f'{field}={get_field(field)}' for field in _str_fields]
+    items.append(f'calories={get_field("calories")}')
+
+    for field in _field_names:
+        if field not in _str_fields:
+            value = get_field(field)
+
+            if field == 'fiber' or np.any(value != 0):
+                items.append(f'{field}={value}')
+
+    return ', '.join(items)
+
 class Nutrients:
     '''
     Holds nutrition data. Supports basic array arithmetic operations.
 
+    Each nutrient is a field, and all the fields are stored together in one
+    array, so arithmetic is done on all of them at once.
+
     .. note::
 
-       This currently only tracks fat, carbohydrate, protein, and fiber
-       amounts.  Calories are estimated based on fat, carbs, and protein.
+       Calories are estimated based on fat, carbs, and protein.
     '''
-    def __init__(self, fat=0, carbs=0, protein=0, fiber=0):
+    __slots__ = ('_values',)
+
+    # Make NumPy defer to the arithmetic operators of this class
+    __array_ufunc__ = None
+
+    def __init__(self, fat=0, carbs=0, protein=0, fiber=0, **fields):
         '''
         Args:
 
@@ -32,61 +134,36 @@ class Nutrients:
             Total fiber, in grams
 
             Default: 0
-        '''
-        check_type(fat, (int, float), 'fat')
-        check_type(carbs, (int, float), 'carbs')
-        check_type(protein, (int, float), 'protein')
-        check_type(fiber, (int, float), 'fiber')
-
-        check_value(fat >= 0, lambda: f"Expected 'fat >= 0' but got {fat}")
-        check_value(carbs >= 0, lambda: f"Expected 'carbs >= 0' but got {carbs}")
-        check_value(protein >= 0, lambda: f"Expected 'protein >= 0' but got {protein}")
-        check_value(fiber >= 0, lambda: f"Expected 'fiber >= 0' but got {fiber}")
 
-        self._fat = fat
-        self._carbs = carbs
-        self._protein = protein
-        self._fiber = fiber
+          **fields (number, optional):
+            Amounts of any of the other fields, like ``sodium``. See the
+            properties of this class for the full list of fields and their
+            units.
 
-    @property
-    def fat(self):
+            Default: 0
         '''
-        Total fat, in grams
+        fields['fat'] = fat
+        fields['carbs'] = carbs
+        fields['protein'] = protein
+        fields['fiber'] = fiber
 
-        Returns:
-          number:
-        '''
-        return self._fat
+        values = np.zeros(len(_field_names))
 
-    @property
-    def carbs(self):
-        '''
-        Total carbohydrates, in grams
+        for field, value in fields.items():
+            check(field in _field_indices, TypeError, lambda: (
+                f"Unknown nutrient field '{field}'"))
+            check_type(value, (int, float), field)
+            check_value(value >= 0, lambda: f"Expected '{field} >= 0' but got {value}")
+            values[_field_indices[field]] = value
 
-        Returns:
-          number:
-        '''
-        return self._carbs
+        self._values = values
 
-    @property
-    def protein(self):
-        '''
-        Total protein, in grams
-
-        Returns:
-          number:
-        '''
-        return self._protein
-
-    @property
-    def fiber(self):
-        '''
-        Total fiber, in grams
-
-        Returns:
-          number:
-        '''
-        return self._fiber
+    @classmethod
+    def _from_values(cls, values):
+        # Constructs without copying or validating ``values``
+        self = cls.__new__(cls)
+        self._values = values
+        return self
 
     @property
     def calories(self):
@@ -105,24 +182,51 @@ class Nutrients:
         return (9 * self.fat) + (4 * self.carbs) + (4 * self.protein)
 
     def __str__(self):
-        return f'Nutrients(fat={self.fat}, carbs={self.carbs}, protein={self.protein}, calories={self.calories}, fiber={self.fiber})'
+        return f'Nutrients({_fields_str(lambda field: getattr(self, field))})'
 
     def __repr__(self):
         return str(self)
 
-    def _binary_op(self, other, op):
+    def _operand_values(self, other):
         if isinstance(other, Nutrients):
-            return Nutrients(
-                fat=op(self.fat, other.fat),
-                carbs=op(self.carbs, other.carbs),
-                protein=op(self.protein, other.protein),
-                fiber=op(self.fiber, other.fiber))
+            return other._values
+        elif isinstance(other, NutrientsArray):
+            return NotImplemented
+        else:
+            check_type(other, (int, float), 'other')
+            return other
+
+    def _binary_op(self, other, op):
+        other_values = self._operand_values(other)
+
+        if other_values is NotImplemented:
+            return NotImplemented
+
+        values = op(self._values, other_values)
+
+        # Adding values that are not negative cannot give negative values, so
+        # those results do not need to be checked
+        if not (op is np.add and (other_values is not other or other >= 0)):
+            _check_array_values(values)
+
+        return Nutrients._from_values(values)
+
+    def _inplace_op(self, other, op):
+        other_values = self._operand_values(other)
+
+        if other_values is NotImplemented:
+            return NotImplemented
+
+        if op is np.add and (other_values is not other or other >= 0):
+            op(self._values, other_values, out=self._values)
         else:
-            return Nutrients(
-                fat=op(self.fat, other),
-                carbs=op(self.carbs, other),
-                protein=op(self.protein, other),
-                fiber=op(self.fiber, other))
+            # The result is checked before it replaces the current values, so
+            # that an error leaves this object unchanged
+            values = op(self._values, other_values)
+            _check_array_values(values)
+            self._values = values
+
+        return self
 
     def __add__(self, other):
         '''
@@ -134,11 +238,24 @@ class Nutrients:
         Returns:
           :class:`foodypy.Nutrients`:
         '''
-        return self._binary_op(other, lambda a, b: a + b)
+        return self._binary_op(other, np.add)
 
     def __radd__(self, other):
         return self + other
 
+    def __iadd__(self, other):
+        '''
+        Add ``other`` element-wise, in place. This modifies this object, rather
+        than creating a new one.
+
+        Args:
+          other (number or :class:`Nutrients`):
+            Amount to add
+        Returns:
+          :class:`foodypy.Nutrients`:
+        '''
+        return self._inplace_op(other, np.add)
+
     def __sub__(self, other):
         '''
         Subtract by ``other`` element-wise.
@@ -149,10 +266,10 @@ class Nutrients:
         Returns:
           :class:`foodypy.Nutrients`:
         '''
-        return self._binary_op(other, lambda a, b: a - b)
+        return self._binary_op(other, np.subtract)
 
     def __rsub__(self, other):
-        return self - other
+        return self._binary_op(other, lambda a, b: b - a)
 
     def __mul__(self, other):
         '''
@@ -164,22 +281,85 @@ class Nutrients:
         Returns:
           :class:`foodypy.Nutrients`:
         '''
-        return self._binary_op(other, lambda a, b: a * b)
+        return self._binary_op(other, np.multiply)
 
     def __rmul__(self, other):
         return self * other
 
+    def __imul__(self, other):
+        '''
+        Multiply by ``other`` element-wise, in place. This modifies this
+        object, rather than creating a new one.
+
+        Args:
+          other (number or :class:`Nutrients`):
+            Amount to multipy by
+        Returns:
+          :class:`foodypy.Nutrients`:
+        '''
+        return self._inplace_op(other, np.multiply)
+
     def __truediv__(self, other):
         '''
         Divide by ``other`` element-wise.
 
+        Fields that are 0 in both operands give 0. Dividing any other field
+        by 0 raises a :class:`ZeroDivisionError`.
+
         Args:
           other (number or :class:`Nutrients`):
             Amount to divide by
         Returns:
           :class:`foodypy.Nutrients`:
         '''
-        return self._binary_op(other, lambda a, b: a / b)
+        return self._binary_op(other, _divide)
+
+    @classmethod
+    def sum(cls, nutrients, weights=None):
+        '''
+        Add together a sequence of :class:`Nutrients`, optionally weighted.
+
+        This is much faster than the builtin :func:`sum`, because it does not
+        create a new :class:`Nutrients` for each intermediate result.
+
+        Args:
+          nutrients (iterable[:class:`Nutrients`]):
+            Nutrients to add together
+
+          weights (iterable[number], optional):
+            Amount to multiply each of the ``nutrients`` by, like the number
+            of grams of each food.
+
+            Default: None
+        Returns:
+          :class:`foodypy.Nutrients`:
+        '''
+        values = []
+
+        for item in nutrients:
+            check(isinstance(item, Nutrients), TypeError, lambda: (
+                f"Expected 'nutrients' to contain foodypy.Nutrients, but got "
+                f"{type(item)}"))
+            values.append(item._values)
+
+        if len(values) == 0:
+            values = np.zeros((0, len(_field_names)))
+
+        if weights is None:
+            return Nutrients._from_values(np.sum(values, axis=0))
+
+        weights = np.asarray(weights)
+        check(weights.dtype.kind in 'biuf', TypeError, lambda: (
+            f"Expected 'weights' to be numbers but got dtype {weights.dtype}"))
+        check_value(weights.shape == (len(values),), lambda: (
+            f"Expected 'weights' to have shape ({len(values)},) but got "
+            f"{weights.shape}"))
+        check_value(weights.size == 0 or weights.min() >= 0, lambda: (
+            "Expected 'weights >= 0'"))
+
+        values = weights @ np.asarray(values)
+        _check_array_values(values)
+        return Nutrients._from_values(values)
 
     def __eq__(self, other):
         '''
@@ -193,9 +373,301 @@ class Nutrients:
         '''
         check(isinstance(other, Nutrients), ValueError, lambda:
             f'expected other to be of type foodypy.Nutrients, but got {type(other)}')
-        return (
-            self.fat == other.fat
-            and self.carbs == other.carbs
-            and self.protein == self.protein
-            and self.fiber == self.fiber
-        )
+        return bool((self._values == other._values).all())
+
+def _nutrients_property(field_idx, unit, description):
+    def getter(self):
+        return self._values.item(field_idx)
+
+    getter.__doc__ = f'''
+        {description}, in {_unit_names[unit]}
+
+        Returns:
+          number:
+        '''
+    return property(getter)
+
+for _field_idx, (_field, _unit, _description) in enumerate(_fields):
+    setattr(Nutrients, _field, _nutrients_property(_field_idx, _unit, _description))
+
+class NutrientsArray:
+    '''
+    Holds nutrition data for a batch of foods, as an array with one
+    :class:`Nutrients` per element. Supports the same arithmetic operations as
+    :class:`Nutrients`, which are applied to the whole batch at once.
+
+    Operands are broadcast against the batch. A :class:`Nutrients` or a number
+    is applied to every element, and an array of numbers is broadcast against
+    the batch shape, giving one number per element.
+
+    Weighted sums can be calculated with matrix multiplication. For instance,
+    if ``table`` has shape ``(N,)`` and ``grams`` is a list of ``N`` numbers,
+    then ``grams @ table`` gives the :class:`Nutrients` for the given amount of
+    each food.
+
+    Values are only validated once for each array, rather than once for each
+    element.
+    '''
+    # Make NumPy defer to the arithmetic operators of this class
+    __array_ufunc__ = None
+
+    def __init__(self, values):
+        '''
+        Args:
+
+          values (array_like or list[:class:`Nutrients`]):
+            Either a list of :class:`Nutrients`, or an array of numbers of
+            shape ``(*shape, F)``, where ``F`` is the number of nutrient
+            fields. The last dimension holds the amount of each field, in the
+            order that the fields are listed in the properties of this class.
+        '''
+        if isinstance(values, NutrientsArray):
+            values = values._values
+
+        elif isinstance(values, (list, tuple)) and len(values) > 0 and all(
+                isinstance(nutrients, Nutrients) for nutrients in values):
+            values = [nutrients._values for nutrients in values]
+
+        values = np.array(values)
+
+        check(values.dtype.kind in 'biuf', TypeError, lambda: (
+            f"Expected 'values' to be numbers but got dtype {values.dtype}"))
+        check_value(values.ndim >= 1 and values.shape[-1] == len(_field_names), lambda: (
+            f"Expected 'values' to have shape (*shape, {len(_field_names)}) "
+            f"but got {values.shape}"))
+
+        values = values.astype(np.float64)
+        _check_array_values(values)
+        self._values = values
+
+    @classmethod
+    def _from_values(cls, values):
+        # Constructs without copying or validating ``values``
+        self = cls.__new__(cls)
+        self._values = values
+        return self
+
+    def _field(self, field_idx):
+        values = self._values[..., field_idx]
+        values.flags.writeable = False
+        return values
+
+    @property
+    def shape(self):
+        '''
+        Shape of the batch
+
+        Returns:
+          tuple[int]:
+        '''
+        return self._values.shape[:-1]
+
+    @property
+    def calories(self):
+        '''
+        Total energy of each element, in Calories. See
+        :attr:`Nutrients.calories`.
+
+        Returns:
+          numpy.ndarray:
+        '''
+        return (9 * self.fat) + (4 * self.carbs) + (4 * self.protein)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self._values, dtype=dtype, copy=True)
+
+    def __str__(self):
+        return f'NutrientsArray({_fields_str(lambda field: getattr(self, field))})'
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        check(len(self.shape) > 0, TypeError, lambda: 'len() of a 0-d NutrientsArray')
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        '''
+        Index into the batch.
+
+        Args:
+          index (int, slice, array_like, or tuple):
+            Index into the batch dimensions
+        Returns:
+          :class:`foodypy.Nutrients` or :class:`foodypy.NutrientsArray`:
+            :class:`Nutrients` if ``index`` selects a single element
+        '''
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        values = self._values[index + (slice(None),)]
+
+        if values.ndim == 1:
+            return Nutrients._from_values(values.copy())
+        else:
+            return NutrientsArray._from_values(values)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _operand_values(self, other):
+        if isinstance(other, NutrientsArray):
+            return other._values
+
+        elif isinstance(other, Nutrients):
+            return other._values
+
+        elif isinstance(other, (int, float)):
+            return other
+
+        else:
+            other = np.asarray(other)
+            check(other.dtype.kind in 'biuf', TypeError, lambda: (
+                f"Expected operand to be a number, Nutrients, NutrientsArray, "
+                f"or array of numbers, but got {type(other)}"))
+
+            # Arrays of numbers broadcast against the batch dimensions
+            return other[..., None]
+
+    def _binary_op(self, other, op):
+        values = op(self._values, self._operand_values(other))
+        _check_array_values(values)
+        return NutrientsArray._from_values(values)
+
+    def __add__(self, other):
+        '''
+        Add ``other`` element-wise.
+
+        Args:
+          other (number, array_like, :class:`Nutrients`, or :class:`NutrientsArray`):
+            Amount to add
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        return self._binary_op(other, np.add)
+
+    def __radd__(self, other):
+        return self + other
+
+    def __sub__(self, other):
+        '''
+        Subtract by ``other`` element-wise.
+
+        Args:
+          other (number, array_like, :class:`Nutrients`, or :class:`NutrientsArray`):
+            Amount to subtract
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        return self._binary_op(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._binary_op(other, lambda a, b: b - a)
+
+    def __mul__(self, other):
+        '''
+        Multiply by ``other`` element-wise.
+
+        Args:
+          other (number, array_like, :class:`Nutrients`, or :class:`NutrientsArray`):
+            Amount to multiply by
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        return self._binary_op(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __truediv__(self, other):
+        '''
+        Divide by ``other`` element-wise. See :meth:`Nutrients.__truediv__`.
+
+        Args:
+          other (number, array_like, :class:`Nutrients`, or :class:`NutrientsArray`):
+            Amount to divide by
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+        '''
+        return self._binary_op(other, _divide)
+
+    def __rtruediv__(self, other):
+        return self._binary_op(other, lambda a, b: _divide(b, a))
+
+    def __rmatmul__(self, other):
+        '''
+        Calculate weighted sums over the first batch dimension, ``other @ self``.
+
+        Args:
+          other (array_like):
+            Weights, of shape ``(N,)`` or ``(M, N)``, where ``N`` is the length
+            of this array
+        Returns:
+          :class:`foodypy.Nutrients` or :class:`foodypy.NutrientsArray`:
+            :class:`Nutrients` if ``other`` has shape ``(N,)``
+        '''
+        other = np.asarray(other)
+        check(other.dtype.kind in 'biuf', TypeError, lambda: (
+            f"Expected weights to be numbers but got dtype {other.dtype}"))
+        check_value(len(self.shape) == 1, lambda: (
+            f"Expected NutrientsArray of shape (N,) but got {self.shape}"))
+
+        values = np.matmul(other, self._values)
+        _check_array_values(values)
+
+        if values.ndim == 1:
+            return Nutrients._from_values(values)
+        else:
+            return NutrientsArray._from_values(values)
+
+    def sum(self, axis=None):
+        '''
+        Sum over batch dimensions.
+
+        Args:
+          axis (int or tuple[int], optional):
+            Batch dimension or dimensions to sum over. If ``None``, sum over
+            all of them.
+
+            Default: None
+        Returns:
+          :class:`foodypy.Nutrients` or :class:`foodypy.NutrientsArray`:
+            :class:`Nutrients` if all batch dimensions are summed over
+        '''
+        batch_ndim = len(self.shape)
+
+        if axis is None:
+            axis = tuple(range(batch_ndim))
+        elif not isinstance(axis, tuple):
+            axis = (axis,)
+
+        for dim in axis:
+            check(-batch_ndim <= dim < batch_ndim, IndexError, lambda: (
+                f"axis {dim} is out of bounds for NutrientsArray with "
+                f"{batch_ndim} batch dimensions"))
+
+        axis = tuple(dim % batch_ndim for dim in axis)
+        values = self._values.sum(axis=axis)
+
+        if values.ndim == 1:
+            return Nutrients._from_values(values)
+        else:
+            return NutrientsArray._from_values(values)
+
+def _nutrients_array_property(field_idx, unit, description):
+    def getter(self):
+        return self._field(field_idx)
+
+    getter.__doc__ = f'''
+        {description} of each element, in {_unit_names[unit]}
+
+        Returns:
+          numpy.ndarray:
+        '''
+    return property(getter)
+
+for _field_idx, (_field, _unit, _description) in enumerate(_fields):
+    setattr(NutrientsArray, _field, _nutrients_array_property(_field_idx, _unit, _description))
+
+del _field_idx, _field, _unit, _description
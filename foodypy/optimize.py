@@ -0,0 +1,252 @@
+import numpy as np
+
+from . import database
+from .error_checking import check, check_type, check_value
+from .nutrients import _field_indices, _field_names
+
+# Nutrient targets can be given for any field, and for calories, which are
+# calculated from fat, carbs, and protein like 'Nutrients.calories' is
+_target_fields = list(_field_names) + ['calories']
+
+def _nutrient_matrix(food_names, fields):
+    # Returns the amount of each field in one gram of each food, with shape
+    # (len(fields), len(food_names))
+    table = database._maybe_load_columns().columns.gather(food_names)
+    rows = []
+
+    for field in fields:
+        if field == 'calories':
+            rows.append(
+                9 * table[:, _field_indices['fat']]
+                + 4 * table[:, _field_indices['carbs']]
+                + 4 * table[:, _field_indices['protein']])
+        else:
+            rows.append(table[:, _field_indices[field]])
+
+    return np.array(rows, dtype=np.float64).reshape(len(fields), len(food_names))
+
+def _targets_matrix(targets):
+    # Returns the target fields, the targets with shape (num_plans,
+    # len(fields)), and whether a batch of plans was given
+    if isinstance(targets, dict):
+        fields = list(targets.keys())
+        values = [np.asarray(targets[field], dtype=np.float64) for field in fields]
+        batched = any(value.ndim > 0 for value in values)
+        shapes = set(value.shape for value in values if value.ndim > 0)
+        check_value(len(shapes) <= 1 and all(len(shape) == 1 for shape in shapes), lambda: (
+            "Expected the targets of each field to be a number or a 1-D array "
+            f"with one target per plan, but got shapes {[value.shape for value in values]}"))
+
+        values = np.broadcast_arrays(*values) if values else []
+        matrix = np.stack(values, axis=-1).reshape(-1, len(fields)) if values else None
+    else:
+        targets = list(targets)
+        check(all(isinstance(plan, dict) for plan in targets), TypeError, lambda: (
+            "Expected 'targets' to be a dict or a list of dicts"))
+        fields = list(targets[0].keys()) if targets else []
+
+        for plan in targets:
+            check_value(set(plan.keys()) == set(fields), lambda: (
+                "Expected every plan in 'targets' to have targets for the same "
+                f"fields, but got {list(plan.keys())} and {fields}"))
+
+        matrix = np.array(
+            [[plan[field] for field in fields] for plan in targets],
+            dtype=np.float64).reshape(len(targets), len(fields))
+        batched = True
+
+    check_value(len(fields) > 0, lambda: "Expected at least one target")
+
+    for field in fields:
+        check_value(field in _target_fields, lambda: (
+            f"Unknown nutrient field '{field}' in 'targets'. Expected one of "
+            f"{_target_fields}"))
+
+    check_value(np.isfinite(matrix).all() and (matrix >= 0).all(), lambda: (
+        "Expected the targets to be finite and >= 0"))
+
+    return fields, matrix, batched
+
+def _solve_gradient(M, b, upper, cost, max_iter, tol):
+    # Minimizes '|M x - b|^2 + cost . x' subject to '0 <= x <= upper' for each
+    # plan in the batch at once, with accelerated projected gradient descent.
+    # M has shape (num_plans, num_fields, num_foods)
+    num_plans, _, num_foods = M.shape
+    G = np.einsum('pfi,pfj->pij', M, M)
+    h = np.einsum('pfi,pf->pi', M, b)
+
+    # The gradient changes by at most twice the largest eigenvalue of G per
+    # unit step, which gives the largest step size that converges
+    lipschitz = 2 * np.linalg.eigvalsh(G)[:, -1]
+    step = np.divide(1, lipschitz, out=np.zeros_like(lipschitz), where=lipschitz > 0)[:, None]
+
+    x = np.zeros((num_plans, num_foods))
+    y = x
+    momentum = 1
+
+    def gradient(x):
+        return 2 * (np.matmul(G, x[:, :, None])[:, :, 0] - h) + cost
+
+    for iteration in range(max_iter):
+        x_next = np.clip(y - step * gradient(y), 0, upper)
+        momentum_next = (1 + np.sqrt(1 + 4 * momentum ** 2)) / 2
+        y = x_next + ((momentum - 1) / momentum_next) * (x_next - x)
+        x = x_next
+        momentum = momentum_next
+
+        # Stop once a projected gradient step from the current amounts would
+        # barely change them. When there are more foods than targets, the
+        # amounts can keep drifting without changing how close the plan is,
+        # so the change between iterations is not checked instead
+        if iteration % 10 == 9:
+            x_step = np.clip(x - step * gradient(x), 0, upper)
+
+            if np.abs(x_step - x).max() <= tol * (1 + np.abs(x).max()):
+                break
+
+    return x
+
+def _solve_scipy(M, b, upper):
+    from scipy.optimize import lsq_linear
+
+    # Each lower bound must be less than its upper bound, so foods with an
+    # upper bound of 0 are left out of the problem, and stay at 0 grams
+    upper = np.broadcast_to(upper, M.shape[2])
+    free = upper > 0
+    x = np.zeros((M.shape[0], M.shape[2]))
+
+    if free.any():
+        for plan in range(M.shape[0]):
+            x[plan, free] = lsq_linear(
+                M[plan][:, free], b[plan], bounds=(0, upper[free]), method='bvls').x
+
+    return x
+
+def _have_scipy():
+    try:
+        import scipy.optimize
+    except ImportError:
+        return False
+
+    return True
+
+def solve_amounts(food_names, targets, weights=None, max_grams=None, cost=None,
+        method='auto', max_iter=10000, tol=1e-8):
+    '''
+    Find the amount of each food, in grams, that gets the nutrients of
+    a diet plan closest to a set of targets.
+
+    The deviation from each target is measured relative to the target, so
+    that targets with different units are comparable, and the sum of the
+    squared deviations is minimized. Targets of 0 are measured in absolute
+    units instead. Amounts are never negative.
+
+    Many plans can be solved at once for the same candidate foods, which is
+    much faster than solving them one at a time.
+
+    Args:
+
+      food_names (list[str]):
+        Names of the candidate foods in the database
+
+      targets (dict[str, number or array-like] or list[dict[str, number]]):
+        Amount of each nutrient field to aim for, like
+        ``{'protein': 150, 'carbs': 250, 'calories': 2400}``. Calories can be
+        targeted, as well as any field of :class:`foodypy.Nutrients`. For a
+        batch of plans, either give an array of targets for each field, or
+        a list of dicts.
+
+      weights (dict[str, number], optional):
+        How much the deviation from the target of each field counts. Fields
+        that are not given have a weight of 1.
+
+        Default: None
+
+      max_grams (number or array-like, optional):
+        Most grams that can be used of each food, either for all foods or for
+        each food. If ``None``, there is no limit.
+
+        Default: None
+
+      cost (array-like, optional):
+        Cost of one gram of each food. Its total is added to the squared
+        deviation, so that cheaper foods are preferred. Costs can only be used
+        with the ``'gradient'`` method.
+
+        Default: None
+
+      method (str, optional):
+        ``'scipy'`` solves each plan exactly with
+        ``scipy.optimize.lsq_linear``. ``'gradient'`` solves all plans at
+        once with projected gradient descent in NumPy. ``'auto'`` uses
+        ``'scipy'`` if it is installed and there is no ``cost``, and
+        ``'gradient'`` otherwise.
+
+        Default: ``'auto'``
+
+      max_iter (int, optional):
+        Most iterations of the ``'gradient'`` method.
+
+        Default: 10000
+
+      tol (float, optional):
+        The ``'gradient'`` method stops when a step would not change any
+        amount by more than this fraction of the largest amount.
+
+        Default: 1e-8
+
+    Returns:
+      numpy.ndarray:
+        The grams of each food, with shape ``(len(food_names),)`` for one
+        plan, or ``(num_plans, len(food_names))`` for a batch of plans.
+    '''
+    food_names = list(food_names)
+    check_value(len(food_names) > 0, lambda: "Expected at least one food")
+    check_value(method in ['auto', 'scipy', 'gradient'], lambda: (
+        f"Expected 'method' to be one of ['auto', 'scipy', 'gradient'], but got "
+        f"'{method}'"))
+
+    fields, target_matrix, batched = _targets_matrix(targets)
+
+    if weights is None:
+        weights = {}
+
+    check_type(weights, dict, 'weights')
+
+    for field, weight in weights.items():
+        check_value(field in fields, lambda: (
+            f"Expected the fields of 'weights' to have targets, but got '{field}'"))
+        check_type(weight, (int, float), f'weights[{field!r}]')
+        check_value(weight >= 0, lambda: (
+            f"Expected 'weights[{field!r}] >= 0' but got {weight}"))
+
+    upper = np.asarray(np.inf if max_grams is None else max_grams, dtype=np.float64)
+    check_value(upper.shape in [(), (len(food_names),)] and (upper >= 0).all(), lambda: (
+        "Expected 'max_grams' to be a number or have one entry per food, "
+        "all >= 0"))
+
+    if cost is not None:
+        cost = np.asarray(cost, dtype=np.float64)
+        check_value(cost.shape == (len(food_names),) and np.isfinite(cost).all(), lambda: (
+            f"Expected 'cost' to have shape ({len(food_names)},) and be finite"))
+        check_value(method != 'scipy', lambda: (
+            "'cost' can only be used with method 'gradient'"))
+
+    if method == 'auto':
+        method = 'scipy' if cost is None and _have_scipy() else 'gradient'
+
+    A = _nutrient_matrix(food_names, fields)
+
+    # Each row of the problem is scaled so that it measures the relative
+    # deviation from its target
+    field_weights = np.array([weights.get(field, 1) for field in fields], dtype=np.float64)
+    scale = field_weights / np.where(target_matrix > 0, target_matrix, 1)
+    M = scale[:, :, None] * A
+    b = scale * target_matrix
+
+    if method == 'scipy':
+        amounts = _solve_scipy(M, b, upper)
+    else:
+        amounts = _solve_gradient(M, b, upper, 0 if cost is None else cost, max_iter, tol)
+
+    return amounts if batched else amounts[0]
@@ -0,0 +1,470 @@
+import array
+import re
+
+import numpy as np
+
+from . import database
+from .error_checking import check, check_type
+from .instrumentation import _instrumented
+from .nutrients import Nutrients
+
+# Grams in each unit of weight. These are the same for every food
+_weight_units = {
+    'g': 1.0,
+    'kg': 1000.0,
+    'mg': 0.001,
+    'oz': 28.349523125,
+    'lb': 453.59237,
+}
+
+# Milliliters in each unit of volume. If a food does not have a portion for
+# one of these, but has a portion for another one, the grams are converted
+# through milliliters
+_volume_units = {
+    'ml': 1.0,
+    'l': 1000.0,
+    'tsp': 4.92892159375,
+    'tbsp': 14.78676478125,
+    'fl oz': 29.5735295625,
+    'cup': 236.5882365,
+    'pint': 473.176473,
+    'quart': 946.352946,
+}
+
+# Spellings of units, mapped to the names that portions are stored with
+_unit_aliases = {
+    'g': 'g', 'gram': 'g', 'grams': 'g', 'gr': 'g',
+    'kg': 'kg', 'kilogram': 'kg', 'kilograms': 'kg', 'kgs': 'kg',
+    'mg': 'mg', 'milligram': 'mg', 'milligrams': 'mg',
+    'oz': 'oz', 'ounce': 'oz', 'ounces': 'oz',
+    'lb': 'lb', 'lbs': 'lb', 'pound': 'lb', 'pounds': 'lb',
+    'ml': 'ml', 'milliliter': 'ml', 'milliliters': 'ml', 'millilitre': 'ml', 'millilitres': 'ml',
+    'l': 'l', 'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l',
+    'tsp': 'tsp', 'tsps': 'tsp', 'teaspoon': 'tsp', 'teaspoons': 'tsp',
+    'tbsp': 'tbsp', 'tbsps': 'tbsp', 'tbs': 'tbsp', 'tbl': 'tbsp',
+    'tablespoon': 'tbsp', 'tablespoons': 'tbsp',
+    'fl oz': 'fl oz', 'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz',
+    'cup': 'cup', 'cups': 'cup',
+    'pint': 'pint', 'pints': 'pint', 'pt': 'pint',
+    'quart': 'quart', 'quarts': 'quart', 'qt': 'quart',
+    'slice': 'slice', 'slices': 'slice',
+    'piece': 'piece', 'pieces': 'piece', 'pc': 'piece', 'pcs': 'piece',
+    'serving': 'serving', 'servings': 'serving', 'nlea serving': 'serving',
+    'small': 'small', 'medium': 'medium', 'large': 'large',
+    'extra large': 'extra large',
+}
+
+_number_words = {
+    'a': 1.0, 'an': 1.0, 'one': 1.0, 'two': 2.0, 'three': 3.0, 'four': 4.0,
+    'five': 5.0, 'six': 6.0, 'seven': 7.0, 'eight': 8.0, 'nine': 9.0,
+    'ten': 10.0, 'eleven': 11.0, 'twelve': 12.0, 'dozen': 12.0,
+    'half': 0.5, 'quarter': 0.25,
+}
+
+_unicode_fractions = {
+    '½': 1 / 2, '⅓': 1 / 3, '⅔': 2 / 3, '¼': 1 / 4, '¾': 3 / 4,
+    '⅕': 1 / 5, '⅛': 1 / 8, '⅜': 3 / 8, '⅝': 5 / 8, '⅞': 7 / 8,
+}
+
+# A number at the start of a line, like '2', '1.5', '1/2', '1 1/2', or '1½'
+_quantity_regex = re.compile(
+    r'\s*(?:(?P<whole>\d+)\s+(?P<mixed_num>\d+)\s*/\s*(?P<mixed_den>\d+)'
+    r'|(?P<num>\d+)\s*/\s*(?P<den>\d+)'
+    r'|(?P<number>\d+(?:\.\d*)?|\.\d+))?'
+    r'\s*(?P<fraction>[' + ''.join(_unicode_fractions) + r'])?')
+
+# When no unit is given, like '2 bananas', the first of these portions that
+# the food has is used
+_count_units = ['medium', 'serving', 'piece', 'slice', 'large', 'small', 'extra large']
+
+def _parse_quantity(text):
+    # Returns the quantity at the start of the text, or None if there is none,
+    # and the rest of the text
+    match = _quantity_regex.match(text)
+    quantity = None
+
+    for den_group in ['mixed_den', 'den']:
+        if match.group(den_group) is not None:
+            check(int(match.group(den_group)) != 0, ValueError, lambda: (
+                f"Expected the fraction in '{text}' to have a nonzero denominator"))
+
+    if match.group('whole') is not None:
+        quantity = int(match.group('whole')) + int(match.group('mixed_num')) / int(match.group('mixed_den'))
+    elif match.group('num') is not None:
+        quantity = int(match.group('num')) / int(match.group('den'))
+    elif match.group('number') is not None:
+        quantity = float(match.group('number'))
+
+    if match.group('fraction') is not None:
+        quantity = (quantity or 0) + _unicode_fractions[match.group('fraction')]
+
+    rest = text[match.end():]
+
+    if quantity is None:
+        words = rest.split(None, 1)
+
+        if words and words[0].lower() in _number_words:
+            quantity = _number_words[words[0].lower()]
+            rest = words[1] if len(words) > 1 else ''
+
+    return quantity, rest.strip()
+
+def _normalize_unit(unit_text):
+    # Returns the name that a unit is stored with, from a unit or the
+    # description of a portion, like 'Cups' or 'cup, chopped'. Returns None
+    # if there is no unit
+    unit_text = re.split(r'[,(]', unit_text.lower(), 1)[0]
+    words = unit_text.replace('.', ' ').split()
+
+    if not words:
+        return None
+
+    for num_words in [2, 1]:
+        unit = _unit_aliases.get(' '.join(words[:num_words]))
+
+        if unit is not None:
+            return unit
+
+    # Other units are kept as they are, like 'stalk' or 'clove', except that
+    # plurals are made singular
+    unit = words[0]
+
+    if len(unit) > 3 and unit.endswith('s') and not unit.endswith('ss'):
+        unit = unit[:-1]
+
+    return unit
+
+def _portions_from_raw(food_raw):
+    # Returns the grams of one of each unit that an FDC food has a portion
+    # for, like '{"cup": 145.0, "tbsp": 9.1}'. The first portion of each unit
+    # is kept
+    portions = {}
+
+    for portion in food_raw.get('foodPortions') or ():
+        grams = portion.get('gramWeight')
+        amount = portion.get('amount') or portion.get('value') or 1
+        unit_text = (portion.get('measureUnit') or {}).get('name')
+
+        # SR Legacy gives the unit in the modifier, and FNDDS gives it in the
+        # description, after the amount
+        if unit_text in [None, '', 'undetermined']:
+            description = portion.get('portionDescription')
+            modifier = portion.get('modifier')
+
+            if description:
+                description_amount, unit_text = _parse_quantity(description)
+                amount = description_amount or amount
+            elif modifier and not modifier.isdigit():
+                unit_text = modifier
+            else:
+                continue
+
+        unit = _normalize_unit(unit_text)
+
+        if unit is not None and unit not in _weight_units and grams and amount > 0:
+            portions.setdefault(unit, grams / amount)
+
+    # Branded foods have one serving instead of portions
+    if food_raw.get('servingSizeUnit', '').lower() in ['g', 'grm'] and food_raw.get('servingSize'):
+        serving_grams = float(food_raw['servingSize'])
+        portions.setdefault('serving', serving_grams)
+        household_amount, household_unit = _parse_quantity(
+            food_raw.get('householdServingFullText') or '')
+        unit = _normalize_unit(household_unit)
+
+        if unit is not None and unit not in _weight_units and (household_amount or 1) > 0:
+            portions.setdefault(unit, serving_grams / (household_amount or 1))
+
+    return portions
+
+class _PortionTableBuilder:
+    # Builds the table of '_build_portion_table' one food at a time
+    def __init__(self):
+        self._units = []
+        self._unit_ids = {}
+        self._offsets = array.array('q', [0])
+        self._food_unit_ids = array.array('i')
+        self._grams = array.array('d')
+
+    def add(self, portions):
+        for unit, unit_grams in (portions or {}).items():
+            unit_id = self._unit_ids.get(unit)
+
+            if unit_id is None:
+                unit_id = self._unit_ids[unit] = len(self._units)
+                self._units.append(unit)
+
+            self._food_unit_ids.append(unit_id)
+            self._grams.append(unit_grams)
+
+        self._offsets.append(len(self._grams))
+
+    def build(self):
+        return {
+            'units': self._units,
+            'unit_index': self._unit_ids,
+            'offsets': np.array(self._offsets, dtype=np.int64),
+            'unit_ids': np.array(self._food_unit_ids, dtype=np.int32),
+            'grams': np.array(self._grams, dtype=np.float64),
+        }
+
+def _build_portion_table(food_portions):
+    # Returns a compact table of the portions of each food, in database order.
+    # The portions of the food in row 'i' are at 'offsets[i]:offsets[i + 1]'
+    # of 'unit_ids' and 'grams', and each unit ID is an index into 'units'
+    builder = _PortionTableBuilder()
+
+    for portions in food_portions:
+        builder.add(portions)
+
+    return builder.build()
+
+def _row_portions(loaded, row):
+    # Returns the portions of the food in a row of the loaded database
+    table = loaded.portion_table
+    start, end = table['offsets'][row:row + 2].tolist()
+    units = table['units']
+    return dict(zip(
+        [units[unit_id] for unit_id in table['unit_ids'][start:end].tolist()],
+        table['grams'][start:end].tolist()))
+
+@_instrumented('get_portions')
+def get_portions(food_name):
+    '''
+    Get the household measures that the specified food in the database has
+    portions for, and the grams in one of each, like
+    ``{'cup': 145.0, 'tbsp': 9.1}``. The portions are recorded when the
+    database is installed.
+
+    Args:
+
+      food_name (str): The name of the food in the database
+
+    Returns:
+      dict[str, float]:
+    '''
+    loaded = database._maybe_load_portions()
+    row = loaded.columns._row(food_name)
+    check(row is not None, ValueError, lambda: (
+        f"Did not find exact name '{food_name}' in database. "
+        "Use 'foodypy.search' to find existing matches"))
+    return _row_portions(loaded, row)
+
+def _split_line(loaded, line):
+    # Returns the quantity, unit, and food of a line like '2 cups of peas'.
+    # The quantity and unit are None if they are not given
+    quantity, rest = _parse_quantity(line)
+    words = rest.split()
+    unit = None
+
+    # The unit can be up to two words, and is only recognized if it is
+    # a known unit and there is a food after it
+    for num_words in [2, 1]:
+        if len(words) > num_words:
+            unit_text = ' '.join(words[:num_words]).lower().rstrip('.')
+            normalized = _unit_aliases.get(unit_text)
+
+            if normalized is None and num_words == 1:
+                normalized = _normalize_unit(unit_text)
+
+                if normalized not in loaded.portion_table['unit_index']:
+                    normalized = None
+
+            if normalized is not None:
+                unit = normalized
+                words = words[num_words:]
+                break
+
+    if words and words[0].lower() == 'of':
+        words = words[1:]
+
+    return quantity, unit, ' '.join(words)
+
+def _portion_grams(loaded, food_name, row, quantity, unit):
+    # Returns the grams of the given quantity of a unit of the food
+    if unit in _weight_units:
+        return quantity * _weight_units[unit]
+
+    portions = _row_portions(loaded, row)
+
+    if unit is None:
+        for count_unit in _count_units:
+            if count_unit in portions:
+                return quantity * portions[count_unit]
+
+        check(len(portions) > 0, ValueError, lambda: (
+            f"No unit was given for '{food_name}', and it does not have any "
+            "portions to count. Give a unit of weight, like '100 g'"))
+        return quantity * next(iter(portions.values()))
+
+    if unit in portions:
+        return quantity * portions[unit]
+
+    if unit in _volume_units:
+        for volume_unit, volume_ml in _volume_units.items():
+            if volume_unit in portions:
+                return quantity * _volume_units[unit] * portions[volume_unit] / volume_ml
+
+    raise ValueError(
+        f"'{food_name}' does not have a portion for unit '{unit}'. It has "
+        f"portions for {list(portions)}, and any unit of weight "
+        f"{list(_weight_units)}")
+
+def _parse_result(loaded, line, food_name, score, row, quantity, unit):
+    return {
+        'text': line,
+        'food_name': food_name,
+        'score': score,
+        'quantity': quantity,
+        'unit': unit,
+        'grams': _portion_grams(loaded, food_name, row, quantity, unit),
+    }
+
+@_instrumented('parse')
+def parse(text):
+    '''
+    Parse a quantity of food, like ``'2 cups peas'``, ``'1 1/2 tbsp of
+    butter'``, ``'100g chicken breast'``, or ``'a banana'``, and calculate its
+    nutrients.
+
+    The food is the top result of :func:`foodypy.search`. The quantity can be
+    a number, a fraction, or a word like ``'a'`` or ``'two'``, and is 1 if it
+    is not given. The unit can be a unit of weight, a household measure that
+    the food has a portion for, like ``'cup'`` or ``'slice'``, or a unit of
+    volume that can be converted to one of its portions. If no unit is given,
+    the quantity counts the food's typical portion, like ``'medium'``. See
+    :func:`foodypy.get_portions`.
+
+    Args:
+
+      text (str): Text to parse
+
+    Returns:
+      dict:
+        Dict with the following items:
+
+        * ``'text'`` (str): The text that was parsed
+
+        * ``'food_name'`` (str): The name of the food in the database
+
+        * ``'score'`` (int): Search score of the food, between 0 and 100
+
+        * ``'quantity'`` (float): The quantity of the unit
+
+        * ``'unit'`` (str or None): The name of the unit, or None if no unit
+          was given
+
+        * ``'grams'`` (float): Grams of the food
+
+        * ``'nutrients'`` (:class:`foodypy.Nutrients`): Nutrients of that
+          many grams of the food
+    '''
+    check_type(text, str, 'text')
+    loaded = database._maybe_load_portions()
+    quantity, unit, food_text = _split_line(loaded, text)
+    check(food_text != '', ValueError, lambda: f"Did not find a food in '{text}'")
+
+    results = database.search(food_text, limit=1)
+    check(len(results) > 0, ValueError, lambda: f"Did not find a food matching '{food_text}'")
+
+    food_name, score = results[0]
+    row = loaded.columns._row(food_name)
+    result = _parse_result(
+        loaded, text, food_name, score, row, 1.0 if quantity is None else quantity, unit)
+    result['nutrients'] = Nutrients._from_values(loaded.columns.table[row] * result['grams'])
+    return result
+
+@_instrumented('parse_many')
+def parse_many(lines, workers=1, errors='raise'):
+    '''
+    Parse many quantities of food, like the lines of a food log. This gives
+    the same results as calling :func:`foodypy.parse` for each line, but each
+    distinct food is only searched for once, and the searches can be spread
+    across a pool of processes.
+
+    Args:
+
+      lines (list[str]):
+        Texts to parse
+
+      workers (int, optional):
+        The number of worker processes to search in. See
+        :func:`foodypy.search_many`.
+
+        Default: 1
+
+      errors (str, optional):
+        If ``'raise'``, raise an error if any line cannot be parsed. If
+        ``'ignore'``, the result of each line that cannot be parsed is
+        ``None``.
+
+        Default: ``'raise'``
+
+    Returns:
+      list[dict or None]:
+        The result of each line, in the same order as ``lines``. See
+        :func:`foodypy.parse`.
+    '''
+    lines = list(lines)
+    check(errors in ['raise', 'ignore'], ValueError, lambda: (
+        f"Expected 'errors' to be one of ['raise', 'ignore'], but got '{errors}'"))
+
+    for line_idx, line in enumerate(lines):
+        check_type(line, str, f'lines[{line_idx}]')
+
+    loaded = database._maybe_load_portions()
+    split_lines = []
+
+    for line in lines:
+        try:
+            split_lines.append(_split_line(loaded, line))
+        except ValueError:
+            if errors == 'raise':
+                raise
+
+            # Lines with a quantity that cannot be parsed are not searched
+            split_lines.append(None)
+
+    # Each distinct food is searched for once
+    food_texts = list(dict.fromkeys(
+        split[2] for split in split_lines if split is not None and split[2]))
+    search_results = dict(zip(
+        food_texts, database.search_many(food_texts, limit=1, workers=workers)))
+
+    results = []
+    rows = []
+
+    for line, split in zip(lines, split_lines):
+        result = None
+        row = None
+
+        if split is not None:
+            quantity, unit, food_text = split
+
+            try:
+                check(food_text != '', ValueError, lambda: f"Did not find a food in '{line}'")
+                check(len(search_results[food_text]) > 0, ValueError, lambda: (
+                    f"Did not find a food matching '{food_text}'"))
+
+                food_name, score = search_results[food_text][0]
+                row = loaded.columns._row(food_name)
+                result = _parse_result(
+                    loaded, line, food_name, score, row, 1.0 if quantity is None else quantity, unit)
+            except ValueError:
+                if errors == 'raise':
+                    raise
+
+        results.append(result)
+        rows.append(row)
+
+    # The nutrients of all the lines are calculated at once
+    parsed = [i for i, result in enumerate(results) if result is not None]
+
+    if parsed:
+        grams = np.array([results[i]['grams'] for i in parsed])
+        values = loaded.columns.table[[rows[i] for i in parsed]] * grams[:, None]
+
+        for i, line_values in zip(parsed, values):
+            results[i]['nutrients'] = Nutrients._from_values(line_values)
+
+    return results
@@ -0,0 +1,207 @@
+import numpy as np
+
+from . import database
+from .error_checking import check, check_type, check_value
+from .nutrients import Nutrients, NutrientsArray, _field_names
+
+class Recipe:
+    '''
+    A recipe or meal, made of amounts of foods in the database and of other
+    recipes.
+
+    The first time that its nutrients are calculated, the recipe looks up the
+    database row of each food once, and compiles its ingredients into a list
+    of rows and the grams of each. After that, calculating its nutrients is
+    a single dot product against the database. It is compiled again if the
+    database is reinstalled.
+
+    Args:
+
+      ingredients (dict[str or Recipe, number]):
+        The ingredients of the recipe. Each food name from the database is
+        mapped to its amount in grams. Each :class:`Recipe` is mapped to its
+        number of servings.
+
+      servings (number, optional):
+        The number of servings that the recipe makes.
+
+        Default: 1
+    '''
+    def __init__(self, ingredients, servings=1):
+        check_type(ingredients, dict, 'ingredients')
+        check_type(servings, (int, float), 'servings')
+        check_value(servings > 0, lambda: (
+            f"Expected 'servings > 0' but got {servings}"))
+
+        for ingredient, amount in ingredients.items():
+            check(isinstance(ingredient, (str, Recipe)), TypeError, lambda: (
+                "Expected the ingredients to be food names or "
+                f"foodypy.Recipe, but got {type(ingredient)}"))
+            check_type(amount, (int, float), f'ingredients[{ingredient!r}]')
+            check_value(amount >= 0, lambda: (
+                f"Expected 'ingredients[{ingredient!r}] >= 0' but got {amount}"))
+
+        self._ingredients = dict(ingredients)
+        self._servings = servings
+        # The database version that the recipe was compiled for, and the
+        # rows and grams of its foods. They are replaced together, so that
+        # threads that compile the recipe at the same time do not mix them
+        self._compiled = None
+
+    @property
+    def ingredients(self):
+        '''
+        Copy of the ingredients of the recipe.
+
+        Returns:
+          dict[str or Recipe, number]:
+        '''
+        return dict(self._ingredients)
+
+    @property
+    def servings(self):
+        '''
+        Number of servings that the recipe makes.
+
+        Returns:
+          number:
+        '''
+        return self._servings
+
+    def _compile(self, loaded):
+        # Returns the rows in the loaded database of all the foods in the
+        # recipe, including the foods in nested recipes, and the grams of each
+        compiled = self._compiled
+
+        if compiled is None or compiled[0] != loaded.version:
+            weights = {}
+
+            for ingredient, amount in self._ingredients.items():
+                if isinstance(ingredient, Recipe):
+                    rows, ingredient_weights = ingredient._compile(loaded)
+                    scale = amount / ingredient._servings
+
+                    for row, weight in zip(rows.tolist(), ingredient_weights.tolist()):
+                        weights[row] = weights.get(row, 0) + weight * scale
+                else:
+                    row = loaded.columns._row(ingredient)
+                    check(row is not None, ValueError, lambda: (
+                        f"Did not find exact name '{ingredient}' in database. "
+                        "Use 'foodypy.search' to find existing matches"))
+                    weights[row] = weights.get(row, 0) + amount
+
+            compiled = self._compiled = (
+                loaded.version,
+                np.fromiter(weights.keys(), dtype=np.intp, count=len(weights)),
+                np.fromiter(weights.values(), dtype=np.float64, count=len(weights)))
+
+        return compiled[1], compiled[2]
+
+    def nutrients(self):
+        '''
+        Calculate the total nutrients of the recipe.
+
+        Returns:
+          :class:`foodypy.Nutrients`:
+        '''
+        loaded = database._maybe_load_columns()
+        rows, weights = self._compile(loaded)
+        return Nutrients._from_values(weights @ loaded.columns.table[rows])
+
+    def per_serving(self):
+        '''
+        Calculate the nutrients of one serving of the recipe.
+
+        Returns:
+          :class:`foodypy.Nutrients`:
+        '''
+        loaded = database._maybe_load_columns()
+        rows, weights = self._compile(loaded)
+        return Nutrients._from_values(
+            (weights / self._servings) @ loaded.columns.table[rows])
+
+    def scale(self, factor):
+        '''
+        Get a copy of the recipe with all the ingredient amounts multiplied by
+        ``factor``. The number of servings stays the same. The copy does not
+        need to be compiled again.
+
+        Args:
+          factor (number): Amount to multiply by
+
+        Returns:
+          :class:`foodypy.Recipe`:
+        '''
+        check_type(factor, (int, float), 'factor')
+        check_value(factor >= 0, lambda: f"Expected 'factor >= 0' but got {factor}")
+
+        scaled = Recipe(
+            {ingredient: amount * factor for ingredient, amount in self._ingredients.items()},
+            self._servings)
+
+        compiled = self._compiled
+
+        if compiled is not None:
+            scaled._compiled = (compiled[0], compiled[1], compiled[2] * factor)
+
+        return scaled
+
+    @staticmethod
+    def evaluate_many(recipes, per_serving=False):
+        '''
+        Calculate the nutrients of each of several recipes. The rows of all
+        the recipes are gathered from the database at once and summed per
+        recipe, which is much faster than calling :meth:`nutrients` for each
+        one.
+
+        Args:
+
+          recipes (list[:class:`foodypy.Recipe`]):
+            The recipes
+
+          per_serving (bool, optional):
+            If ``True``, calculate the nutrients of one serving of each
+            recipe, rather than the total.
+
+            Default: False
+
+        Returns:
+          :class:`foodypy.NutrientsArray`:
+            Array of shape ``(len(recipes),)`` with one element per recipe.
+        '''
+        recipes = list(recipes)
+
+        for recipe in recipes:
+            check(isinstance(recipe, Recipe), TypeError, lambda: (
+                f"Expected 'recipes' to contain foodypy.Recipe, but got "
+                f"{type(recipe)}"))
+
+        values = np.zeros((len(recipes), len(_field_names)))
+
+        if len(recipes) == 0:
+            return NutrientsArray._from_values(values)
+
+        loaded = database._maybe_load_columns()
+        compiled = [recipe._compile(loaded) for recipe in recipes]
+
+        lengths = np.array([len(rows) for rows, _ in compiled])
+        rows = np.concatenate([rows for rows, _ in compiled])
+        weights = np.concatenate([weights for _, weights in compiled])
+
+        if per_serving:
+            servings = np.array([recipe._servings for recipe in recipes], dtype=np.float64)
+            weights /= np.repeat(servings, lengths)
+
+        # Each recipe's rows are summed by 'reduceat'. Empty recipes have no
+        # rows to sum, so they are left out and stay 0
+        nonempty = lengths > 0
+
+        if nonempty.any():
+            offsets = np.cumsum(lengths) - lengths
+            weighted = loaded.columns.table[rows] * weights[:, None]
+            values[nonempty] = np.add.reduceat(weighted, offsets[nonempty], axis=0)
+
+        return NutrientsArray._from_values(values)
+
+    def __repr__(self):
+        return f'Recipe({self._ingredients!r}, servings={self._servings!r})'
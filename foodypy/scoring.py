@@ -0,0 +1,384 @@
+import numpy as np
+
+# Upper bounds of the scores of the 'fuzzywuzzy.fuzz' scorers, which let
+# 'foodypy.search' skip the foods that cannot be in the top results without
+# scoring them.
+#
+# Every scorer is built from 'fuzz.ratio' and 'fuzz.partial_ratio'. The ratio
+# of two strings is '2 * M / (len(a) + len(b))', where 'M' is the number of
+# matching characters, and 'M' is at most the length of their longest common
+# subsequence, which is at most the number of characters they have in common.
+# The partial ratio is the ratio of the shorter string and the best window of
+# the longer one. The bounds are computed in two tiers:
+#
+#   * '_upper_bounds' uses the number of characters in common, counted for
+#     all the names at once with NumPy
+#
+#   * '_reaches' uses the longest common subsequence and the characters in
+#     common with each window, for one name at a time, which is tighter and
+#     still much cheaper than scoring the name
+#
+# Each bound is rounded the same way as the scorer rounds its scores, so they
+# can be compared with scores exactly.
+
+# Characters are counted in these buckets. Letters, digits, and underscores
+# each have their own bucket, other characters share one, and spaces are
+# counted separately
+_bucket_chars = 'abcdefghijklmnopqrstuvwxyz0123456789_'
+_other_bucket = len(_bucket_chars)
+_space_bucket = _other_bucket + 1
+_num_buckets = _space_bucket + 1
+
+_bucket_table = np.full(128, _other_bucket, dtype=np.int64)
+_bucket_table[[ord(char) for char in _bucket_chars]] = np.arange(len(_bucket_chars))
+_bucket_table[ord(' ')] = _space_bucket
+
+# Small amount added before rounding a bound up, so that the bound is never
+# less than a score that was calculated with operations in a different order
+_epsilon = 1e-9
+
+# Scorers that have bounds. Custom scorers do not
+_bounded_scorers = [
+    'WRatio',
+    'QRatio',
+    'ratio',
+    'partial_ratio',
+    'token_sort_ratio',
+    'token_set_ratio',
+    'partial_token_sort_ratio',
+    'partial_token_set_ratio',
+]
+
+def _char_counts(strings):
+    # Returns the number of characters in each bucket of each string, with
+    # shape (len(strings), _num_buckets)
+    lengths = np.array([len(string) for string in strings], dtype=np.int64)
+    codes = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+    buckets = np.where(codes < 128, _bucket_table[np.minimum(codes, 127)], _other_bucket)
+    string_ids = np.repeat(np.arange(len(strings)), lengths)
+    counts = np.bincount(
+        string_ids * _num_buckets + buckets,
+        minlength=len(strings) * _num_buckets)
+    return counts.reshape(len(strings), _num_buckets)
+
+def _name_stats(processed_names):
+    # Returns the statistics of the processed names that '_upper_bounds' uses
+    counts = _char_counts(processed_names)
+    num_tokens = []
+    set_lengths = []
+    set_num_tokens = []
+    tokens = {}
+
+    for name_id, name in enumerate(processed_names):
+        name_tokens = name.split()
+        token_set = set(name_tokens)
+        num_tokens.append(len(name_tokens))
+        set_num_tokens.append(len(token_set))
+        set_lengths.append(sum(map(len, token_set)) + max(len(token_set) - 1, 0))
+
+        for token in token_set:
+            tokens.setdefault(token, []).append(name_id)
+
+    char_counts = counts[:, :_space_bucket]
+
+    return {
+        'lengths': np.array([len(name) for name in processed_names], dtype=np.int64),
+        'char_counts': char_counts.astype(np.min_scalar_type(char_counts.max(initial=0))),
+        'spaces': counts[:, _space_bucket],
+        'num_tokens': np.array(num_tokens, dtype=np.int64),
+        'set_lengths': np.array(set_lengths, dtype=np.int64),
+        'set_num_tokens': np.array(set_num_tokens, dtype=np.int64),
+        'tokens': {
+            token: np.array(name_ids, dtype=np.int64)
+            for token, name_ids in tokens.items()},
+    }
+
+class _Query:
+    # The strings that the scorers compare a processed query with, and its
+    # statistics
+    def __init__(self, processed):
+        self.processed = processed
+        self.tokens = processed.split()
+        self.token_set = set(self.tokens)
+        self.sorted = ' '.join(sorted(self.tokens))
+        self.set_string = ' '.join(sorted(self.token_set))
+        self.stats = _name_stats([processed])
+
+def _round_up(score):
+    # Rounds like 'fuzzywuzzy.utils.intr', or up where that rounds down
+    return np.floor(score + 0.5 + _epsilon)
+
+def _ratio_upper(matches, len_a, len_b):
+    # Highest 'fuzz.ratio' of strings with these lengths that have at most
+    # 'matches' characters in common
+    matches = np.minimum(matches, np.minimum(len_a, len_b))
+    total = len_a + len_b
+    score = _round_up(100 * 2 * matches / np.maximum(total, 1))
+    return np.where(total == 0, 100, score)
+
+def _partial_ratio_upper(matches, len_a, len_b):
+    # Highest 'fuzz.partial_ratio' of strings with these lengths that have at
+    # most 'matches' characters in common. A window of the longer string with
+    # 'n' characters has at most 'min(matches, n)' in common with the shorter
+    # string, of length 'm', and its ratio is at most '2 * min(matches, n) /
+    # (m + n)', which is highest when 'n == min(matches, m)'
+    shorter = np.minimum(len_a, len_b)
+    matches = np.minimum(matches, shorter)
+    ratio = 2 * matches / np.maximum(shorter + matches, 1)
+    score = np.where(ratio > .995, 100, _round_up(100 * ratio))
+    return np.where(
+        (len_a == 0) | (len_b == 0),
+        np.where(len_a == len_b, 100, 0),
+        score)
+
+def _upper_bounds(scorer, query, stats):
+    # Returns the highest score that each name can get from a scorer in
+    # '_bounded_scorers'
+    query_stats = query.stats
+    query_counts = query_stats['char_counts'][0].astype(np.int64)
+    columns = np.flatnonzero(query_counts)
+
+    # Characters in common, other than spaces
+    common = np.minimum(
+        stats['char_counts'][:, columns], query_counts[columns]).sum(axis=1, dtype=np.int64)
+
+    len_q = query_stats['lengths'][0]
+    len_n = stats['lengths']
+
+    raw_common = common + np.minimum(stats['spaces'], query_stats['spaces'][0])
+
+    # Tokens that are sorted and joined with one space
+    tokens_q = query_stats['num_tokens'][0]
+    tokens_n = stats['num_tokens']
+    sorted_len_q = len_q - query_stats['spaces'][0] + max(tokens_q - 1, 0)
+    sorted_len_n = len_n - stats['spaces'] + np.maximum(tokens_n - 1, 0)
+    sorted_common = common + np.minimum(max(tokens_q - 1, 0), np.maximum(tokens_n - 1, 0))
+
+    # Distinct tokens, which are compared by the token set scorers when the
+    # names have no tokens in common with the query
+    set_len_q = query_stats['set_lengths'][0]
+    set_len_n = stats['set_lengths']
+    set_common = common + np.minimum(
+        max(query_stats['set_num_tokens'][0] - 1, 0),
+        np.maximum(stats['set_num_tokens'] - 1, 0))
+
+    shared = np.zeros(len(len_n), dtype=bool)
+
+    for token in query.token_set:
+        name_ids = stats['tokens'].get(token)
+
+        if name_ids is not None:
+            shared[name_ids] = True
+
+    if scorer in ['ratio', 'QRatio']:
+        bounds = _ratio_upper(raw_common, len_q, len_n)
+    elif scorer == 'partial_ratio':
+        bounds = _partial_ratio_upper(raw_common, len_q, len_n)
+    elif scorer == 'token_sort_ratio':
+        bounds = _ratio_upper(sorted_common, sorted_len_q, sorted_len_n)
+    elif scorer == 'partial_token_sort_ratio':
+        bounds = _partial_ratio_upper(sorted_common, sorted_len_q, sorted_len_n)
+    elif scorer == 'token_set_ratio':
+        bounds = np.where(shared, 100, _ratio_upper(set_common, set_len_q, set_len_n))
+    elif scorer == 'partial_token_set_ratio':
+        bounds = np.where(shared, 100, _partial_ratio_upper(set_common, set_len_q, set_len_n))
+    else:
+        assert scorer == 'WRatio'
+        base = _ratio_upper(raw_common, len_q, len_n)
+        unpartial = np.maximum(base, np.maximum(
+            _ratio_upper(sorted_common, sorted_len_q, sorted_len_n) * .95,
+            np.where(shared, 100, _ratio_upper(set_common, set_len_q, set_len_n)) * .95))
+
+        len_ratio = np.maximum(len_q, len_n) / np.maximum(np.minimum(len_q, len_n), 1)
+        partial_scale = np.where(len_ratio > 8, .6, .9)
+        partial = np.maximum.reduce([
+            base,
+            _partial_ratio_upper(raw_common, len_q, len_n) * partial_scale,
+            _partial_ratio_upper(sorted_common, sorted_len_q, sorted_len_n) * .95 * partial_scale,
+            np.where(
+                shared, 100,
+                _partial_ratio_upper(set_common, set_len_q, set_len_n)) * .95 * partial_scale,
+        ])
+        bounds = _round_up(np.where(len_ratio < 1.5, unpartial, partial))
+
+    # QRatio, WRatio, and the token set scorers are 0 if either string is
+    # empty, except that the token set scorers are 100 for equal strings,
+    # which can only be equal if they have the same characters
+    if scorer in ['QRatio', 'WRatio', 'token_set_ratio', 'partial_token_set_ratio']:
+        bounds = np.where((len_n == 0) | (len_q == 0), 0, bounds)
+
+    if scorer in ['token_set_ratio', 'partial_token_set_ratio']:
+        bounds = np.where((len_n == len_q) & (raw_common == len_q), 100, bounds)
+
+    return bounds.astype(np.int64)
+
+def _lcs_length(a, b):
+    # Length of the longest common subsequence of two strings, computed with
+    # a bit for each character of 'a'
+    masks = {}
+    bit = 1
+
+    for char in a:
+        masks[char] = masks.get(char, 0) | bit
+        bit <<= 1
+
+    row = bit - 1
+
+    for char in b:
+        mask = masks.get(char)
+
+        if mask:
+            matched = row & mask
+            row = (row + matched) | (row - matched)
+
+    return len(a) - (row & (bit - 1)).bit_count()
+
+def _ratio_bound(a, b):
+    # Highest 'fuzz.ratio' of two strings
+    if a == b:
+        return 100
+
+    if not a or not b:
+        return 0
+
+    return int(_round_up(100 * 2 * _lcs_length(a, b) / (len(a) + len(b))))
+
+def _partial_ratio_bound(a, b):
+    # Highest 'fuzz.partial_ratio' of two strings. Every window of the longer
+    # string, including the shorter ones at its end, is compared by the
+    # characters that it has in common with the shorter string, and no window
+    # can match more characters than the whole longer string does
+    if a == b:
+        return 100
+
+    if not a or not b:
+        return 0
+
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    window_len = len(shorter)
+    max_matches = _lcs_length(shorter, longer)
+
+    if max_matches == 0:
+        return 0
+    needed = {}
+
+    for char in shorter:
+        needed[char] = needed.get(char, 0) + 1
+
+    window_counts = dict.fromkeys(needed, 0)
+    matches = 0
+    best_matches = 0
+
+    for end, char in enumerate(longer):
+        count = needed.get(char)
+
+        if count is not None:
+            if window_counts[char] < count:
+                matches += 1
+
+            window_counts[char] += 1
+
+        if end >= window_len:
+            char = longer[end - window_len]
+            count = needed.get(char)
+
+            if count is not None:
+                window_counts[char] -= 1
+
+                if window_counts[char] < count:
+                    matches -= 1
+
+        if matches > best_matches:
+            best_matches = min(matches, max_matches)
+
+            if best_matches == window_len:
+                return 100
+
+    best_ratio = best_matches / window_len
+
+    # The windows at the end of the longer string are shorter
+    for start in range(len(longer) - window_len, len(longer) - 1):
+        char = longer[start]
+        count = needed.get(char)
+
+        if count is not None:
+            window_counts[char] -= 1
+
+            if window_counts[char] < count:
+                matches -= 1
+
+        best_ratio = max(
+            best_ratio,
+            2 * min(matches, max_matches) / (window_len + len(longer) - start - 1))
+
+    return 100 if best_ratio > .995 else int(_round_up(100 * best_ratio))
+
+def _token_set_strings(query, name_tokens):
+    # The strings that the token set scorers compare
+    name_set = set(name_tokens)
+    intersection = ' '.join(sorted(query.token_set & name_set))
+    combined_q = (intersection + ' ' + ' '.join(sorted(query.token_set - name_set))).strip()
+    combined_n = (intersection + ' ' + ' '.join(sorted(name_set - query.token_set))).strip()
+    return intersection, combined_q, combined_n
+
+def _token_set_bound(bound_func, query, name_tokens):
+    intersection, combined_q, combined_n = _token_set_strings(query, name_tokens)
+    bounds = [bound_func(combined_q, combined_n)]
+
+    if intersection:
+        bounds += [bound_func(intersection, combined_q), bound_func(intersection, combined_n)]
+
+    return max(bounds)
+
+def _reaches(scorer, query, name, score):
+    # Returns whether the name might get at least the score from a scorer in
+    # '_bounded_scorers'. The parts of each score are bounded one at a time,
+    # and this returns as soon as one of them might reach the score
+    processed = query.processed
+
+    if scorer in ['token_set_ratio', 'partial_token_set_ratio'] and processed == name:
+        return 100 >= score
+
+    if scorer in ['QRatio', 'WRatio', 'token_set_ratio', 'partial_token_set_ratio']:
+        if not processed or not name:
+            return 0 >= score
+
+    if scorer in ['ratio', 'QRatio']:
+        return _ratio_bound(processed, name) >= score
+    elif scorer == 'partial_ratio':
+        return _partial_ratio_bound(processed, name) >= score
+
+    name_tokens = name.split()
+    name_sorted = ' '.join(sorted(name_tokens))
+
+    if scorer == 'token_sort_ratio':
+        return _ratio_bound(query.sorted, name_sorted) >= score
+    elif scorer == 'partial_token_sort_ratio':
+        return _partial_ratio_bound(query.sorted, name_sorted) >= score
+    elif scorer == 'token_set_ratio':
+        return _token_set_bound(_ratio_bound, query, name_tokens) >= score
+    elif scorer == 'partial_token_set_ratio':
+        return _token_set_bound(_partial_ratio_bound, query, name_tokens) >= score
+
+    assert scorer == 'WRatio'
+
+    if _round_up(_ratio_bound(processed, name)) >= score:
+        return True
+
+    len_ratio = max(len(processed), len(name)) / min(len(processed), len(name))
+
+    if len_ratio < 1.5:
+        parts = [
+            lambda: _ratio_bound(query.sorted, name_sorted) * .95,
+            lambda: _token_set_bound(_ratio_bound, query, name_tokens) * .95,
+        ]
+    else:
+        partial_scale = .6 if len_ratio > 8 else .9
+        parts = [
+            lambda: _partial_ratio_bound(processed, name) * partial_scale,
+            lambda: _partial_ratio_bound(query.sorted, name_sorted) * .95 * partial_scale,
+            lambda: _token_set_bound(
+                _partial_ratio_bound, query, name_tokens) * .95 * partial_scale,
+        ]
+
+    return any(_round_up(part()) >= score for part in parts)
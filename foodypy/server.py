@@ -0,0 +1,265 @@
+import http.server
+import json
+import traceback
+
+from . import database
+from .error_checking import check
+from .nutrients import _field_names
+from .recipe import Recipe
+
+_default_host = '127.0.0.1'
+_default_port = 8642
+
+# Largest request body that is read, in bytes
+_default_max_request_size = 2 ** 24
+
+# Errors that are caused by a request, rather than by the server. They are
+# sent to the client, which raises them again
+_client_errors = (ValueError, TypeError)
+
+def _recipe_from_json(recipe_json):
+    # Recipes are sent as a dict with a list of '[ingredient, amount]' pairs,
+    # where each ingredient is either a food name or a nested recipe
+    check(isinstance(recipe_json, dict) and 'ingredients' in recipe_json, TypeError, lambda: (
+        f"Expected a recipe to be a dict with 'ingredients', but got {recipe_json!r}"))
+
+    ingredients = {}
+
+    for ingredient, amount in recipe_json['ingredients']:
+        if isinstance(ingredient, dict):
+            ingredient = _recipe_from_json(ingredient)
+
+        ingredients[ingredient] = amount
+
+    return Recipe(ingredients, recipe_json.get('servings', 1))
+
+def _values_json(values):
+    return {'fields': list(_field_names), 'values': values.tolist()}
+
+def _search(request):
+    return {'results': database.search(
+        request['food_name'],
+        limit=request.get('limit', 10),
+        scorer=request.get('scorer'),
+        score_cutoff=request.get('score_cutoff', 0))}
+
+def _search_many(request):
+    return {'results': database.search_many(
+        request['food_names'],
+        limit=request.get('limit', 10),
+        workers=1,
+        scorer=request.get('scorer'),
+        score_cutoff=request.get('score_cutoff', 0))}
+
+def _get(request):
+    return _values_json(database.get(request['food_name'])._values)
+
+def _get_many(request):
+    return _values_json(database.get_many(request['food_names'])._values)
+
+def _recipes(request):
+    recipes = [_recipe_from_json(recipe_json) for recipe_json in request['recipes']]
+    return _values_json(Recipe.evaluate_many(
+        recipes, per_serving=request.get('per_serving', False))._values)
+
+# Function that handles each path that is posted to
+_routes = {
+    '/search': _search,
+    '/search_many': _search_many,
+    '/get': _get,
+    '/get_many': _get_many,
+    '/recipes': _recipes,
+}
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, so clients do not
+    # connect again for each one
+    protocol_version = 'HTTP/1.1'
+
+    # Responses are small, so they are sent right away instead of waiting to
+    # be combined with more data
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_json(self, status, error):
+        self._send_json(status, {'error': {
+            'type': type(error).__name__,
+            'message': error.args[0] if len(error.args) == 1 else str(error),
+        }})
+
+    def _send_not_found(self):
+        self._send_json(404, {'error': {
+            'type': 'LookupError',
+            'message': f"Unknown path '{self.path}'",
+        }})
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_not_found()
+
+    def do_POST(self):
+        route = _routes.get(self.path)
+        length = self.headers.get('Content-Length', '0')
+
+        # If the body is not read, the next request on the connection would
+        # not start in the right place, so the connection is closed
+        transfer_encoding = self.headers.get('Transfer-Encoding')
+
+        if transfer_encoding is not None:
+            self.close_connection = True
+            self._send_error_json(411, ValueError(
+                "Expected the request to have a 'Content-Length', but got "
+                f"'Transfer-Encoding: {transfer_encoding}'"))
+            return
+
+        # 'isdigit' is also true for other digits, like '²', which 'int' does
+        # not accept
+        if not (length.isascii() and length.isdigit()):
+            self.close_connection = True
+            self._send_error_json(400, ValueError(
+                f"Expected 'Content-Length' to be a non-negative integer, but got '{length}'"))
+            return
+
+        length = int(length)
+
+        if length > self.server.max_request_size:
+            self.close_connection = True
+            self._send_error_json(413, ValueError(
+                f"Expected the request to be at most {self.server.max_request_size} "
+                f"bytes, but got {length}"))
+            return
+
+        # The body is read even if the path is unknown, so that the next
+        # request on the connection starts in the right place
+        body = self.rfile.read(length)
+
+        if route is None:
+            self._send_not_found()
+            return
+
+        try:
+            request = json.loads(body)
+            check(isinstance(request, dict), TypeError, lambda: (
+                "Expected the request to be a JSON object"))
+            response = route(request)
+        except json.JSONDecodeError as error:
+            self._send_error_json(400, ValueError(f"Invalid JSON: {error}"))
+        except KeyError as error:
+            self._send_error_json(400, ValueError(
+                f"Expected the request to have '{error.args[0]}'"))
+        except _client_errors as error:
+            self._send_error_json(400, error)
+        except Exception:
+            # Details of errors in the server are logged rather than sent to
+            # the client
+            self.log_error('Error handling %s:\n%s', self.path, traceback.format_exc())
+            self._send_error_json(500, RuntimeError('Internal server error'))
+        else:
+            self._send_json(200, response)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def log_error(self, *args):
+        # Errors are logged even if requests are not
+        super().log_message(*args)
+
+def make_server(
+        host=_default_host, port=_default_port, preload=True, verbose=False,
+        max_request_size=_default_max_request_size):
+    '''
+    Create a FoodyPy server, which serves the database over HTTP/JSON. Each
+    connection is handled in its own thread, and connections are kept open
+    between requests.
+
+    One server can replace a copy of the database and search index in each
+    process on a host. Use :class:`foodypy.client.Client` to make requests to
+    it.
+
+    Args:
+
+      host (str, optional):
+        Address to listen on.
+
+        Default: ``'127.0.0.1'``
+
+      port (int, optional):
+        Port to listen on. If ``0``, use any free port.
+
+        Default: 8642
+
+      preload (bool, optional):
+        If ``True``, load the database and search index before returning, so
+        that the first requests do not have to.
+
+        Default: True
+
+      verbose (bool, optional):
+        If ``True``, log each request to stderr.
+
+        Default: False
+
+      max_request_size (int, optional):
+        The largest request body to accept, in bytes. Larger requests get
+        a 413 response. Requests must give the size of their body with
+        ``Content-Length``, and chunked requests get a 411 response.
+
+        Default: ``2 ** 24``
+
+    Returns:
+      :class:`http.server.ThreadingHTTPServer`:
+        The server. Call its ``serve_forever`` method to start serving. Its
+        ``server_address`` is the address that it listens on.
+    '''
+    if preload:
+        database.preload()
+
+    check(isinstance(max_request_size, int) and max_request_size >= 0, ValueError, lambda: (
+        f"Expected 'max_request_size' to be a non-negative int, but got {max_request_size!r}"))
+
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    server.verbose = verbose
+    server.max_request_size = max_request_size
+    return server
+
+def serve(host=_default_host, port=_default_port, verbose=False):
+    '''
+    Serve the database until interrupted. See :func:`foodypy.server.make_server`.
+    This is what ``python -m foodypy serve`` runs.
+
+    Args:
+
+      host (str, optional):
+        Address to listen on.
+
+        Default: ``'127.0.0.1'``
+
+      port (int, optional):
+        Port to listen on.
+
+        Default: 8642
+
+      verbose (bool, optional):
+        If ``True``, log each request to stderr.
+
+        Default: False
+    '''
+    with make_server(host, port, verbose=verbose) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,264 @@
+import collections.abc
+import functools
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from .error_checking import check
+from .nutrients import _field_names
+
+class _ColumnarDatabase(collections.abc.Mapping):
+    '''
+    Database stored as a table of nutrient amounts with one row per food and
+    one column per field in ``_field_names``. It can be used in place of the
+    ``dict`` database, which maps food names to their nutrients dicts.
+    '''
+    def __init__(self, names, table):
+        self.names = names
+        self.rows = {name: row for row, name in enumerate(names)}
+        self.table = table
+
+    @classmethod
+    def from_dict(cls, database):
+        # Fields that are missing from a nutrients dict, in databases
+        # installed before the field was added, are 0
+        names = list(database.keys())
+        table = np.array(
+            [[nutrients_raw.get(field, 0) for field in _field_names]
+                for nutrients_raw in database.values()],
+            dtype=np.float64).reshape(len(names), len(_field_names))
+        return cls(names, table)
+
+    def _row(self, food_name):
+        return self.rows.get(food_name)
+
+    def __getitem__(self, food_name):
+        row = self._row(food_name)
+
+        if row is None:
+            raise KeyError(food_name)
+
+        return dict(zip(_field_names, self.table[row].tolist()))
+
+    def __contains__(self, food_name):
+        return self._row(food_name) is not None
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        for name, values in zip(self.names, self.table.tolist()):
+            yield name, dict(zip(_field_names, values))
+
+    def gather(self, food_names):
+        row_ids = np.empty(len(food_names), dtype=np.intp)
+
+        for i, food_name in enumerate(food_names):
+            row = self._row(food_name)
+            check(row is not None, ValueError, lambda: (
+                f"Did not find exact name '{food_name}' in database. "
+                "Use 'foodypy.search' to find existing matches"))
+            row_ids[i] = row
+
+        return self.table[row_ids]
+
+# Binary database layout, with all integers and floats little-endian:
+#
+#   header:        _binary_header
+#   table:         float64[num_foods, num_fields]
+#   name_offsets:  uint64[num_foods + 1], offsets of each name in 'names'
+#   sorted_rows:   uint64[num_foods], rows ordered by UTF-8 encoded name
+#   fields:        UTF-8 field names, separated by newlines
+#   names:         UTF-8 food names, in row order
+#
+# Rows are kept in the same order as the JSON database. Version 1 has the
+# same layout. Version 2 does not have 'sorted_rows', so they are sorted when
+# the database is opened.
+_binary_magic = b'FOODYPY\0'
+_binary_version = 3
+_binary_header = struct.Struct('<8sIIQQQ')
+_binary_row = struct.Struct(f'<{len(_field_names)}d')
+_binary_offset = struct.Struct('<Q')
+
+class _BinaryDatabaseWriter:
+    # Writes a binary database one food at a time, so that the foods do not
+    # have to be kept in memory. Each row of the table is written as it is
+    # added. The name offsets and names, which come after the table, go to
+    # temporary files until the table is done. The rows are then sorted by
+    # their encoded names, which are read back from the temporary file
+    # without decoding them, and the header is written last, once the number
+    # of foods is known
+    def __init__(self, path):
+        tmp_dir = os.path.dirname(os.path.abspath(path))
+        self._file = open(path, 'wb')
+        self._name_offsets = tempfile.TemporaryFile(dir=tmp_dir)
+        self._names = tempfile.TemporaryFile(dir=tmp_dir)
+        self._num_foods = 0
+        self._names_size = 0
+
+        self._file.write(bytes(_binary_header.size))
+        self._name_offsets.write(_binary_offset.pack(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._finish()
+        finally:
+            self._file.close()
+            self._name_offsets.close()
+            self._names.close()
+
+    def add(self, name, values):
+        name_encoded = name.encode('utf-8')
+        self._file.write(_binary_row.pack(*values))
+        self._names.write(name_encoded)
+        self._names_size += len(name_encoded)
+        self._name_offsets.write(_binary_offset.pack(self._names_size))
+        self._num_foods += 1
+
+    def _finish(self):
+        fields_encoded = '\n'.join(_field_names).encode('utf-8')
+
+        self._name_offsets.seek(0)
+        shutil.copyfileobj(self._name_offsets, self._file)
+        self._name_offsets.seek(0)
+        name_offsets = np.frombuffer(self._name_offsets.read(), dtype='<u8').tolist()
+        self._names.seek(0)
+        names_blob = self._names.read()
+        sorted_rows = sorted(
+            range(self._num_foods),
+            key=lambda row: names_blob[name_offsets[row]:name_offsets[row + 1]])
+        del names_blob
+        self._file.write(np.array(sorted_rows, dtype='<u8').tobytes())
+        self._file.write(fields_encoded)
+        self._names.seek(0)
+        shutil.copyfileobj(self._names, self._file)
+
+        self._file.seek(0)
+        self._file.write(_binary_header.pack(
+            _binary_magic,
+            _binary_version,
+            len(_field_names),
+            self._num_foods,
+            len(fields_encoded),
+            self._names_size))
+
+def _index_view(array):
+    # Returns a view of a uint64 array, which is much faster than the array to
+    # index one element at a time. Arrays that are not in native byte order
+    # are copied
+    return memoryview(np.ascontiguousarray(array, dtype=np.uint64)).cast('B').cast('Q')
+
+class _MappedDatabase(_ColumnarDatabase):
+    '''
+    :class:`_ColumnarDatabase` that is memory-mapped from a binary database
+    file. Nutrient amounts are only read from the file when they are needed.
+    Names are looked up by binary search of the rows in sorted order,
+    comparing their UTF-8 encodings, so they do not have to be decoded.
+    '''
+    def __init__(self, path, buffer):
+        self.path = path
+        self._buffer = buffer
+
+        (magic, version, num_fields, num_foods, fields_size,
+            names_size) = _binary_header.unpack_from(buffer)
+
+        check(magic == _binary_magic and version in [1, 2, _binary_version], RuntimeError, lambda: (
+            f"'{path}' is not a FoodyPy binary database of version "
+            f"{_binary_version}. Please reinstall the database with "
+            "'foodypy.install_database(overwrite=True)'"))
+
+        offset = _binary_header.size
+        self.table = np.frombuffer(
+            buffer, dtype='<f8', count=num_foods * num_fields,
+            offset=offset).reshape(num_foods, num_fields)
+        offset += self.table.nbytes
+
+        self._name_offsets = np.frombuffer(
+            buffer, dtype='<u8', count=num_foods + 1, offset=offset)
+        offset += self._name_offsets.nbytes
+
+        if version != 2:
+            self._sorted_rows = np.frombuffer(
+                buffer, dtype='<u8', count=num_foods, offset=offset)
+            offset += self._sorted_rows.nbytes
+
+        fields = tuple(
+            bytes(buffer[offset:offset + fields_size]).decode('utf-8').split('\n'))
+        offset += fields_size
+
+        check(fields == _field_names, RuntimeError, lambda: (
+            f"Binary database '{path}' has nutrient fields {fields}, but "
+            f"expected {_field_names}. Please reinstall the database with "
+            "'foodypy.install_database(overwrite=True)'"))
+
+        self._names_offset = offset
+
+        self._name_offsets_view = _index_view(self._name_offsets)
+
+        if version == 2:
+            self._sorted_rows = np.array(
+                sorted(range(num_foods), key=self._encoded_name), dtype=np.uint64)
+
+        self._sorted_rows_view = _index_view(self._sorted_rows)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(path, buffer)
+
+    def __reduce__(self):
+        # Other processes map the same file, rather than copying its contents
+        return (_MappedDatabase.open, (self.path,))
+
+    def _encoded_name(self, row):
+        name_offsets = self._name_offsets_view
+        return self._buffer[
+            self._names_offset + name_offsets[row]:self._names_offset + name_offsets[row + 1]]
+
+    @functools.cached_property
+    def names(self):
+        name_offsets = self._name_offsets.tolist()
+        names_blob = self._buffer[self._names_offset:self._names_offset + name_offsets[-1]]
+        return [
+            names_blob[start:end].decode('utf-8')
+            for start, end in zip(name_offsets[:-1], name_offsets[1:])]
+
+    def _row(self, food_name):
+        if not isinstance(food_name, str):
+            return None
+
+        try:
+            name_encoded = food_name.encode('utf-8')
+        except UnicodeEncodeError:
+            return None
+
+        sorted_rows = self._sorted_rows_view
+        encoded_name = self._encoded_name
+        low = 0
+        high = len(sorted_rows)
+
+        while low < high:
+            mid = (low + high) // 2
+
+            if encoded_name(sorted_rows[mid]) < name_encoded:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(sorted_rows) and encoded_name(sorted_rows[low]) == name_encoded:
+            return sorted_rows[low]
+
+        return None
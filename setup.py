@@ -25,6 +25,9 @@ setup(
     url='https://github.com/kurtamohler/foodypy',
     # license=license,
     packages=['foodypy'],
+    entry_points={
+        'console_scripts': ['foodypy = foodypy.__main__:main'],
+    },
     cmdclass=cmdclass,
     command_options={
         'build_sphinx': {
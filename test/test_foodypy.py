@@ -1,7 +1,1996 @@
 import unittest
+import tempfile
+import os
+import subprocess
+import sys
 import foodypy
+import foodypy.database as database
+
+_test_food_names = [
+    'Peas, green, raw',
+    'Peas, edible-podded, raw',
+    'Cowpeas, leafy tips, raw',
+    'Pigeonpeas, immature seeds, raw',
+    'Babyfood, peas and brown rice',
+    'Chickpeas (garbanzo beans, bengal gram), mature seeds, raw',
+    'Chicken, broilers or fryers, breast, meat only, raw',
+    'Chicken, broilers or fryers, thigh, meat only, raw',
+    'Chicken, ground, raw',
+    'Rice, white, long-grain, regular, cooked',
+    'Rice, brown, long-grain, cooked',
+    'Apples, raw, with skin',
+    'Apple juice, canned or bottled, unsweetened',
+    'Bananas, raw',
+    'Beef, ground, 80% lean meat / 20% fat, raw',
+    'Milk, whole, 3.25% milkfat',
+    'Ice creams, vanilla',
+    'Ice creams, vanilla, light',
+    'Egg, whole, raw, fresh',
+    'Bread, whole-wheat, commercially prepared',
+]
+
+# FDC nutrient ID, name, and unit of each field
+_test_nutrient_info = {
+    'fat': (1004, 'Total lipid (fat)', 'g'),
+    'carbs': (1005, 'Carbohydrate, by difference', 'g'),
+    'protein': (1003, 'Protein', 'g'),
+    'fiber': (1079, 'Fiber, total dietary', 'g'),
+}
+
+def _test_amounts(i):
+    # Amounts per 100 grams of the i-th test food
+    return {
+        'fat': float(i),
+        'carbs': float(len(_test_food_names) - i),
+        'protein': float(i % 5),
+        'fiber': float(i % 3),
+    }
+
+def _test_foods_raw():
+    # Foods in the format of FoodData Central's JSON datasets
+    foods = []
+
+    for i, name in enumerate(_test_food_names):
+        food_nutrients = []
+
+        for field, amount in _test_amounts(i).items():
+            nutrient_id, nutrient_name, unit = _test_nutrient_info[field]
+            food_nutrients.append({
+                'type': 'FoodNutrient',
+                'id': 10000 + 10 * i + len(food_nutrients),
+                'nutrient': {
+                    'id': nutrient_id,
+                    'number': str(nutrient_id),
+                    'name': nutrient_name,
+                    'rank': 1,
+                    'unitName': unit,
+                },
+                'amount': amount,
+            })
+
+        foods.append({
+            'foodClass': 'FinalFood',
+            'description': name,
+            'foodNutrients': food_nutrients,
+            'fdcId': 100000 + i,
+            'dataType': 'SR Legacy',
+            'publicationDate': '4/1/2019',
+        })
+
+    return foods
+
+def _test_dataset_zip(path, foods_raw, key='SRLegacyFoods'):
+    import json
+    import zipfile
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('foods.json', json.dumps({key: foods_raw}, indent=1))
+
+def _nutrient_values(fat=0, carbs=0, protein=0, fiber=0):
+    # Values of all the nutrient fields, in array order
+    from foodypy.nutrients import _field_names
+    values = [0] * len(_field_names)
+    values[:4] = [fat, carbs, protein, fiber]
+    return values
+
+def _all_fields(nutrients_raw):
+    from foodypy.nutrients import _field_names
+    return {field: nutrients_raw.get(field, 0) for field in _field_names}
+
+def _test_database():
+    data = {}
+
+    for i, name in enumerate(_test_food_names):
+        data[name] = {
+            field: amount / 100 for field, amount in _test_amounts(i).items()}
+
+    return data
+
+class _TestFileServer:
+    '''
+    Serves files from a dict of paths to contents over HTTP, with support for
+    ``Range``, ``If-Range``, and ``HEAD`` requests. The files can be changed
+    by modifying ``files``.
+    '''
+    def __init__(self, files):
+        import hashlib
+        import http.server
+        import threading
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                content = server.files.get(self.path)
+
+                if content is None:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(content)))
+                self.send_header('ETag', hashlib.md5(content).hexdigest())
+                self.end_headers()
+
+            def do_GET(self):
+                content = server.files.get(self.path)
+
+                if content is None:
+                    self.send_error(404)
+                    return
+
+                range_header = self.headers.get('Range')
+                server.range_headers.append(range_header)
+                etag = hashlib.md5(content).hexdigest()
+                start = 0
+
+                # The range is ignored if the file changed since 'If-Range'
+                if self.headers.get('If-Range', etag) != etag:
+                    range_header = None
+
+                if range_header is not None:
+                    start = int(range_header[len('bytes='):-len('-')])
+
+                    if start >= len(content):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(content)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+
+                self.send_response(200 if range_header is None else 206)
+                self.send_header('Content-Length', str(len(content) - start))
+                self.send_header('ETag', etag)
+
+                if range_header is not None:
+                    self.send_header(
+                        'Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+
+                self.end_headers()
+                self.wfile.write(content[start:])
+
+            def log_message(self, *args):
+                pass
+
+        self.files = files
+        self.range_headers = []
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+class TestDatabase(unittest.TestCase):
+    '''
+    Runs ``foodypy.database`` against a small test database installed to
+    a temporary directory.
+    '''
+    def setUp(self):
+        db = database
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._saved_globals = dict(vars(db))
+
+        # Move all database files into the temporary directory
+        for attr in list(vars(db)):
+            if attr.startswith('_') and attr.endswith(('_path', '_dir')) and attr != '_data_dir':
+                rel_path = os.path.relpath(getattr(db, attr), db._data_dir)
+                setattr(db, attr, os.path.join(self._tmp_dir.name, rel_path))
+
+        db._data_dir = self._tmp_dir.name
+        db._unload_database()
+        foodypy.configure_search_cache()
+        db._write_database(
+            (name, nutrients_raw, {'source': 'sr_legacy', 'fdc_id': 100000 + i})
+            for i, (name, nutrients_raw) in enumerate(_test_database().items()))
+
+    def tearDown(self):
+        vars(database).update(self._saved_globals)
+        self._tmp_dir.cleanup()
+
+    def test_database_status(self):
+        db = database
+        self.assertEqual(foodypy.database_status(), {
+            'installed': True, 'loaded': False, 'path': db._data_path})
+
+        foodypy.get('Bananas, raw')
+        self.assertTrue(foodypy.database_status()['loaded'])
+
+        os.remove(db._data_path)
+        db._loaded = None
+        self.assertFalse(foodypy.database_status()['installed'])
+
+        with self.assertRaisesRegex(RuntimeError, r"has not been installed"):
+            foodypy.get('Bananas, raw')
+
+    def test_iter_foods_raw(self):
+        foods_raw = _test_foods_raw()
+        zip_path = os.path.join(self._tmp_dir.name, 'foods.zip')
+        _test_dataset_zip(zip_path, foods_raw)
+
+        for chunk_size in [1, 7, 2 ** 16]:
+            self.assertEqual(
+                list(database._iter_foods_raw(zip_path, chunk_size=chunk_size)),
+                foods_raw)
+
+        _test_dataset_zip(zip_path, [])
+        self.assertEqual(list(database._iter_foods_raw(zip_path)), [])
+
+        with open(zip_path, 'wb') as f:
+            import zipfile
+
+            with zipfile.ZipFile(f, 'w') as zip_file:
+                zip_file.writestr('foods.json', '{"SRLegacyFoods": [{"a": 1} {"b": 2}]}')
+
+        with self.assertRaisesRegex(RuntimeError, r"expected one of \[',', '\]'\]"):
+            list(database._iter_foods_raw(zip_path))
+
+    def test_nutrients_from_raw(self):
+        db = database
+        food = _test_foods_raw()[5]
+        nutrients_check = _all_fields(_test_database()[food['description']])
+        self.assertEqual(db._nutrients_from_raw(food), nutrients_check)
+
+        # Nutrients that are not mapped to a field are ignored
+        def food_nutrient(nutrient_id, name, amount, unit='g'):
+            return {
+                'nutrient': {'id': nutrient_id, 'name': name, 'unitName': unit},
+                'amount': amount,
+            }
+
+        food['foodNutrients'] += [
+            food_nutrient(1008, 'Energy', 123.0, 'kcal'),
+            food_nutrient(1404, 'PUFA 18:3 n-3 c,c,c (ALA)', 3.0),
+        ]
+        self.assertEqual(db._nutrients_from_raw(food), nutrients_check)
+
+        # Mapped nutrients are added together
+        compiled_nutrient_map = db._compile_nutrient_map(
+            dict(db._nutrient_map, fiber=[[1079, 1404]]))
+        self.assertEqual(
+            db._nutrients_from_raw(food, compiled_nutrient_map),
+            dict(nutrients_check, fiber=nutrients_check['fiber'] + 0.03))
+
+        # Amounts are converted to the units of each field
+        food['foodNutrients'] += [
+            food_nutrient(1093, 'Sodium, Na', 0.25, 'g'),
+            food_nutrient(1087, 'Calcium, Ca', 12.0, 'mg'),
+            food_nutrient(1103, 'Selenium, Se', 500.0, 'µg'),
+            food_nutrient(1106, 'Vitamin A, RAE', 0.5, 'mg'),
+            food_nutrient(1235, 'Sugars, added', 7000.0, 'MG'),
+        ]
+        nutrients = db._nutrients_from_raw(food)
+        nutrients_check = dict(
+            nutrients_check,
+            sodium=2.5, calcium=0.12, selenium=5.0, vitamin_a=5.0, added_sugars=0.07)
+        self.assertEqual(nutrients.keys(), nutrients_check.keys())
+
+        for field, amount in nutrients.items():
+            self.assertAlmostEqual(amount, nutrients_check[field], msg=field)
+
+        # Missing optional fields are 0, and missing required fields mean that
+        # the food cannot be converted
+        food['foodNutrients'] = [food_nutrient(1005, 'Carbohydrate, by difference', 10.0)]
+        self.assertEqual(
+            db._nutrients_from_raw(food),
+            _all_fields({'carbs': 0.1}))
+
+        food['foodNutrients'] = [food_nutrient(1004, 'Total lipid (fat)', 10.0)]
+        self.assertIsNone(db._nutrients_from_raw(food))
+
+        food['foodNutrients'] = [food_nutrient(1005, 'Carbohydrate, by difference', 10.0, 'kcal')]
+
+        with self.assertRaisesRegex(RuntimeError, r"expected nutrient 'Carbohydrate, by difference' to be in units 'g', but got 'kcal'"):
+            db._nutrients_from_raw(food)
+
+    def test_install_nutrient_map(self):
+        server = self._serve_datasets({'sr_legacy': _test_foods_raw()})
+
+        try:
+            # Swap fat and protein
+            with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                foodypy.install_database(
+                    overwrite=True, workers=1,
+                    nutrient_map={'fat': [[1003]], 'protein': [[1004]]})
+
+            database._loaded = None
+
+            for name, nutrients_raw in _test_database().items():
+                self.assertEqual(foodypy.get(name), foodypy.Nutrients(**dict(
+                    nutrients_raw,
+                    fat=nutrients_raw['protein'],
+                    protein=nutrients_raw['fat'])))
+
+        finally:
+            server.close()
+
+        with self.assertRaisesRegex(ValueError, r"Unknown nutrient field 'sugar'"):
+            foodypy.install_database(overwrite=True, nutrient_map={'sugar': [[2000]]})
+
+        with self.assertRaisesRegex(TypeError, r"Expected 'nutrient_map\['fat'\]' to be a list of lists"):
+            foodypy.install_database(overwrite=True, nutrient_map={'fat': [1004]})
+
+    def test_download_resume(self):
+        import json
+
+        content = bytes(range(256)) * 1000
+        server = _TestFileServer({'/data.zip': content})
+        url = server.url + '/data.zip'
+        path = os.path.join(self._tmp_dir.name, 'data.zip')
+
+        def interrupted(content, version):
+            # Leaves behind a download interrupted after 12345 bytes
+            with open(path + '.part', 'wb') as f:
+                f.write(content[:12345])
+
+            with open(path + '.part.json', 'w') as f:
+                json.dump(version, f)
+
+        def check_downloaded(content):
+            self.assertFalse(os.path.exists(path + '.part'))
+            self.assertFalse(os.path.exists(path + '.part.json'))
+
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+        try:
+            version = database._download(url, path, chunk_size=1000)
+            self.assertEqual(version, database._remote_version(url))
+            self.assertEqual(server.range_headers, [None])
+            check_downloaded(content)
+
+            # Resume an interrupted download
+            interrupted(content, version)
+            self.assertEqual(database._download(url, path), version)
+            self.assertEqual(server.range_headers[-1], 'bytes=12345-')
+            check_downloaded(content)
+
+            # Resume a download that was already complete
+            os.rename(path, path + '.part')
+
+            with open(path + '.part.json', 'w') as f:
+                json.dump(version, f)
+
+            self.assertEqual(database._download(url, path), version)
+            check_downloaded(content)
+
+            # A download of a file that changed since it was interrupted
+            # starts over
+            new_content = content[::-1]
+            server.files['/data.zip'] = new_content
+            interrupted(content, version)
+            new_version = database._download(url, path)
+            self.assertNotEqual(new_version, version)
+            self.assertEqual(server.range_headers[-1], 'bytes=12345-')
+            check_downloaded(new_content)
+
+            # A partial file without a version cannot be resumed
+            interrupted(new_content, None)
+            database._download(url, path)
+            self.assertEqual(server.range_headers[-1], None)
+            check_downloaded(new_content)
+
+            with self.assertRaisesRegex(RuntimeError, r"failed to get zipfile"):
+                database._download(server.url + '/missing.zip', path)
+
+        finally:
+            server.close()
+
+    def _dataset_files(self, datasets_raw):
+        # Zipfiles of the given datasets, keyed by the path they are served at
+        files = {}
+
+        for dataset, foods_raw in datasets_raw.items():
+            zip_path = os.path.join(self._tmp_dir.name, f'{dataset}.zip')
+            _test_dataset_zip(zip_path, foods_raw)
+
+            with open(zip_path, 'rb') as f:
+                files[f'/{dataset}.zip'] = f.read()
+
+            os.remove(zip_path)
+
+        return files
+
+    def _serve_datasets(self, datasets_raw):
+        # Serves zipfiles of the given datasets, and points the database's
+        # dataset URLs at them
+        server = _TestFileServer(self._dataset_files(datasets_raw))
+        database._dataset_urls = {
+            dataset: f'{server.url}/{dataset}.zip' for dataset in datasets_raw}
+        return server
+
+    def test_install_database(self):
+        db = database
+        server = self._serve_datasets({'sr_legacy': _test_foods_raw()})
+
+        try:
+            with self.assertRaisesRegex(RuntimeError, r"Database already installed"):
+                foodypy.install_database()
+
+            for path in [db._data_path, db._binary_path, db._index_path, db._metadata_path]:
+                os.remove(path)
+
+            for workers in [None, 1, 2]:
+                db._loaded = None
+
+                with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                    foodypy.install_database(overwrite=True, workers=workers)
+
+                self.assertEqual(os.listdir(db._download_dir), [])
+                self.assertEqual(dict(foodypy.copy_database()), {
+                    name: foodypy.Nutrients(**nutrients_raw)
+                    for name, nutrients_raw in _test_database().items()})
+                self.assertEqual(foodypy.get_source('Bananas, raw'), 'sr_legacy')
+
+        finally:
+            server.close()
+
+        with self.assertRaisesRegex(ValueError, r"Unknown dataset 'sr'"):
+            foodypy.install_database(overwrite=True, datasets=['sr'])
+
+        with self.assertRaisesRegex(ValueError, r"Expected at least one dataset"):
+            foodypy.install_database(overwrite=True, datasets=[])
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'duplicates' to be one of"):
+            foodypy.install_database(overwrite=True, duplicates='keep')
+
+    def test_update_database(self):
+        from unittest import mock
+
+        db = database
+        foods_raw = _test_foods_raw()
+        server = self._serve_datasets({'sr_legacy': foods_raw})
+
+        def installed_database():
+            return dict(foodypy.copy_database())
+
+        try:
+            # The test database was installed without publication dates, so
+            # every food is converted again
+            self.assertEqual(
+                foodypy.update_database(workers=1),
+                {'added': 0, 'changed': len(_test_food_names), 'removed': 0})
+            self.assertEqual(installed_database(), {
+                name: foodypy.Nutrients(**nutrients_raw)
+                for name, nutrients_raw in _test_database().items()})
+            self.assertEqual(db._maybe_load_metadata().metadata['Bananas, raw']['published'], '4/1/2019')
+            self.assertEqual(os.listdir(db._download_dir), [])
+
+            # Datasets that did not change are not downloaded again
+            num_downloads = len(server.range_headers)
+            self.assertEqual(
+                foodypy.update_database(workers=1),
+                {'added': 0, 'changed': 0, 'removed': 0})
+            self.assertEqual(len(server.range_headers), num_downloads)
+
+            # Change the amounts of one food and the name of another, remove
+            # one, and add a new food and a duplicate
+            foods_raw[1]['foodNutrients'][0]['amount'] = 50.0
+            foods_raw[1]['publicationDate'] = '4/1/2024'
+            foods_raw[2]['description'] = 'Cowpeas, leafy tips, boiled'
+            foods_raw[2]['publicationDate'] = '4/1/2024'
+            del foods_raw[3]
+            foods_raw.append(dict(foods_raw[0], fdcId=300000))
+            foods_raw.append(dict(foods_raw[4], fdcId=300001, description='Kale, raw'))
+            server.files.update(self._dataset_files({'sr_legacy': foods_raw}))
+
+            with mock.patch.object(db, '_convert_from_raw', wraps=db._convert_from_raw) as convert:
+                self.assertEqual(
+                    foodypy.update_database(workers=1),
+                    {'added': 2, 'changed': 2, 'removed': 1})
+
+            # The loaded database was replaced by the updated one
+            self.assertEqual(db._loaded.version, db._installed_version())
+
+            # Only the changed and added foods are converted
+            self.assertEqual(
+                sorted(food['fdcId'] for call in convert.call_args_list for food in call.args[0]),
+                [100001, 100002, 300000, 300001])
+
+            names = list(installed_database().keys())
+            self.assertEqual(
+                names[:4],
+                ['Peas, green, raw', 'Peas, edible-podded, raw', 'Cowpeas, leafy tips, boiled',
+                 'Babyfood, peas and brown rice'])
+            self.assertEqual(names[-2:], ['Peas, green, raw (FDC ID 300000)', 'Kale, raw'])
+            self.assertEqual(foodypy.get('Peas, edible-podded, raw').fat, 0.5)
+            self.assertEqual(foodypy.search('kale', limit=1)[0][0], 'Kale, raw')
+
+            # The updated search index is the same as a new one
+            index_check = db._build_search_index(names)
+            self.assertEqual(db._loaded.search_index['trigrams'], index_check['trigrams'])
+            self.assertEqual(db._loaded.search_index['processed_names'], db._process_names(names))
+
+            # The database is the same as a new install, except for the order
+            updated = installed_database()
+            updated_sources = {name: foodypy.get_source(name) for name in updated}
+            db._unload_database()
+
+            with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                foodypy.install_database(overwrite=True, workers=1)
+
+            self.assertEqual(installed_database(), updated)
+            self.assertEqual(
+                {name: foodypy.get_source(name) for name in updated}, updated_sources)
+
+        finally:
+            server.close()
+
+        # The database is opened again if it is replaced while it is opened
+        db._unload_database()
+        versions = [db._installed_version(), None]
+
+        with mock.patch.object(db, '_installed_version', side_effect=versions + versions[:1] * 2):
+            with mock.patch.object(db._MappedDatabase, 'open', wraps=db._MappedDatabase.open) as open_mock:
+                self.assertEqual(foodypy.get('Kale, raw'), updated['Kale, raw'])
+
+        self.assertEqual(open_mock.call_count, 2)
+
+        db._unload_database()
+        os.remove(db._data_path)
+
+        with self.assertRaisesRegex(RuntimeError, r"Cannot update database"):
+            foodypy.update_database()
+
+    def test_update_database_skipped(self):
+        from unittest import mock
+
+        db = database
+        foods_raw = _test_foods_raw()
+
+        # Foods without FDC IDs, which updates cannot match
+        for i, description in enumerate(['Spinach, raw', 'Lettuce, raw']):
+            food_raw = dict(foods_raw[2 + i], description=description)
+            del food_raw['fdcId']
+            foods_raw.append(food_raw)
+
+        # A duplicate that is skipped, and a food without carbs
+        foods_raw.append(dict(foods_raw[0], fdcId=300000))
+        foods_raw.append(dict(foods_raw[1], fdcId=300001, description='Kale, raw', foodNutrients=[]))
+        server = self._serve_datasets({'sr_legacy': foods_raw})
+
+        try:
+            with self.assertWarnsRegex(UserWarning, r"Skipped 1 foods"):
+                foodypy.install_database(overwrite=True, duplicates='skip', workers=1)
+
+            installed = dict(foodypy.copy_database())
+            self.assertEqual(len(installed), len(_test_food_names) + 2)
+            version = db._installed_version()
+
+            # Foods that were left out are not converted again or counted as
+            # added, and the database is not written again
+            foods_raw[5]['foodClass'] = 'Changed'
+            server.files.update(self._dataset_files({'sr_legacy': foods_raw}))
+
+            with mock.patch.object(db, '_convert_from_raw', wraps=db._convert_from_raw) as convert:
+                self.assertEqual(
+                    foodypy.update_database(workers=1),
+                    {'added': 0, 'changed': 0, 'removed': 0})
+
+            self.assertEqual(convert.call_count, 0)
+            self.assertEqual(db._installed_version(), version)
+
+            # Removing the food that a skipped duplicate duplicates adds the
+            # duplicate
+            del foods_raw[0]
+            server.files.update(self._dataset_files({'sr_legacy': foods_raw}))
+
+            with mock.patch.object(db, '_convert_from_raw', wraps=db._convert_from_raw) as convert:
+                self.assertEqual(
+                    foodypy.update_database(workers=1),
+                    {'added': 1, 'changed': 0, 'removed': 1})
+
+            self.assertEqual(
+                [food['fdcId'] for call in convert.call_args_list for food in call.args[0]],
+                [300000])
+            self.assertEqual(db._maybe_load_metadata().metadata['Peas, green, raw']['fdc_id'], 300000)
+            self.assertEqual(len(foodypy.copy_database()), len(_test_food_names) + 2)
+
+            # The foods without FDC IDs are kept as they are
+            for name in ['Spinach, raw', 'Lettuce, raw']:
+                self.assertEqual(foodypy.get(name), installed[name])
+
+            # Changing the food that was skipped for having no carbs converts
+            # it again, and it is still skipped
+            foods_raw[-1]['publicationDate'] = '4/1/2024'
+            server.files.update(self._dataset_files({'sr_legacy': foods_raw}))
+
+            with self.assertWarnsRegex(UserWarning, r"Skipped 1 foods"):
+                self.assertEqual(
+                    foodypy.update_database(workers=1),
+                    {'added': 0, 'changed': 0, 'removed': 0})
+        finally:
+            server.close()
+
+    def test_install_multiple_datasets(self):
+        db = database
+        sr_legacy_raw = _test_foods_raw()
+        db._conversion_chunk_size = 3
+
+        # Foundation Foods has some foods with only carbs by summation, and
+        # some without any carbs
+        foundation_raw = []
+
+        for i, food in enumerate(_test_foods_raw()[:4]):
+            food['fdcId'] = 200000 + i
+
+            for food_nutrient in food['foodNutrients']:
+                if food_nutrient['nutrient']['id'] == 1005:
+                    food_nutrient['amount'] = 50.0
+
+                    if i % 2 == 0:
+                        food_nutrient['nutrient']['id'] = 1050
+                        food_nutrient['nutrient']['name'] = 'Carbohydrate, by summation'
+
+            if i == 3:
+                food['foodNutrients'] = [
+                    food_nutrient for food_nutrient in food['foodNutrients']
+                    if food_nutrient['nutrient']['id'] != 1005]
+
+            foundation_raw.append(food)
+
+        foundation_raw.append(dict(foundation_raw[0], fdcId=200004))
+
+        server = self._serve_datasets({
+            'foundation': foundation_raw,
+            'sr_legacy': sr_legacy_raw,
+        })
+
+        try:
+            for workers in [1, 2]:
+                db._loaded = None
+
+                with self.assertWarnsRegex(UserWarning, r"Skipped 1 foods"):
+                    foodypy.install_database(
+                        overwrite=True, datasets=['foundation', 'sr_legacy'],
+                        workers=workers)
+
+                # Foods are ordered by dataset, and duplicates are renamed
+                names = list(foodypy.copy_database().keys())
+                self.assertEqual(names, [
+                    _test_food_names[0],
+                    _test_food_names[1],
+                    _test_food_names[2],
+                    f'{_test_food_names[0]} (FDC ID 200004)',
+                    f'{_test_food_names[0]} (FDC ID 100000)',
+                    f'{_test_food_names[1]} (FDC ID 100001)',
+                    f'{_test_food_names[2]} (FDC ID 100002)',
+                ] + _test_food_names[3:])
+
+                for name in names[:4]:
+                    self.assertEqual(foodypy.get(name).carbs, 0.5)
+                    self.assertEqual(foodypy.get_source(name), 'foundation')
+
+                for name in names[4:]:
+                    self.assertEqual(foodypy.get_source(name), 'sr_legacy')
+
+            db._loaded = None
+
+            with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                foodypy.install_database(
+                    overwrite=True, datasets=['sr_legacy', 'foundation'],
+                    duplicates='skip', workers=1)
+
+            self.assertEqual(
+                list(foodypy.copy_database().keys()),
+                _test_food_names)
+
+            # Errors must not leave a partially written database in place
+            with open(db._data_path) as f:
+                data_check = f.read()
+
+            with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                with self.assertRaisesRegex(RuntimeError, r"multiple entries for food"):
+                    foodypy.install_database(
+                        overwrite=True, datasets=['foundation', 'sr_legacy'],
+                        duplicates='error', workers=1)
+
+            with open(db._data_path) as f:
+                self.assertEqual(f.read(), data_check)
+
+            self.assertFalse(os.path.exists(db._data_path + '.tmp'))
+
+        finally:
+            server.close()
+
+    def test_get_source(self):
+        self.assertEqual(foodypy.get_source('Bananas, raw'), 'sr_legacy')
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name"):
+            foodypy.get_source('not a food')
+
+        # Databases installed without metadata have no sources
+        os.remove(database._metadata_path)
+        database._loaded.metadata = None
+        self.assertIsNone(foodypy.get_source('Bananas, raw'))
+
+    def test_get(self):
+        data = _test_database()
+
+        for name, nutrients_raw in data.items():
+            self.assertEqual(foodypy.get(name), foodypy.Nutrients(**nutrients_raw))
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name"):
+            foodypy.get('not a food')
+
+    def test_get_many(self):
+        data = _test_database()
+        names = ['Bananas, raw', 'Peas, green, raw', 'Bananas, raw']
+        res = foodypy.get_many(names)
+        self.assertIsInstance(res, foodypy.NutrientsArray)
+        self.assertEqual(res.shape, (3,))
+
+        for nutrients, name in zip(res, names):
+            self.assertEqual(nutrients, foodypy.get(name))
+
+        self.assertEqual(foodypy.get_many([]).shape, (0,))
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name 'not a food'"):
+            foodypy.get_many(['Bananas, raw', 'not a food'])
+
+    def test_binary_database(self):
+        import pickle
+        from foodypy.storage import _MappedDatabase
+
+        db = database
+        data = _test_database()
+        foodypy.get('Bananas, raw')
+        self.assertIsInstance(db._loaded.database, _MappedDatabase)
+        self.assertEqual(len(db._loaded.database), len(data))
+        self.assertEqual(list(db._loaded.database), list(data.keys()))
+        data = {name: _all_fields(nutrients_raw) for name, nutrients_raw in data.items()}
+        self.assertEqual(dict(db._loaded.database.items()), data)
+        self.assertNotIn('not a food', db._loaded.database)
+        self.assertNotIn('Bananas', db._loaded.database)
+        self.assertNotIn(None, db._loaded.database)
+
+        for name in data:
+            self.assertIn(name, db._loaded.database)
+            self.assertEqual(db._loaded.database[name], data[name])
+
+        self.assertEqual(
+            [db._loaded.database._row(name) for name in data], list(range(len(data))))
+        self.assertIsNone(db._loaded.database._row('\ud800'))
+
+        loaded = pickle.loads(pickle.dumps(db._loaded.database))
+        self.assertEqual(dict(loaded.items()), data)
+
+        # The rows are sorted by their encoded names
+        sorted_rows = db._loaded.database._sorted_rows.tolist()
+        self.assertEqual(
+            sorted_rows,
+            sorted(range(len(data)), key=lambda row: list(data)[row].encode('utf-8')))
+
+        # Databases of version 1 have the same layout, and databases of
+        # version 2 do not have the sorted rows
+        from foodypy import storage
+
+        with open(db._binary_path, 'rb') as f:
+            content = f.read()
+
+        header = storage._binary_header.unpack_from(content)
+        num_foods = header[3]
+        offsets_end = (
+            storage._binary_header.size + db._loaded.database.table.nbytes + 8 * (num_foods + 1))
+
+        with open(db._binary_path + '.v1', 'wb') as f:
+            f.write(storage._binary_header.pack(header[0], 1, *header[2:]))
+            f.write(content[storage._binary_header.size:])
+
+        with open(db._binary_path + '.v2', 'wb') as f:
+            f.write(storage._binary_header.pack(header[0], 2, *header[2:]))
+            f.write(content[storage._binary_header.size:offsets_end])
+            f.write(content[offsets_end + 8 * num_foods:])
+
+        for version in [1, 2]:
+            old_database = _MappedDatabase.open(f'{db._binary_path}.v{version}')
+            self.assertEqual(dict(old_database.items()), data)
+            self.assertEqual(old_database._sorted_rows.tolist(), sorted_rows)
+            self.assertEqual(old_database._row('Bananas, raw'), list(data).index('Bananas, raw'))
+
+        # Databases installed without the binary file are loaded from JSON
+        os.remove(db._binary_path)
+        db._unload_database()
+        self.assertEqual(foodypy.get('Bananas, raw'), foodypy.Nutrients(**data['Bananas, raw']))
+        self.assertEqual(dict(db._loaded.database.items()), data)
+
+        with open(db._binary_path, 'wb') as f:
+            f.write(b'not a database' * 10)
+
+        with self.assertRaisesRegex(RuntimeError, r"is not a FoodyPy binary database"):
+            _MappedDatabase.open(db._binary_path)
+
+    def test_interrupted_write(self):
+        from unittest import mock
+
+        db = database
+        foods = [('Bananas, raw', {'fat': 1.0}, {}), ('Kale, raw', {'fat': 2.0}, {})]
+        replace = os.replace
+        num_replaced = 0
+
+        # The process stops after the list of files to replace and one of the
+        # files are moved into place
+        def interrupted_replace(src, dst):
+            nonlocal num_replaced
+
+            if num_replaced == 2:
+                raise KeyboardInterrupt
+
+            num_replaced += 1
+            replace(src, dst)
+
+        with mock.patch('os.replace', side_effect=interrupted_replace):
+            with self.assertRaises(KeyboardInterrupt):
+                db._write_database(foods, install_info={'datasets': ['sr_legacy']})
+
+        self.assertTrue(os.path.exists(db._replacing_path))
+
+        # The next process that loads the database finishes replacing the
+        # files
+        db._unload_database()
+        self.assertEqual(foodypy.get('Kale, raw').fat, 2.0)
+        self.assertEqual(list(foodypy.copy_database()), ['Bananas, raw', 'Kale, raw'])
+        self.assertEqual(db._read_install_info(), {'datasets': ['sr_legacy']})
+        self.assertFalse(os.path.exists(db._replacing_path))
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(db._data_dir)))
+
+    def test_prepared_cache(self):
+        import pickle
+        from unittest import mock
+
+        db = database
+        res_check = foodypy.search('chicken breast', limit=3)
+
+        # Installing caches the prepared search index, so the JSON index is not
+        # needed
+        db._unload_database()
+        with open(db._index_path, 'w') as f:
+            f.write('not json')
+        self.assertEqual(foodypy.search('chicken breast', limit=3), res_check)
+        self.assertEqual(
+            db._loaded.search_index['processed_names'][True][6],
+            'chicken  broilers or fryers  breast  meat only  raw')
+
+        # A cache that was written for another version of the database, or
+        # that cannot be read, is rebuilt
+        os.remove(db._index_path)
+        os.utime(db._data_path, ns=(0, 0))
+        db._unload_database()
+        self.assertEqual(foodypy.search('chicken breast', limit=3), res_check)
+
+        with open(db._index_cache_path, 'rb') as f:
+            self.assertEqual(pickle.load(f)['database_version'], db._installed_version())
+
+        with open(db._index_cache_path, 'wb') as f:
+            f.write(b'not a pickle')
+        db._unload_database()
+        self.assertEqual(foodypy.search('chicken breast', limit=3), res_check)
+        self.assertIsNotNone(db._read_cache(db._index_cache_path, db._installed_version()))
+
+        # Databases without the binary file cache their columns
+        bananas = foodypy.get('Bananas, raw')
+        os.remove(db._binary_path)
+        db._unload_database()
+        self.assertEqual(foodypy.get('Bananas, raw'), bananas)
+        self.assertTrue(os.path.exists(db._columns_cache_path))
+        db._unload_database()
+
+        with mock.patch.object(db.json, 'loads', side_effect=AssertionError):
+            self.assertEqual(foodypy.get('Bananas, raw'), bananas)
+            self.assertEqual(foodypy.search('chicken breast', limit=3), res_check)
+
+        db._write_database([('Bananas, raw', {'fat': 1.0}, {})])
+        self.assertFalse(os.path.exists(db._columns_cache_path))
+        self.assertEqual(foodypy.get('Bananas, raw').fat, 1)
+
+    def test_threaded_loading(self):
+        import threading
+        import time
+        from unittest import mock
+        from foodypy.storage import _MappedDatabase
+
+        db = database
+        res_check = foodypy.search('chicken breast', limit=3)
+        get_check = foodypy.get('Bananas, raw')
+        db._unload_database()
+
+        num_threads = 8
+        barrier = threading.Barrier(num_threads)
+        results = [None] * num_threads
+        open_database = _MappedDatabase.open
+        read_cache = db._read_cache
+
+        def slow_open(path):
+            time.sleep(0.05)
+            return open_database(path)
+
+        def slow_read_cache(path, database_version):
+            time.sleep(0.05)
+            return read_cache(path, database_version)
+
+        def worker(i):
+            barrier.wait()
+            results[i] = (
+                foodypy.search('chicken breast', limit=3),
+                foodypy.get('Bananas, raw'))
+
+        with mock.patch.object(_MappedDatabase, 'open', side_effect=slow_open) as open_mock, \
+                mock.patch.object(db, '_read_cache', side_effect=slow_read_cache) as read_cache_mock:
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(open_mock.call_count, 1)
+        self.assertEqual(read_cache_mock.call_count, 1)
+
+        for search_res, get_res in results:
+            self.assertEqual(search_res, res_check)
+            self.assertEqual(get_res, get_check)
+
+    def test_threaded_reload(self):
+        import threading
+
+        queries = ['chicken breast', 'peas', 'banana', 'whole wheat bread']
+        search_checks = {query: foodypy.search(query, limit=3) for query in queries}
+        get_check = foodypy.get('Bananas, raw')
+        recipe = foodypy.Recipe({'Bananas, raw': 120, 'Peas, green, raw': 80})
+        recipe_check = recipe.nutrients()
+
+        stop = threading.Event()
+        errors = []
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    for query in queries:
+                        self.assertEqual(foodypy.search(query, limit=3), search_checks[query])
+
+                    self.assertEqual(foodypy.get('Bananas, raw'), get_check)
+                    self.assertEqual(recipe.nutrients(), recipe_check)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Searches and gets that are running keep using the database that
+            # they started with while it is reloaded or closed
+            for i in range(100):
+                if i % 10 == 0:
+                    foodypy.close()
+                else:
+                    foodypy.reload()
+        finally:
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_preload(self):
+        db = database
+        foodypy.preload(search=False)
+        self.assertIsNotNone(db._loaded.columns)
+        self.assertIsNotNone(db._loaded.metadata)
+        self.assertIsNone(db._loaded.search_index)
+
+        foodypy.search('peas')
+        foodypy.close()
+        self.assertFalse(foodypy.database_status()['loaded'])
+        self.assertIsNone(db._loaded)
+        self.assertEqual(foodypy.search_cache_info()['size'], 0)
+
+        foodypy.preload()
+        self.assertIsNotNone(db._loaded.search_index)
+
+        # Reloading picks up changes made by other processes
+        columns = db._loaded.columns
+        foodypy.reload()
+        self.assertIsNot(db._loaded.columns, columns)
+        self.assertIsNotNone(db._loaded.search_index)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_fork(self):
+        import threading
+
+        db = database
+        foodypy.preload()
+        res_check = foodypy.search('chicken breast', limit=3)
+        db._unload_database()
+
+        # The child must be able to load the database even if another thread
+        # held the lock when the process forked
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with db._load_lock:
+                locked.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+
+        try:
+            pid = os.fork()
+
+            if pid == 0:
+                ok = False
+                try:
+                    ok = foodypy.search('chicken breast', limit=3) == res_check
+                finally:
+                    os._exit(0 if ok else 1)
+        finally:
+            release.set()
+            thread.join()
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def test_search_matches_full_scan(self):
+        import random
+        from fuzzywuzzy import fuzz, process
+
+        # A database with more foods than the shortlist, so that foods which
+        # are not shortlisted must be found too
+        words = [
+            'peas', 'green', 'raw', 'chicken', 'breast', 'rice', 'brown',
+            'cooked', 'oatmeal', 'oat', 'meal', 'cheese', 'cheddar', 'whole',
+            'roasted', 'crème', 'jalapeño', 'ice', 'cream', 'vanilla', 'a',
+            'egg', 'eggs', 'bread', 'wheat', 'apple', 'juice', 'canned',
+            '80%', 'lean', 'beef', 'ground', 'milk', '3.25%', 'fat', 'tea',
+        ]
+        rng = random.Random(0)
+        names = list(dict.fromkeys(
+            ', '.join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+            for _ in range(300)))
+        self.assertGreater(len(names), database._search_shortlist_size)
+
+        database._write_database((name, {'fat': 1.0}, {}) for name in names)
+
+        def first_letters(a, b):
+            return 100 if a[:1] == b[:1] else 0
+
+        queries = [
+            'oatmeal', 'peas', 'chicken breast', 'vanilla ice cream', 'a', '',
+            'creme', 'roasted cheddar cheese', 'xyz', 'tea, green',
+        ]
+        scorers = [None, first_letters] + database._search_scorers
+
+        for query in queries:
+            search_term = database._normalize_search_term(query)
+
+            for scorer in scorers:
+                scorer_func = getattr(fuzz, scorer) if isinstance(scorer, str) else scorer
+                all_results = process.extractBests(
+                    search_term, names, scorer=scorer_func or fuzz.WRatio, limit=None)
+
+                for shortlist_size in [256, 16]:
+                    database._search_shortlist_size = shortlist_size
+                    foodypy.clear_search_cache()
+
+                    # Without a cutoff, all the foods are returned if there
+                    # is no limit, so that is only checked with a cutoff
+                    for limit, score_cutoff in [(1, 0), (10, 0), (0, 85), (10, 85), (None, 85)]:
+                        res_check = [
+                            result for result in all_results
+                            if result[1] >= score_cutoff][:limit]
+                        res = foodypy.search(
+                            query, limit=limit, scorer=scorer, score_cutoff=score_cutoff)
+                        self.assertEqual(
+                            res, res_check, (shortlist_size, query, scorer, limit, score_cutoff))
+
+    def test_search_scorers(self):
+        from fuzzywuzzy import utils
+        from foodypy import scoring
+
+        queries = [
+            'peas', 'chicken breast', 'vanilla ice cream', 'rice', 'a', '',
+            'raw chicken', 'whole wheat bread', 'brown rice cooked', 'Ice',
+            'banana', 'egg', 'apple juice unsweetened canned', 'xyz',
+        ]
+
+        # The bounds of the scores really are upper bounds
+        for force_ascii in [True, False]:
+            names = [
+                utils.full_process(name, force_ascii=force_ascii)
+                for name in _test_food_names + queries]
+            stats = scoring._name_stats(names)
+
+            for query in names:
+                scoring_query = scoring._Query(query)
+
+                for scorer in scoring._bounded_scorers:
+                    score_func, _, _ = database._get_scorer(scorer)
+                    bounds = scoring._upper_bounds(scorer, scoring_query, stats)
+
+                    for name, bound in zip(names, bounds):
+                        score = score_func(query, name)
+                        self.assertLessEqual(score, bound, (scorer, query, name))
+                        self.assertTrue(
+                            scoring._reaches(scorer, scoring_query, name, score),
+                            (scorer, query, name))
+
+        with self.assertRaisesRegex(ValueError, r"Unknown scorer 'nope'"):
+            foodypy.search('peas', scorer='nope')
+
+        with self.assertRaises(TypeError):
+            foodypy.search('peas', scorer=1)
+
+        # Invalid limits are not run or cached
+        for search_func, query in [(foodypy.search, 'peas'), (foodypy.search_many, ['peas'])]:
+            with self.assertRaisesRegex(ValueError, r"Expected 'limit' to be None or >= 0"):
+                search_func(query, limit=-1)
+
+            with self.assertRaisesRegex(TypeError, r"Expected 'limit' to be"):
+                search_func(query, limit=2.5)
+
+        self.assertEqual(foodypy.search('peas', limit=0), [])
+
+    def test_search_many(self):
+        queries = ['peas', 'chicken breast', 'vanilla ice cream', 'rice', 'a'] * 3
+        res_check = [foodypy.search(query, limit=4) for query in queries]
+
+        for workers in [None, 1, 2]:
+            res = foodypy.search_many(queries, limit=4, workers=workers)
+            self.assertEqual(res, res_check)
+
+        self.assertEqual(foodypy.search_many([]), [])
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'workers >= 1'"):
+            foodypy.search_many(queries, workers=0)
+
+    def test_search_cache(self):
+        db = database
+        res_check = foodypy.search('chicken breast', limit=3)
+        self.assertEqual(foodypy.search_cache_info(), {
+            'hits': 0, 'misses': 1, 'prefix_hits': 0, 'size': 1,
+            'max_size': 1024, 'ttl': None})
+
+        # Search terms are normalized
+        for search_term in ['chicken breast', 'Chicken, breast', '  CHICKEN  breast!']:
+            self.assertEqual(foodypy.search(search_term, limit=3), res_check)
+
+        self.assertEqual(foodypy.search_cache_info()['hits'], 3)
+
+        # Results are cached for each limit
+        self.assertEqual(foodypy.search('chicken breast', limit=2), res_check[:2])
+        self.assertEqual(foodypy.search_cache_info()['misses'], 2)
+
+        # Returned results can be modified without affecting the cache
+        foodypy.search('chicken breast', limit=2).clear()
+        self.assertEqual(foodypy.search('chicken breast', limit=2), res_check[:2])
+
+        # Longer search terms reuse the trigram counts of shorter ones
+        foodypy.clear_search_cache()
+        self.assertEqual(foodypy.search_cache_info()['misses'], 0)
+
+        for search_term in ['chi', 'chic', 'chick', 'chicken', 'chicken b', 'chicken breast']:
+            res = foodypy.search(search_term, limit=3)
+            db._overlap_cache.clear()
+            db._search_cache.clear()
+            self.assertEqual(foodypy.search(search_term, limit=3), res)
+
+        self.assertEqual(foodypy.search_cache_info()['prefix_hits'], 5)
+        self.assertEqual(foodypy.search('chicken breast', limit=3), res_check)
+
+        # Reinstalling the database invalidates the cache
+        db._write_database(
+            (name.upper(), nutrients_raw, {})
+            for name, nutrients_raw in _test_database().items())
+        self.assertEqual(
+            foodypy.search('chicken breast', limit=3),
+            [(name.upper(), score) for name, score in res_check])
+
+        foodypy.configure_search_cache(max_size=2)
+        foodypy.search('peas')
+        foodypy.search('rice')
+        foodypy.search('apple')
+        self.assertEqual(foodypy.search_cache_info()['size'], 2)
+        foodypy.search('peas')
+        self.assertEqual(foodypy.search_cache_info()['hits'], 0)
+
+        foodypy.configure_search_cache(max_size=0)
+        foodypy.search('peas')
+        foodypy.search('peas')
+        self.assertEqual(foodypy.search_cache_info()['size'], 0)
+        self.assertEqual(foodypy.search_cache_info()['hits'], 0)
+
+        foodypy.configure_search_cache(ttl=1e-9)
+        foodypy.search('peas')
+        foodypy.search('peas')
+        self.assertEqual(foodypy.search_cache_info()['hits'], 0)
+        self.assertEqual(foodypy.search_cache_info()['misses'], 2)
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'max_size >= 0'"):
+            foodypy.configure_search_cache(max_size=-1)
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'ttl > 0'"):
+            foodypy.configure_search_cache(ttl=0)
+
+    def test_search_index_persisted(self):
+        db = database
+        self.assertTrue(os.path.exists(db._index_path))
+        foodypy.search('peas')
+        self.assertEqual(db._loaded.search_index['names'], _test_food_names)
+
+        # A missing index gets rebuilt in memory
+        os.remove(db._index_path)
+        db._loaded.search_index = None
+        self.assertEqual(foodypy.search('peas', limit=3)[0][0], 'Peas, green, raw')
+
+    def test_similar(self):
+        import numpy as np
+
+        db = database
+        names = list(foodypy.copy_database().keys())
+        table = foodypy.get_many(names)._values
+        scale = table.std(axis=0)
+        scale[scale == 0] = 1
+        scaled = table / scale
+        unit = scaled / np.maximum(np.linalg.norm(scaled, axis=1, keepdims=True), 1e-300)
+
+        def distances_check(food_name, metric):
+            row = names.index(food_name)
+
+            if metric == 'euclidean':
+                return np.linalg.norm(scaled - scaled[row], axis=1)
+            elif metric == 'manhattan':
+                return np.abs(scaled - scaled[row]).sum(axis=1)
+            else:
+                return 1 - unit @ unit[row]
+
+        # Installing builds the index
+        self.assertTrue(os.path.exists(db._similar_cache_path))
+
+        for use_trees in [True, False]:
+            db._unload_database()
+            db._maybe_load_similar_index()
+
+            if not use_trees:
+                db._loaded.similar_index['trees'] = None
+
+            for metric in ['euclidean', 'manhattan', 'cosine']:
+                for food_name in _test_food_names[:5]:
+                    for k in [0, 1, 3, len(names)]:
+                        results = foodypy.similar(food_name, k, metric=metric)
+                        distances = distances_check(food_name, metric)
+                        distances[names.index(food_name)] = np.inf
+                        self.assertEqual(len(results), min(k, len(names) - 1))
+                        self.assertNotIn(food_name, [name for name, _ in results])
+
+                        # The nearest foods are found, but ties can be in any order
+                        np.testing.assert_allclose(
+                            [distance for _, distance in results],
+                            np.sort(distances)[:len(results)], atol=1e-9)
+                        np.testing.assert_allclose(
+                            [distance for _, distance in results],
+                            [distances[names.index(name)] for name, _ in results], atol=1e-9)
+
+                results = foodypy.similar_many(_test_food_names[:5], 3, metric=metric)
+                results_check = [
+                    foodypy.similar(food_name, 3, metric=metric)
+                    for food_name in _test_food_names[:5]]
+                self.assertEqual(
+                    [[name for name, _ in result] for result in results],
+                    [[name for name, _ in result] for result in results_check])
+                np.testing.assert_allclose(
+                    [[distance for _, distance in result] for result in results],
+                    [[distance for _, distance in result] for result in results_check],
+                    atol=1e-9)
+
+        self.assertEqual(foodypy.similar_many([]), [])
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name 'nope'"):
+            foodypy.similar('nope')
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'metric' to be one of"):
+            foodypy.similar(_test_food_names[0], metric='nope')
+
+        with self.assertRaises(ValueError):
+            foodypy.similar(_test_food_names[0], -1)
+
+    def test_parse(self):
+        db = database
+        foods_raw = {food['description']: food for food in _test_foods_raw()}
+
+        def sr_portion(amount, modifier, grams):
+            return {'amount': amount, 'modifier': modifier, 'gramWeight': grams,
+                    'measureUnit': {'name': 'undetermined'}}
+
+        foods_raw['Peas, green, raw']['foodPortions'] = [
+            sr_portion(1, 'cup', 145.0), sr_portion(10, 'pods', 34.0)]
+        foods_raw['Bananas, raw']['foodPortions'] = [
+            sr_portion(1, 'medium (7" to 7-7/8" long)', 118.0),
+            sr_portion(1, 'cup, mashed', 225.0)]
+        foods_raw['Bread, whole-wheat, commercially prepared']['foodPortions'] = [
+            {'amount': 1, 'gramWeight': 32.0, 'measureUnit': {'name': 'slice'}}]
+        foods_raw['Milk, whole, 3.25% milkfat']['foodPortions'] = [
+            {'portionDescription': '1/2 cup', 'modifier': '10205', 'gramWeight': 122.0}]
+
+        server = self._serve_datasets({'sr_legacy': list(foods_raw.values())})
+
+        try:
+            with self.assertWarnsRegex(UserWarning, r"Installing FoodyPy database"):
+                foodypy.install_database(overwrite=True, workers=1)
+        finally:
+            server.close()
+
+        self.assertEqual(foodypy.get_portions('Peas, green, raw'), {'cup': 145.0, 'pod': 3.4})
+        self.assertEqual(
+            foodypy.get_portions('Bananas, raw'), {'medium': 118.0, 'cup': 225.0})
+        self.assertEqual(foodypy.get_portions('Milk, whole, 3.25% milkfat'), {'cup': 244.0})
+        self.assertEqual(foodypy.get_portions('Chicken, ground, raw'), {})
+
+        peas = foodypy.get('Peas, green, raw')
+        result = foodypy.parse('2 cups peas')
+        self.assertEqual(result['food_name'], 'Peas, green, raw')
+        self.assertEqual((result['quantity'], result['unit']), (2, 'cup'))
+        self.assertAlmostEqual(result['grams'], 290)
+        self.assertEqual(result['nutrients'], peas * 290)
+
+        grams_checks = [
+            ('1/2 cup of peas', 72.5),
+            ('1 1/2 cups peas', 217.5),
+            ('1½ cups peas', 217.5),
+            ('three pods peas', 10.2),
+            ('1 tbsp peas', 145 / 16),
+            ('100g peas', 100),
+            ('100 grams peas', 100),
+            ('2 oz peas', 2 * 28.349523125),
+            ('peas', 145),
+            ('a banana', 118),
+            ('2 bananas', 236),
+            ('2 slices bread', 64),
+            ('1 cup milk', 244),
+        ]
+
+        for text, grams in grams_checks:
+            self.assertAlmostEqual(foodypy.parse(text)['grams'], grams, msg=text)
+
+        with self.assertRaisesRegex(ValueError, r"does not have a portion for unit 'slice'"):
+            foodypy.parse('2 slices peas')
+
+        with self.assertRaisesRegex(ValueError, r"does not have any portions to count"):
+            foodypy.parse('2 chicken ground')
+
+        with self.assertRaisesRegex(ValueError, r"Did not find a food in"):
+            foodypy.parse('1 1/2')
+
+        for text in ['1/0 cup peas', '1 1/0 cup peas']:
+            with self.assertRaisesRegex(ValueError, r"Expected the fraction in '.*' to have a nonzero denominator"):
+                foodypy.parse(text)
+
+        with self.assertRaisesRegex(TypeError, r"Expected 'text' to be"):
+            foodypy.parse(2)
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name"):
+            foodypy.get_portions('peas')
+
+        # Parsing many lines gives the same results as parsing each line
+        lines = [text for text, _ in grams_checks]
+        results = foodypy.parse_many(lines)
+
+        for line, result in zip(lines, results):
+            self.assertEqual(result, foodypy.parse(line))
+
+        results = foodypy.parse_many(
+            ['2 slices peas', '1 cup milk', '1 1/2', '1/0 cup peas'], errors='ignore')
+        self.assertEqual(results, [None, foodypy.parse('1 cup milk'), None, None])
+
+        with self.assertRaisesRegex(ValueError, r"nonzero denominator"):
+            foodypy.parse_many(['1 cup milk', '1/0 cup peas'])
+
+        with self.assertRaisesRegex(ValueError, r"does not have a portion"):
+            foodypy.parse_many(['1 cup milk', '2 slices peas'])
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'errors' to be one of"):
+            foodypy.parse_many(['1 cup milk'], errors='skip')
+
+        # Databases installed before portions were recorded have none, and
+        # the table is built from the metadata if its cache is missing
+        os.remove(db._portions_cache_path)
+        db._unload_database()
+        self.assertEqual(foodypy.get_portions('Bread, whole-wheat, commercially prepared'), {'slice': 32.0})
+        self.assertTrue(os.path.exists(db._portions_cache_path))
+
+    def test_instrumentation(self):
+        spans = []
+        foodypy.stats(reset=True)
+
+        # Nothing is recorded while instrumentation is disabled
+        foodypy.add_span_hook(spans.append)
+
+        try:
+            foodypy.get('Bananas, raw')
+            self.assertEqual(foodypy.stats(), {'enabled': False, 'spans': {}, 'counters': {}})
+            self.assertEqual(spans, [])
+
+            foodypy.enable_instrumentation()
+            database._unload_database()
+            foodypy.search('chicken breast')
+            foodypy.search('chicken breast')
+
+            with self.assertRaises(ValueError):
+                foodypy.get('nope')
+
+            stats = foodypy.stats()
+            self.assertTrue(stats['enabled'])
+            self.assertEqual(stats['spans']['search']['count'], 2)
+            self.assertEqual(stats['spans']['search.score']['count'], 1)
+            self.assertEqual(stats['spans']['search_index.load']['count'], 1)
+            self.assertEqual(stats['spans']['database.load']['count'], 1)
+            self.assertEqual(stats['spans']['get']['errors'], 1)
+            self.assertEqual(stats['counters'], {'search.cache_misses': 1, 'search.cache_hits': 1})
+
+            for span_stats in stats['spans'].values():
+                self.assertGreaterEqual(span_stats['total_s'], span_stats['max_s'])
+                self.assertAlmostEqual(
+                    span_stats['mean_s'], span_stats['total_s'] / span_stats['count'])
+
+            # Spans know the span that they ran inside of
+            spans_by_name = {span.name: span for span in reversed(spans)}
+            self.assertIs(spans_by_name['search.score'].parent, spans_by_name['search'])
+            self.assertIsNone(spans_by_name['search'].parent)
+            self.assertGreater(spans_by_name['search.score'].attributes['candidates'], 0)
+            self.assertIsInstance(spans[-1].error, ValueError)
+
+            # A hook that fails does not break the operation
+            def failing_hook(span):
+                raise RuntimeError('failed')
+
+            foodypy.add_span_hook(failing_hook)
+
+            with self.assertWarnsRegex(UserWarning, r"raised RuntimeError\('failed'\)"):
+                foodypy.get('Bananas, raw')
+
+            foodypy.remove_span_hook(failing_hook)
+
+            self.assertEqual(foodypy.stats(reset=True)['spans']['get']['count'], 2)
+            self.assertEqual(foodypy.stats()['spans'], {})
+
+            foodypy.disable_instrumentation()
+            num_spans = len(spans)
+            foodypy.get('Bananas, raw')
+            self.assertEqual(len(spans), num_spans)
+            self.assertEqual(foodypy.stats()['spans'], {})
+
+        finally:
+            foodypy.disable_instrumentation()
+            foodypy.remove_span_hook(spans.append)
+            foodypy.stats(reset=True)
+
+        with self.assertRaises(ValueError):
+            foodypy.remove_span_hook(spans.append)
+
+        with self.assertRaises(TypeError):
+            foodypy.add_span_hook(1)
+
+    def test_recipe(self):
+        def assert_nutrients_close(a, b):
+            self.assertEqual(len(a._values), len(b._values))
+            for a_value, b_value in zip(a._values, b._values):
+                self.assertAlmostEqual(a_value, b_value)
+
+        bananas = foodypy.get('Bananas, raw')
+        milk = foodypy.get('Milk, whole, 3.25% milkfat')
+        bread = foodypy.get('Bread, whole-wheat, commercially prepared')
+
+        smoothie = foodypy.Recipe({'Bananas, raw': 120, 'Milk, whole, 3.25% milkfat': 250}, servings=2)
+        assert_nutrients_close(smoothie.nutrients(), 120 * bananas + 250 * milk)
+        assert_nutrients_close(smoothie.per_serving(), (120 * bananas + 250 * milk) / 2)
+        self.assertEqual(smoothie.servings, 2)
+        self.assertEqual(smoothie.ingredients, {'Bananas, raw': 120, 'Milk, whole, 3.25% milkfat': 250})
+
+        # Nested recipes are given in servings, and foods that appear more
+        # than once are combined
+        breakfast = foodypy.Recipe({smoothie: 1, 'Bananas, raw': 30, 'Bread, whole-wheat, commercially prepared': 80})
+        breakfast_check = 90 * bananas + 125 * milk + 80 * bread
+        assert_nutrients_close(breakfast.nutrients(), breakfast_check)
+        self.assertEqual(len(breakfast._compile(database._maybe_load_columns())[0]), 3)
+
+        assert_nutrients_close(breakfast.scale(3).nutrients(), 3 * breakfast_check)
+        self.assertEqual(breakfast.scale(0.5).ingredients[smoothie], 0.5)
+
+        empty = foodypy.Recipe({})
+        self.assertEqual(empty.nutrients(), foodypy.Nutrients())
+
+        recipes = [smoothie, empty, breakfast, empty, smoothie.scale(2)]
+        res = foodypy.Recipe.evaluate_many(recipes)
+        self.assertEqual(res.shape, (5,))
+        for i, recipe in enumerate(recipes):
+            assert_nutrients_close(res[i], recipe.nutrients())
+
+        res = foodypy.Recipe.evaluate_many(recipes, per_serving=True)
+        for i, recipe in enumerate(recipes):
+            assert_nutrients_close(res[i], recipe.per_serving())
+
+        self.assertEqual(foodypy.Recipe.evaluate_many([]).shape, (0,))
+
+        # Recipes are compiled again after the database is reinstalled
+        database._write_database(
+            (name, {'fat': 1.0}, {}) for name in _test_food_names)
+        self.assertEqual(breakfast.nutrients().fat, 295)
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name 'nope'"):
+            foodypy.Recipe({'nope': 1}).nutrients()
+
+        with self.assertRaises(TypeError):
+            foodypy.Recipe({1: 1})
+
+        with self.assertRaises(TypeError):
+            foodypy.Recipe(['Bananas, raw'])
+
+        with self.assertRaises(ValueError):
+            foodypy.Recipe({'Bananas, raw': -1})
+
+        with self.assertRaises(ValueError):
+            foodypy.Recipe({'Bananas, raw': 1}, servings=0)
+
+        with self.assertRaises(TypeError):
+            foodypy.Recipe.evaluate_many([smoothie, 'Bananas, raw'])
+
+    def test_optimize(self):
+        import numpy as np
+        from foodypy import optimize
+
+        food_names = [_test_food_names[i] for i in [2, 4, 10]]
+        nutrients = foodypy.get_many(food_names)
+
+        # Targets that some amounts of the foods hit exactly
+        amounts_check = np.array([
+            [100, 50, 200],
+            [0, 300, 20],
+            [250, 0, 0],
+        ], dtype=float)
+        plans = amounts_check @ nutrients
+        fields = ['fat', 'carbs', 'protein', 'fiber']
+        targets = {field: getattr(plans, field) for field in fields}
+
+        methods = ['gradient'] + (['scipy'] if optimize._have_scipy() else [])
+
+        for method in methods:
+            amounts = optimize.solve_amounts(food_names, targets, method=method)
+            self.assertEqual(amounts.shape, (3, 3))
+            np.testing.assert_allclose(amounts, amounts_check, atol=1e-3)
+
+            amounts = optimize.solve_amounts(
+                food_names,
+                [{field: targets[field][1] for field in fields}, {'fat': 0, 'carbs': 0, 'protein': 0, 'fiber': 0}],
+                method=method)
+            np.testing.assert_allclose(amounts, [amounts_check[1], [0, 0, 0]], atol=1e-3)
+
+            amounts = optimize.solve_amounts(
+                food_names, {'calories': 500, 'protein': 0}, method=method)
+            self.assertEqual(amounts.shape, (3,))
+            self.assertAlmostEqual((amounts @ nutrients).calories, 500, delta=0.01)
+
+            # Limits on the amounts are kept
+            amounts = optimize.solve_amounts(
+                food_names, {field: targets[field][0] for field in fields},
+                max_grams=[1000, 1000, 150], method=method)
+            self.assertLessEqual(amounts[2], 150 + 1e-9)
+            self.assertTrue((amounts >= 0).all())
+
+            # Foods with a limit of 0 are not used
+            amounts = optimize.solve_amounts(food_names, targets, max_grams=0, method=method)
+            np.testing.assert_array_equal(amounts, np.zeros((3, 3)))
+
+            amounts = optimize.solve_amounts(
+                food_names, {field: targets[field][2] for field in fields},
+                max_grams=[1000, 0, 0], method=method)
+            np.testing.assert_allclose(amounts, amounts_check[2], atol=1e-3)
+
+            amounts = optimize.solve_amounts(
+                food_names, {field: targets[field][0] for field in fields},
+                max_grams=[1000, 0, 1000], method=method)
+            self.assertEqual(amounts[1], 0)
+            self.assertTrue((amounts >= 0).all())
+
+        # A field with a weight of 0 is ignored
+        amounts = optimize.solve_amounts(
+            food_names, {'fat': 2.5, 'carbs': 10000}, weights={'carbs': 0},
+            method='gradient')
+        self.assertAlmostEqual((amounts @ nutrients).fat, 2.5, places=3)
+
+        # Expensive foods are avoided
+        amounts = optimize.solve_amounts(
+            food_names, {'carbs': 50}, cost=[0, 0, 1], method='gradient')
+        self.assertEqual(amounts[2], 0)
+        self.assertAlmostEqual((amounts @ nutrients).carbs, 50, places=1)
+
+        with self.assertRaisesRegex(ValueError, r"Unknown nutrient field 'nope'"):
+            optimize.solve_amounts(food_names, {'nope': 1})
+
+        with self.assertRaisesRegex(ValueError, r"Expected the targets to be finite and >= 0"):
+            optimize.solve_amounts(food_names, {'fat': -1})
+
+        with self.assertRaisesRegex(ValueError, r"one target per plan"):
+            optimize.solve_amounts(food_names, {'fat': [1, 2], 'carbs': [1, 2, 3]})
+
+        with self.assertRaisesRegex(ValueError, r"the same fields"):
+            optimize.solve_amounts(food_names, [{'fat': 1}, {'carbs': 1}])
+
+        with self.assertRaisesRegex(ValueError, r"'cost' can only be used"):
+            optimize.solve_amounts(food_names, {'fat': 1}, cost=[1, 1, 1], method='scipy')
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name"):
+            optimize.solve_amounts(['nope'], {'fat': 1})
+
+    def test_logs(self):
+        import datetime
+        import numpy as np
+        import foodypy.logs as logs
+
+        rng = np.random.default_rng(0)
+        num_rows = 1000
+        users = rng.choice(np.array(['ann', 'bob', 'cy']), num_rows)
+        timestamps = (
+            np.datetime64('2024-01-29T00:00')
+            + rng.integers(0, 60 * 24 * 60, num_rows).astype('timedelta64[m]'))
+        foods = rng.choice(np.array(_test_food_names, dtype=object), num_rows)
+        grams = rng.uniform(10, 300, num_rows)
+        log = {'user': users, 'timestamp': timestamps, 'food': foods, 'grams': grams}
+
+        def totals_check(user, start, end):
+            # Total nutrients, grams, and rows of a user between two days
+            days = timestamps.astype('datetime64[D]')
+            mask = (users == user) & (days >= start) & (days < end)
+            nutrients = sum(
+                (foodypy.get(food) * amount for food, amount in zip(foods[mask], grams[mask])),
+                foodypy.Nutrients())
+            return nutrients, grams[mask].sum(), mask.sum()
+
+        def assert_totals_equal(result, check):
+            self.assertTrue((result['user'] == check['user']).all())
+            self.assertTrue((result['period'] == check['period']).all())
+            self.assertTrue(np.allclose(result['nutrients']._values, check['nutrients']._values))
+            self.assertTrue(np.allclose(result['grams'], check['grams']))
+            self.assertTrue((result['count'] == check['count']).all())
+
+        period_lengths = {
+            'day': lambda start: start + 1,
+            'week': lambda start: start + 7,
+            'month': lambda start: (start.astype('datetime64[M]') + 1).astype('datetime64[D]'),
+        }
+
+        for by, period_end in period_lengths.items():
+            result = logs.aggregate(log, by=by)
+            self.assertEqual(result['by'], by)
+            self.assertEqual(result['count'].sum(), num_rows)
+
+            # Sorted by user and then period, with one element for each
+            keys = list(zip(result['user'].tolist(), result['period'].tolist()))
+            self.assertEqual(keys, sorted(set(keys)))
+
+            for i in range(0, len(keys), max(1, len(keys) // 10)):
+                nutrients, total_grams, count = totals_check(
+                    result['user'][i], result['period'][i], period_end(result['period'][i]))
+                self.assertTrue(np.allclose(result['nutrients'][i]._values, nutrients._values))
+                self.assertAlmostEqual(result['grams'][i], total_grams)
+                self.assertEqual(result['count'][i], count)
+
+            # Chunks of any size give the same totals
+            for chunk_size in [1, 7, 333]:
+                assert_totals_equal(logs.aggregate(log, by=by, chunk_size=chunk_size), result)
+
+            chunks = [
+                {name: column[start:start + 100] for name, column in log.items()}
+                for start in range(0, num_rows, 100)]
+            assert_totals_equal(logs.aggregate(iter(chunks), by=by, chunk_size=150), result)
+
+        # Weeks start on Monday
+        weekly = logs.aggregate(log, by='week')
+        self.assertTrue(all(period.weekday() == 0 for period in weekly['period'].tolist()))
+        monthly = logs.aggregate(log, by='month')
+        self.assertTrue(all(period.day == 1 for period in monthly['period'].tolist()))
+
+        # Timestamps can be seconds since the epoch or datetimes, and columns
+        # can have other names
+        daily = logs.aggregate(log)
+        assert_totals_equal(logs.aggregate({
+            'user_id': users.tolist(),
+            'eaten_at': (timestamps - np.datetime64(0, 's')) / np.timedelta64(1, 's'),
+            'food': foods.tolist(),
+            'grams': grams.tolist(),
+        }, columns={'user': 'user_id', 'timestamp': 'eaten_at'}), daily)
+        assert_totals_equal(logs.aggregate(
+            dict(log, timestamp=timestamps.astype(datetime.datetime))), daily)
+
+        # Rolling windows are the totals of each period and the ones before it
+        for window in [1, 3, 7]:
+            rolled = logs.rolling(daily, window)
+            self.assertEqual(rolled['window'], window)
+            self.assertTrue((rolled['period'] == daily['period']).all())
+
+            for i in range(0, len(daily['user']), 10):
+                end = daily['period'][i] + 1
+                nutrients, total_grams, count = totals_check(
+                    daily['user'][i], end - window, end)
+                self.assertTrue(np.allclose(rolled['nutrients'][i]._values, nutrients._values))
+                self.assertAlmostEqual(rolled['grams'][i], total_grams)
+                self.assertEqual(rolled['count'][i], count)
+
+        rolled_mean = logs.rolling(daily, 7, mean=True)
+        self.assertTrue(np.allclose(
+            rolled_mean['nutrients']._values, logs.rolling(daily, 7)['nutrients']._values / 7))
+
+        # Foods that are not in the database
+        log_unknown = dict(log, food=np.where(np.arange(num_rows) % 10 == 0, 'Nope', foods))
+
+        with self.assertRaisesRegex(ValueError, r"Did not find exact name 'Nope'"):
+            logs.aggregate(log_unknown)
+
+        result = logs.aggregate(log_unknown, errors='ignore')
+        self.assertEqual(result['count'].sum(), num_rows - 100)
+
+        empty = logs.aggregate({'user': [], 'timestamp': [], 'food': [], 'grams': []})
+        self.assertEqual(len(empty['user']), 0)
+        self.assertEqual(empty['nutrients']._values.shape, (0, len(daily['nutrients']._values[0])))
+        self.assertEqual(len(logs.rolling(empty, 7)['user']), 0)
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'by' to be one of"):
+            logs.aggregate(log, by='year')
+
+        with self.assertRaisesRegex(ValueError, r"Expected the log to have a 'user' column"):
+            logs.aggregate({'timestamp': timestamps, 'food': foods, 'grams': grams})
+
+        with self.assertRaisesRegex(ValueError, r"Expected the columns of the log to have the same length"):
+            logs.aggregate(dict(log, grams=grams[:10]))
+
+        with self.assertRaisesRegex(ValueError, r"Expected the keys of 'columns'"):
+            logs.aggregate(log, columns={'amount': 'grams'})
+
+        with self.assertRaisesRegex(TypeError, r"Expected the timestamps of the log"):
+            logs.aggregate(dict(log, timestamp=['yesterday'] * num_rows))
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'window >= 1'"):
+            logs.rolling(daily, 0)
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'totals' to be sorted"):
+            logs.rolling(dict(daily, user=daily['user'][::-1]), 7)
+
+    def test_aio(self):
+        import asyncio
+        import concurrent.futures
+        import threading
+        from unittest import mock
+        from foodypy import aio
+
+        class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+            def __init__(self):
+                super().__init__(max_workers=1)
+                self.num_submitted = 0
+                self.release = threading.Event()
+
+            def submit(self, fn, *args, **kwargs):
+                self.num_submitted += 1
+
+                # Search terms are normalized right away, so that the calls
+                # that use them can be shared
+                def wait_and_call():
+                    if getattr(fn, 'func', None) is not recording_normalize:
+                        self.release.wait()
+
+                    return fn(*args, **kwargs)
+
+                return super().submit(wait_and_call)
+
+        normalize_threads = []
+        normalize = database._normalize_search_term
+
+        def recording_normalize(food_name):
+            normalize_threads.append(threading.current_thread())
+            return normalize(food_name)
+
+        search_check = foodypy.search('chicken breast', limit=3)
+        database._unload_database()
+        executor = CountingExecutor()
+        executor_thread = executor.submit(threading.current_thread)
+        executor.release.set()
+        executor_thread = executor_thread.result()
+        aio.set_executor(executor)
+
+        async def main():
+            await aio.load_database()
+            self.assertTrue(foodypy.database_status()['loaded'])
+
+            # Identical calls share the call that is already running
+            executor.num_submitted = 0
+            executor.release.clear()
+            calls = asyncio.gather(
+                aio.search('chicken breast', limit=3),
+                aio.search('  Chicken,  breast', limit=3),
+                aio.search('chicken breast', limit=2),
+                aio.get('Bananas, raw'),
+                aio.get('Bananas, raw'))
+
+            while executor.num_submitted < 5:
+                await asyncio.sleep(0.01)
+
+            await asyncio.sleep(0.05)
+            executor.release.set()
+            search_a, search_b, search_c, get_a, get_b = await calls
+
+            # Search terms are normalized on the executor, not the event loop
+            self.assertEqual(executor.num_submitted, 5)
+            self.assertEqual(set(normalize_threads), {executor_thread})
+            self.assertEqual(search_a, search_check)
+            self.assertEqual(search_b, search_check)
+            self.assertIsNot(search_a, search_b)
+            self.assertEqual(search_c, search_check[:2])
+            self.assertEqual(get_a, foodypy.get('Bananas, raw'))
+            self.assertIsNot(get_a, get_b)
+
+            with self.assertRaisesRegex(ValueError, r"Did not find exact name"):
+                await aio.get('not a food')
+
+            with self.assertRaisesRegex(RuntimeError, r"already installed"):
+                await aio.install_database()
+
+        try:
+            with mock.patch.object(database, '_normalize_search_term', recording_normalize):
+                asyncio.run(main())
+        finally:
+            aio.set_executor(None)
+            executor.shutdown()
+
+        with self.assertRaises(TypeError):
+            aio.set_executor(1)
+
+    def test_server(self):
+        import contextlib
+        import io
+        import socket
+        import threading
+        from unittest import mock
+        from foodypy import server as foodypy_server
+        from foodypy.client import Client
+
+        server = foodypy_server.make_server(port=0, max_request_size=1000)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+
+            with Client(url, pool_size=2) as client:
+                self.assertEqual(
+                    client.search('chicken breast', limit=3),
+                    foodypy.search('chicken breast', limit=3))
+                self.assertEqual(
+                    client.search('rice', limit=2, scorer='ratio', score_cutoff=10),
+                    foodypy.search('rice', limit=2, scorer='ratio', score_cutoff=10))
+                self.assertEqual(
+                    client.search_many(['peas', 'apple'], limit=2),
+                    foodypy.search_many(['peas', 'apple'], limit=2, workers=1))
+                self.assertEqual(client.get('Bananas, raw'), foodypy.get('Bananas, raw'))
+
+                names = _test_food_names[:3]
+                self.assertEqual(list(client.get_many(names)), list(foodypy.get_many(names)))
+                self.assertEqual(len(client.get_many([])), 0)
+
+                smoothie = foodypy.Recipe({'Bananas, raw': 100, 'Milk, whole, 3.25% milkfat': 200}, servings=2)
+                breakfast = foodypy.Recipe({smoothie: 1, 'Egg, whole, raw, fresh': 50})
+                self.assertEqual(
+                    list(client.evaluate_many([smoothie, breakfast], per_serving=True)),
+                    list(foodypy.Recipe.evaluate_many([smoothie, breakfast], per_serving=True)))
+
+                # The connection is kept open and reused
+                self.assertEqual(client._pool.qsize(), 1)
+                connection = client._pool.queue[0]
+                client.get('Bananas, raw')
+                self.assertIs(client._pool.queue[0], connection)
+
+                # Errors are raised in the client
+                with self.assertRaisesRegex(ValueError, r"Did not find exact name 'nope'"):
+                    client.get('nope')
+
+                with self.assertRaisesRegex(ValueError, r"Expected the request to have 'food_names'"):
+                    client._post('/get_many', {})
+
+                with self.assertRaisesRegex(TypeError, r"Expected 'scorer' to be the name"):
+                    client.search('rice', scorer=len)
+
+                with self.assertRaisesRegex(RuntimeError, r"Unknown path '/nope'"):
+                    client._post('/nope', {})
+
+                # Errors in the server are not described to the client
+                with mock.patch.dict(foodypy_server._routes, {'/get': lambda request: 1 / 0}):
+                    with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                        with self.assertRaisesRegex(RuntimeError, r"^Internal server error$"):
+                            client.get('Bananas, raw')
+
+                self.assertIn('ZeroDivisionError', stderr.getvalue())
+
+                # A connection that the server closed is replaced
+                client._pool.queue[0].sock.shutdown(socket.SHUT_RDWR)
+                self.assertEqual(client.get('Bananas, raw'), foodypy.get('Bananas, raw'))
+
+                # Requests that are too large are not read, and the server
+                # closes the connection
+                with self.assertRaisesRegex(ValueError, r"Expected the request to be at most 1000 bytes"):
+                    client.get_many(['Bananas, raw'] * 100)
+
+                self.assertEqual(client.get('Bananas, raw'), foodypy.get('Bananas, raw'))
+
+            # Requests with bad lengths get an error, and the connection is
+            # closed, since the server cannot tell where their bodies end
+            bad_headers = [
+                ('Content-Length: abc', 400),
+                ('Content-Length: -5', 400),
+                ('Content-Length: \u00b2', 400),
+                ('Content-Length: 1001', 413),
+                ('Transfer-Encoding: chunked', 411),
+            ]
+
+            for header, status in bad_headers:
+                with socket.create_connection(server.server_address) as sock:
+                    sock.sendall((
+                        'POST /get HTTP/1.1\r\n'
+                        f'{header}\r\n\r\n').encode('latin-1'))
+                    response = b''
+
+                    while chunk := sock.recv(4096):
+                        response += chunk
+
+                self.assertTrue(response.startswith(f'HTTP/1.1 {status} '.encode()), response)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'url' to be an http URL"):
+            Client('localhost:8642')
 
 class FoodyPyTestSuit(unittest.TestCase):
+    def test_import(self):
+        # Importing must not install the database or import heavy modules
+        with tempfile.TemporaryDirectory() as home:
+            env = dict(os.environ, HOME=home)
+            code = (
+                'import sys, foodypy; '
+                'print(sorted({"requests", "fuzzywuzzy", "numpy"} & set(sys.modules)))')
+            res = subprocess.run(
+                [sys.executable, '-c', code],
+                env=env, capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            self.assertEqual(res.stdout.strip(), '[]')
+            self.assertEqual(os.listdir(home), [])
+
     def test_Nutrients_properties(self):
         n = foodypy.Nutrients(8, 7, 6, 5)
         self.assertEqual(n.fat, 8)
@@ -18,6 +2007,43 @@ class FoodyPyTestSuit(unittest.TestCase):
             with self.assertRaisesRegex(ValueError, rf"Expected '{nutrient} >= 0'"):
                 foodypy.Nutrients(**{nutrient: -1})
 
+    def test_Nutrients_fields(self):
+        from foodypy.nutrients import _field_names
+
+        self.assertEqual(_field_names[:4], ('fat', 'carbs', 'protein', 'fiber'))
+        self.assertGreater(len(_field_names), 30)
+
+        for field_idx, field in enumerate(_field_names):
+            n = foodypy.Nutrients(**{field: field_idx + 1})
+
+            for other_field in _field_names:
+                self.assertEqual(getattr(n, other_field), field_idx + 1 if other_field == field else 0)
+
+            self.assertEqual((n + n) * 2, foodypy.Nutrients(**{field: 4 * (field_idx + 1)}))
+
+            with self.assertRaisesRegex(TypeError, rf"Expected '{field}'"):
+                foodypy.Nutrients(**{field: 'bad'})
+
+            with self.assertRaisesRegex(ValueError, rf"Expected '{field} >= 0'"):
+                foodypy.Nutrients(**{field: -1})
+
+            with self.assertRaisesRegex(ValueError, rf"Expected '{field} >= 0'"):
+                n - foodypy.Nutrients(**{field: field_idx + 2})
+
+        with self.assertRaisesRegex(TypeError, r"Unknown nutrient field 'sugar'"):
+            foodypy.Nutrients(sugar=1)
+
+        with self.assertRaises(AttributeError):
+            foodypy.Nutrients().other = 1
+
+        n = foodypy.Nutrients(1, 2, 3, 4, sodium=5)
+        self.assertEqual(
+            str(n),
+            'Nutrients(fat=1.0, carbs=2.0, protein=3.0, calories=29.0, fiber=4.0, sodium=5.0)')
+        self.assertEqual(
+            str(foodypy.Nutrients()),
+            'Nutrients(fat=0.0, carbs=0.0, protein=0.0, calories=0.0, fiber=0.0)')
+
     def test_Nutrients_add(self):
         test_cases = [
             # a, b, res_check
@@ -140,5 +2166,181 @@ class FoodyPyTestSuit(unittest.TestCase):
             res = a / b
             self.assertEqual(res, res_check)
 
+        # Fields that are 0 in both operands give 0
+        self.assertEqual(
+            foodypy.Nutrients(2, 0, 0, 0, sodium=3) / foodypy.Nutrients(4, 1, 0, 0, sodium=2),
+            foodypy.Nutrients(0.5, 0, 0, 0, sodium=1.5))
+
+        with self.assertRaises(ZeroDivisionError):
+            foodypy.Nutrients(1, 1, 1, 1) / foodypy.Nutrients(1, 1, 1, 0)
+
+        with self.assertRaises(ZeroDivisionError):
+            foodypy.Nutrients(1, 1, 1, 1) / 0
+
+        with self.assertRaises(ZeroDivisionError):
+            foodypy.NutrientsArray([foodypy.Nutrients(1)]) / [0]
+
+    def test_Nutrients_inplace(self):
+        a = foodypy.Nutrients(1, 2, 3, 4, sodium=5)
+        a_ref = a
+        a += foodypy.Nutrients(1, 1, 1, 1)
+        self.assertIs(a, a_ref)
+        self.assertEqual(a, foodypy.Nutrients(2, 3, 4, 5, sodium=5))
+
+        a *= 2
+        self.assertIs(a, a_ref)
+        self.assertEqual(a, foodypy.Nutrients(4, 6, 8, 10, sodium=10))
+
+        a *= foodypy.Nutrients(1, 1, 1, 1)
+        self.assertEqual(a, foodypy.Nutrients(4, 6, 8, 10))
+
+        # A result with negative values raises and leaves the object unchanged
+        with self.assertRaises(ValueError):
+            a += -5
+        with self.assertRaises(ValueError):
+            a *= -1
+        self.assertEqual(a, foodypy.Nutrients(4, 6, 8, 10))
+
+        with self.assertRaises(TypeError):
+            a += 'a'
+
+        # Adding a NutrientsArray gives a new NutrientsArray
+        b = foodypy.Nutrients(1)
+        b += foodypy.NutrientsArray([foodypy.Nutrients(1), foodypy.Nutrients(2)])
+        self.assertIsInstance(b, foodypy.NutrientsArray)
+        self.assertEqual(b.fat.tolist(), [2, 3])
+
+    def test_Nutrients_sum(self):
+        nutrients = [foodypy.Nutrients(**_test_amounts(i)) for i in range(5)]
+        weights = [0.5, 2, 0, 1, 3]
+
+        self.assertEqual(foodypy.Nutrients.sum(nutrients), sum(nutrients))
+        self.assertEqual(foodypy.Nutrients.sum(iter(nutrients)), sum(nutrients))
+
+        res = foodypy.Nutrients.sum(nutrients, weights)
+        res_check = sum(n * w for n, w in zip(nutrients, weights))
+        for field in ['fat', 'carbs', 'protein', 'fiber']:
+            self.assertAlmostEqual(getattr(res, field), getattr(res_check, field))
+
+        self.assertEqual(foodypy.Nutrients.sum([]), foodypy.Nutrients())
+        self.assertEqual(foodypy.Nutrients.sum([], []), foodypy.Nutrients())
+
+        with self.assertRaises(TypeError):
+            foodypy.Nutrients.sum([foodypy.Nutrients(), 1])
+
+        with self.assertRaises(TypeError):
+            foodypy.Nutrients.sum(nutrients, ['a'] * 5)
+
+        with self.assertRaises(ValueError):
+            foodypy.Nutrients.sum(nutrients, weights[:-1])
+
+        with self.assertRaises(ValueError):
+            foodypy.Nutrients.sum(nutrients, [-1] * 5)
+
+    def test_NutrientsArray(self):
+        a = foodypy.Nutrients(1, 2, 3, 4)
+        b = foodypy.Nutrients(5, 6, 7, 8)
+        arr = foodypy.NutrientsArray([a, b])
+        self.assertEqual(arr.shape, (2,))
+        self.assertEqual(len(arr), 2)
+        self.assertEqual(arr[0], a)
+        self.assertEqual(arr[-1], b)
+        self.assertEqual(list(arr), [a, b])
+        self.assertEqual(arr.fat.tolist(), [1, 5])
+        self.assertEqual(arr.carbs.tolist(), [2, 6])
+        self.assertEqual(arr.protein.tolist(), [3, 7])
+        self.assertEqual(arr.fiber.tolist(), [4, 8])
+        self.assertEqual(arr.calories.tolist(), [a.calories, b.calories])
+
+        arr2 = foodypy.NutrientsArray([_nutrient_values(1, 2, 3, 4), _nutrient_values(5, 6, 7, 8)])
+        self.assertEqual(list(arr2), list(arr))
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'values' to have shape"):
+            foodypy.NutrientsArray([1, 2, 3])
+
+        with self.assertRaisesRegex(TypeError, r"Expected 'values' to be numbers"):
+            foodypy.NutrientsArray([['a'] * len(_nutrient_values())])
+
+        for field_idx, nutrient in enumerate(['fat', 'carbs', 'protein', 'fiber']):
+            values = [_nutrient_values(), _nutrient_values()]
+            values[1][field_idx] = -1
+
+            with self.assertRaisesRegex(ValueError, rf"Expected '{nutrient} >= 0' but got -1"):
+                foodypy.NutrientsArray(values)
+
+    def test_NutrientsArray_arithmetic(self):
+        nutrients_list = [
+            foodypy.Nutrients(1, 2, 3, 4),
+            foodypy.Nutrients(5, 6, 7, 8),
+            foodypy.Nutrients(9, 10, 11, 12),
+        ]
+        arr = foodypy.NutrientsArray(nutrients_list)
+        n = foodypy.Nutrients(1, 1, 1, 1)
+        weights = [2, 3, 4]
+
+        test_cases = [
+            # res, res_check
+            (arr + arr, [x + x for x in nutrients_list]),
+            (arr + n, [x + n for x in nutrients_list]),
+            (n + arr, [n + x for x in nutrients_list]),
+            (arr + 2, [x + 2 for x in nutrients_list]),
+            (2 + arr, [x + 2 for x in nutrients_list]),
+            (arr - n, [x - n for x in nutrients_list]),
+            (arr * arr, [x * x for x in nutrients_list]),
+            (arr * n, [x * n for x in nutrients_list]),
+            (arr * 0.5, [x * 0.5 for x in nutrients_list]),
+            (0.5 * arr, [x * 0.5 for x in nutrients_list]),
+            (arr * weights, [x * w for x, w in zip(nutrients_list, weights)]),
+            (weights * arr, [x * w for x, w in zip(nutrients_list, weights)]),
+            (arr / 2, [x / 2 for x in nutrients_list]),
+            (arr / arr, [x / x for x in nutrients_list]),
+            (arr / weights, [x / w for x, w in zip(nutrients_list, weights)]),
+        ]
+
+        for res, res_check in test_cases:
+            self.assertIsInstance(res, foodypy.NutrientsArray)
+            self.assertEqual(list(res), res_check)
+
+        self.assertEqual(list(arr + 0 * arr - arr), [foodypy.Nutrients()] * 3)
+        self.assertEqual(list(100 - arr), [100 - x for x in nutrients_list])
+        self.assertEqual(list(100 - arr)[0].fat, 99)
+
+        with self.assertRaisesRegex(ValueError, r"Expected 'fat >= 0'"):
+            arr - 2
+
+        # Weighted sums
+        res = weights @ arr
+        self.assertIsInstance(res, foodypy.Nutrients)
+        self.assertEqual(res, 2 * nutrients_list[0] + 3 * nutrients_list[1] + 4 * nutrients_list[2])
+
+        res = [weights, [1, 0, 0]] @ arr
+        self.assertEqual(list(res), [
+            2 * nutrients_list[0] + 3 * nutrients_list[1] + 4 * nutrients_list[2],
+            nutrients_list[0],
+        ])
+
+    def test_NutrientsArray_sum(self):
+        arr = foodypy.NutrientsArray([
+            [_nutrient_values(1, 2, 3, 4), _nutrient_values(5, 6, 7, 8)],
+            [_nutrient_values(9, 10, 11, 12), _nutrient_values(13, 14, 15, 16)],
+            [_nutrient_values(17, 18, 19, 20), _nutrient_values(21, 22, 23, 24)],
+        ])
+        self.assertEqual(arr.shape, (3, 2))
+        self.assertEqual(arr[1, 0], foodypy.Nutrients(9, 10, 11, 12))
+        self.assertEqual(arr.sum(), foodypy.Nutrients(66, 72, 78, 84))
+        self.assertEqual(arr.sum(axis=(0, 1)), foodypy.Nutrients(66, 72, 78, 84))
+        self.assertEqual(list(arr.sum(axis=0)), [
+            foodypy.Nutrients(27, 30, 33, 36),
+            foodypy.Nutrients(39, 42, 45, 48),
+        ])
+        self.assertEqual(list(arr.sum(axis=-1)), [
+            foodypy.Nutrients(6, 8, 10, 12),
+            foodypy.Nutrients(22, 24, 26, 28),
+            foodypy.Nutrients(38, 40, 42, 44),
+        ])
+
+        with self.assertRaises(IndexError):
+            arr.sum(axis=2)
+
 if __name__ == '__main__':
     unittest.main()